@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+import math
+import os
+import random
+from rsync_backup.job import Job, JobTemplate
+from rsync_backup.manager import Manager
+from rsync_backup.planner import DestinationPlanner
+from rsync_backup.scheduler import DEFAULT_THROUGHPUT, Scheduler
+from rsync_backup.scheduler import simulate_makespan
+import shutil
+from timeit import default_timer as timer
+
+
+LOG = logging.getLogger(__name__)
+
+FIXED = 'fixed'
+UNIFORM = 'uniform'
+LOGNORMAL = 'lognormal'
+
+DISTRIBUTIONS = (FIXED, UNIFORM, LOGNORMAL)
+
+# File data is cut from this much random data.
+DATA_SIZE = 1024 * 1024
+
+
+class TreeSpec(object):
+    def __init__(self, depth=3, fanout=8, files=8, size=4096,
+                 distribution=LOGNORMAL, skew=0.0, seed=0):
+        self.depth = depth
+        self.fanout = fanout
+        # Files in each directory before the skew is applied.
+        self.files = files
+        # Mean file size in bytes.
+        self.size = size
+        self.distribution = distribution
+        # Zero gives a even tree, higher values puts more of the files
+        # in the first subdirectories on every level.
+        self.skew = skew
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+def file_size(rnd, spec):
+    if spec.distribution == FIXED:
+        return spec.size
+
+    if spec.distribution == UNIFORM:
+        return rnd.randint(0, 2 * spec.size)
+
+    # The median is chosen so that the mean is size.
+    sigma = 1.5
+    mu = math.log(max(spec.size, 1)) - sigma * sigma / 2
+    return min(int(rnd.lognormvariate(mu, sigma)), 100 * spec.size)
+
+
+def skew_weights(fanout, skew):
+    weights = [(i + 1) ** -skew for i in range(fanout)]
+    total = sum(weights)
+    return [w * fanout / total for w in weights]
+
+
+def generate_tree(path, spec):
+    """Creates a reproducible tree, same spec gives the same tree.
+
+    Returns the amount of directories, files and bytes created.
+    """
+
+    rnd = random.Random(spec.seed)
+    data = rnd.getrandbits(8 * DATA_SIZE).to_bytes(DATA_SIZE, 'little')
+    weights = skew_weights(spec.fanout, spec.skew)
+
+    counts = {'dirs': 0, 'files': 0, 'bytes': 0}
+    level = [(path, 1.0)]
+
+    for depth in range(spec.depth + 1):
+        new_level = []
+
+        for dirpath, weight in level:
+            os.makedirs(dirpath)
+            counts['dirs'] += 1
+
+            for i in range(int(round(spec.files * weight))):
+                size = file_size(rnd, spec)
+
+                with open(os.path.join(dirpath, 'f%i' % i), 'wb') as f:
+                    remaining = size
+
+                    while remaining > 0:
+                        offset = rnd.randint(0, DATA_SIZE - 1)
+                        chunk = data[offset:offset + remaining]
+                        f.write(chunk)
+                        remaining -= len(chunk)
+
+                counts['files'] += 1
+                counts['bytes'] += size
+
+            if depth == spec.depth:
+                continue
+
+            for i in range(spec.fanout):
+                new_level.append((os.path.join(dirpath, 'd%i' % i),
+                                  weight * weights[i]))
+
+        level = new_level
+
+    return counts
+
+
+def job_config(source, destination, steps):
+    return {
+        'source': {'path': source},
+        'destination': {'path': destination},
+        'exclusions': [],
+        'options': ['-a'],
+        'steps': steps,
+    }
+
+
+def bench_explode(source, steps, scan_threads):
+    mgr = Manager('rsync', scan_threads=scan_threads)
+    mgr.queue_jobs({'jobs': [job_config(source, '/nonexistent', steps)]})
+
+    start = timer()
+    jobs = mgr.explode()
+
+    return {
+        'jobs': len(jobs),
+        'seconds': timer() - start,
+        'scan_seconds': mgr.walker.scan_seconds,
+        'scanned': mgr.walker.scanned,
+    }, jobs
+
+
+def bench_jobs(source, destination, relpaths, scan_threads):
+    template = JobTemplate('rsync', job_config(source, destination, 0))
+
+    start = timer()
+    jobs = [Job(template, relpath=r) for r in relpaths]
+    commands = [job.command for job in jobs]
+
+    construct = timer() - start
+
+    planner = DestinationPlanner(scan_threads)
+    planner.prepare(jobs)
+
+    return {
+        'jobs': len(commands),
+        'construct_seconds': construct,
+        'prepare_seconds': planner.prepare_seconds,
+        'created': planner.created,
+    }
+
+
+def bench_schedule(jobs, workers_list):
+    scheduler = Scheduler()
+
+    start = timer()
+    durations = [scheduler.expected_seconds(job) for job in jobs]
+    estimate = timer() - start
+
+    ordered = sorted(durations, reverse=True)
+
+    results = {}
+
+    for workers in workers_list:
+        results[str(workers)] = {
+            'unordered_makespan': simulate_makespan(durations, workers),
+            'ordered_makespan': simulate_makespan(ordered, workers),
+            'lower_bound': max(sum(durations) / workers,
+                               max(durations or [0])),
+        }
+
+    return {
+        'throughput': DEFAULT_THROUGHPUT,
+        'estimate_seconds': estimate,
+        'workers': results,
+    }
+
+
+def bench_run(rsync_path, source, destination, steps, workers, nbytes):
+    mgr = Manager(rsync_path, workers)
+    mgr.queue_jobs({'jobs': [job_config(source, destination, steps)]})
+
+    start = timer()
+    mgr.wait()
+    seconds = timer() - start
+
+    failed = 0
+
+    for child in mgr.supervisor.children.values():
+        if not child.successful() or child.get().returncode != 0:
+            failed += 1
+
+    return {
+        'seconds': seconds,
+        'jobs': len(mgr.supervisor.children),
+        'failed': failed,
+        'bytes_per_second': nbytes / seconds if seconds > 0 else None,
+    }
+
+
+def run_benchmarks(workdir, spec, steps=2, workers_list=(1, 2, 4, 8),
+                   scan_threads=8, rsync_path=None):
+    source = os.path.join(workdir, 'source')
+
+    results = {'tree': spec.to_dict(), 'steps': steps}
+
+    start = timer()
+    counts = generate_tree(source, spec)
+    LOG.info('generated %i dirs and %i files (%i bytes) in %.2f secs' % (
+             counts['dirs'], counts['files'], counts['bytes'],
+             timer() - start))
+    results['generated'] = counts
+
+    results['explode'], jobs = bench_explode(source, steps, scan_threads)
+
+    destination = os.path.join(workdir, 'prepare')
+    os.mkdir(destination)
+    results['jobs'] = bench_jobs(source, destination,
+                                 [j.relpath for j in jobs], scan_threads)
+    shutil.rmtree(destination)
+
+    results['schedule'] = bench_schedule(jobs, workers_list)
+
+    if rsync_path is None:
+        LOG.warning('no rsync given, skipping end to end runs')
+        return results
+
+    results['run'] = {}
+
+    for workers in workers_list:
+        destination = os.path.join(workdir, 'run-%i' % workers)
+        os.mkdir(destination)
+
+        LOG.info('running rsync with %i workers' % workers)
+        results['run'][str(workers)] = bench_run(
+            rsync_path, source, destination, steps, workers,
+            counts['bytes'])
+
+        shutil.rmtree(destination)
+
+    return results
+
+
+def flatten(results, prefix=''):
+    values = {}
+
+    for key, value in results.items():
+        name = prefix + key
+
+        if isinstance(value, dict):
+            values.update(flatten(value, name + '.'))
+            continue
+
+        if isinstance(value, bool):
+            continue
+
+        if isinstance(value, (int, float)):
+            values[name] = value
+
+    return values
+
+
+def compare(baseline, current):
+    # Returns (name, baseline, current, percent change) for every
+    # number found in both results.
+    old = flatten(baseline)
+    new = flatten(current)
+
+    for name in list(old):
+        if name.startswith('meta.'):
+            del old[name]
+
+    changes = []
+
+    for name in sorted(set(old) & set(new)):
+        change = None
+
+        if old[name]:
+            change = (new[name] - old[name]) * 100.0 / old[name]
+
+        changes.append((name, old[name], new[name], change))
+
+    return changes
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import json
+import logging
+import os
+import platform
+from rsync_backup import benchmark
+from rsync_backup.utils import which
+import shutil
+import six
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def get_commit():
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(benchmark.__file__)))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return output.decode().strip()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='rsync-backup benchmark')
+
+    parser.add_argument('--depth', type=int, default=3,
+                        help='depth of the generated tree')
+    parser.add_argument('--fanout', type=int, default=8,
+                        help='subdirectories in every directory')
+    parser.add_argument('--files', type=int, default=8,
+                        help='files in every directory')
+    parser.add_argument('--size', type=int, default=4096,
+                        help='mean file size in bytes')
+    parser.add_argument('--distribution', choices=benchmark.DISTRIBUTIONS,
+                        default=benchmark.LOGNORMAL,
+                        help='distribution of the file sizes')
+    parser.add_argument('--skew', type=float, default=0.0,
+                        help='put more files in the first subdirectories, '
+                        'zero gives a even tree')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for generating the tree')
+    parser.add_argument('--steps', type=int, default=2,
+                        help='steps to explode the tree with')
+    parser.add_argument('-w', '--workers', type=int, nargs='+',
+                        default=[1, 2, 4, 8],
+                        help='amounts of workers to measure')
+    parser.add_argument('--scan-threads', type=int, default=8,
+                        help='threads used to scan directories')
+    parser.add_argument('--no-rsync', action='store_true',
+                        help='skip the end to end runs with rsync')
+    parser.add_argument('--workdir', type=six.text_type,
+                        help='directory to generate the tree in, must not '
+                        'exist and is removed afterwards')
+    parser.add_argument('-o', '--output', type=six.text_type,
+                        help='write the results as json to this file')
+    parser.add_argument('--compare', type=six.text_type,
+                        help='compare with results from an earlier run')
+    parser.add_argument('-d', '--debug', action='store_true',
+                        help='enable debug output')
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
+                        level=logging.DEBUG if args.debug else logging.WARNING)
+
+    rsync_path = None
+
+    if not args.no_rsync:
+        rsync_path = which('rsync')
+
+        if rsync_path is None:
+            sys.stderr.write('could not find rsync, end to end runs is '
+                             'skipped\n')
+
+    spec = benchmark.TreeSpec(depth=args.depth, fanout=args.fanout,
+                              files=args.files, size=args.size,
+                              distribution=args.distribution,
+                              skew=args.skew, seed=args.seed)
+
+    workdir = args.workdir
+
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='rsync-backup-bench')
+    else:
+        os.makedirs(workdir)
+
+    try:
+        results = benchmark.run_benchmarks(
+            workdir, spec, steps=args.steps, workers_list=args.workers,
+            scan_threads=args.scan_threads, rsync_path=rsync_path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results['meta'] = {
+        'commit': get_commit(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+    }
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare is None:
+        return
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+
+    print('%-50s %14s %14s %9s' % ('metric', 'baseline', 'current',
+                                   'change'))
+
+    for name, old, new, change in benchmark.compare(baseline, results):
+        change_str = '-' if change is None else '%+.1f%%' % change
+        print('%-50s %14.4g %14.4g %9s' % (name, old, new, change_str))
@@ -16,13 +16,33 @@
 
 import argparse
 import logging
+from rsync_backup.cmd import benchmark as benchmark_cmd
+from rsync_backup.cmd.estimate import print_report
+from rsync_backup.cmd import history as history_cmd
+from rsync_backup.cmd import status as status_cmd
 from rsync_backup.config import load_config
+from rsync_backup.estimate import Estimator, get_throughputs
+from rsync_backup.history import HISTORY_FILE, JobRecord, RunHistory
+from rsync_backup.journal import JOURNAL_FILE, Journal
 from rsync_backup.manager import Manager
+from rsync_backup.manifest import MANIFEST_FILE, Manifest
+from rsync_backup.metrics import MetricsExporter
+from rsync_backup.preflight import DEFAULT_TIMEOUT, preflight
+from rsync_backup.scheduler import DurationHistory
+from rsync_backup.status import StatusServer, get_socket_path
+from rsync_backup.supervisor import KILLED
+from rsync_backup.throttle import Throttle
+from rsync_backup.tuner import DEFAULT_INTERVAL, DEFAULT_MAX_IOWAIT
+from rsync_backup.tuner import DEFAULT_MAX_LOAD, SAMPLE_INTERVAL
+from rsync_backup.tuner import WorkerTuner
 from rsync_backup.utils import which
+from rsync_backup.walker import DEFAULT_THREADS
+from rsync_backup.watch import DEFAULT_DEBOUNCE, Watcher
 import os
 import random
 import six
 import sys
+import time
 from timeit import default_timer as timer
 
 
@@ -30,6 +50,102 @@ LOG = logging.getLogger(__name__)
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
+    backup(sys.argv[1:])
+
+
+def setup_logging(debug, logfile):
+    if debug:
+        loglevel = logging.DEBUG
+    else:
+        loglevel = logging.INFO
+
+    if logfile is not None:
+        logfile = os.path.expanduser(logfile)
+
+    run_id = int(random.getrandbits(32))
+
+    log_format = '%(asctime)s %(levelname)s {} %(message)s'.format(run_id)
+    logging.basicConfig(format=log_format, level=loglevel, filename=logfile)
+
+    return run_id
+
+
+def get_rsync_path():
+    rsync_path = which('rsync')
+
+    if rsync_path is None:
+        LOG.error('could not find rsync executable anywhere')
+        sys.exit(1)
+
+    return rsync_path
+
+
+def get_throttle(config, bandwidth_limit=None):
+    if bandwidth_limit is None:
+        bandwidth_limit = config.get('bandwidth_limit', None)
+
+    if bandwidth_limit is not None:
+        LOG.info('sharing a bandwidth limit of %i KiB/s between all '
+                 'workers' % bandwidth_limit)
+
+    return Throttle(bandwidth_limit,
+                    ionice_class=config.get('ionice_class', None),
+                    ionice_level=config.get('ionice_level', None),
+                    nice=config.get('nice', None))
+
+
+def get_tuner(autotune, supervisor, workers):
+    max_workers = autotune.get('max_workers', workers)
+    min_workers = min(autotune.get('min_workers', 1), max_workers)
+
+    tuner = WorkerTuner(supervisor, min_workers=min_workers,
+                        max_workers=max_workers,
+                        max_iowait=autotune.get('max_iowait',
+                                                DEFAULT_MAX_IOWAIT),
+                        max_load=autotune.get('max_load', DEFAULT_MAX_LOAD))
+
+    # Starts at the floor and is raised while running.
+    supervisor.resize(min_workers)
+    supervisor.every(autotune.get('interval', DEFAULT_INTERVAL),
+                     tuner.adjust)
+    supervisor.every(SAMPLE_INTERVAL, tuner.sample)
+
+    LOG.info('tuning workers between %i and %i' % (
+             min_workers, max_workers))
+
+    return tuner
+
+
+def create_state_dir(state_dir):
+    try:
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+    except OSError as exc:
+        LOG.error('failed to create state dir %s: %s' % (
+                  state_dir, six.text_type(exc)))
+        sys.exit(1)
+
+
+def check_jobs(config):
+    # Jobs with a unhealthy source or destination is left out so the
+    # other jobs can still run.
+    jobs = config['jobs']
+    timeout = config.get('preflight_timeout', DEFAULT_TIMEOUT)
+
+    config['jobs'], skipped = preflight(jobs, timeout)
+
+    if skipped:
+        LOG.error('skipping %i of %i jobs that failed the preflight '
+                  'checks' % (len(skipped), len(jobs)))
+
+    return skipped
+
+
+def backup(argv):
     parser = argparse.ArgumentParser()
 
     parser.add_argument('-c', '--config', type=str, required=True,
@@ -45,39 +161,46 @@ def main():
                         'jobs that has the longest run time')
     parser.add_argument('-w', '--workers', type=int,
                         help='override amount of workers')
+    parser.add_argument('--scan-threads', type=int,
+                        help='override amount of threads used to scan '
+                        'directories when exploding jobs')
+    parser.add_argument('-s', '--state-dir', type=six.text_type,
+                        help='directory to keep state such as job '
+                        'durations between runs in')
+    parser.add_argument('--bwlimit', type=int,
+                        help='override the total bandwidth limit in KiB/s '
+                        'shared by all workers')
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help='only run jobs that did not complete in the '
+                        'last run if it was interrupted or failed')
+    parser.add_argument('-m', '--metrics-file', type=six.text_type,
+                        help='write prometheus metrics for the '
+                        'node_exporter textfile collector to this file')
+    parser.add_argument('-f', '--full', action='store_true',
+                        help='run every job even if the manifest says '
+                        'its source is unchanged')
+    parser.add_argument('-e', '--estimate', action='store_true',
+                        help='run every job with rsync --dry-run and '
+                        'print how much would be transferred and how '
+                        'long it would take')
     parser.add_argument('-a', '--allowed-returncodes',
                         type=int, nargs='+',
                         help=('allowed return codes, separate by '
                               'spaces for multiple'))
 
-    args = parser.parse_args()
-
-    if args.debug:
-        loglevel = logging.DEBUG
-    else:
-        loglevel = logging.INFO
-
-    logfile = None
-
-    if args.logfile is not None:
-        logfile = os.path.expanduser(args.logfile)
+    args = parser.parse_args(argv)
 
     start = timer()
-    run_id = int(random.getrandbits(32))
-
-    log_format = '%(asctime)s %(levelname)s {} %(message)s'.format(run_id)
-    logging.basicConfig(format=log_format, level=loglevel, filename=logfile)
+    started = time.time()
+    run_id = setup_logging(args.debug, args.logfile)
 
     LOG.info('starting rsync-backup')
 
-    rsync_path = which('rsync')
-
-    if rsync_path is None:
-        LOG.error('could not find rsync executable anywhere')
-        sys.exit(1)
+    rsync_path = get_rsync_path()
 
     LOG.debug('loading configuration file %s' % (args.config))
     config = load_config(args.config)
+    unhealthy = check_jobs(config)
 
     workers = config['workers']
 
@@ -98,35 +221,169 @@ def main():
     LOG.debug('allowed return codes is: %s' % (
               six.text_type(allowed_returncodes)))
 
-    mgr = Manager(rsync_path, workers)
+    state_dir = config.get('state_dir', None)
+
+    if args.state_dir is not None:
+        state_dir = os.path.expanduser(args.state_dir)
+
+    history = None
+    run_history = None
+    manifest = None
+    journal = None
+    manifest_config = config.get('manifest', None)
+
+    if args.resume and state_dir is None:
+        LOG.error('resuming requires a state dir')
+        sys.exit(1)
+
+    if state_dir is not None:
+        create_state_dir(state_dir)
+
+        if not args.noop and not args.estimate:
+            try:
+                journal = Journal(os.path.join(state_dir, JOURNAL_FILE),
+                                  resume=args.resume)
+            except (IOError, OSError) as exc:
+                LOG.error('failed to open journal: %s' % (
+                          six.text_type(exc)))
+                sys.exit(1)
+
+        history = DurationHistory(os.path.join(state_dir, 'timings.json'))
+
+        try:
+            run_history = RunHistory(os.path.join(state_dir, HISTORY_FILE))
+        except Exception as exc:
+            LOG.error('failed to open run history, this run will not '
+                      'be recorded: %s' % six.text_type(exc))
+
+        if manifest_config is not None:
+            manifest = Manifest(os.path.join(state_dir, MANIFEST_FILE),
+                                full_every=manifest_config.get(
+                                    'full_every', 0),
+                                force_full=args.full)
+
+            if manifest.full:
+                LOG.info('running a full pass, unchanged jobs will not '
+                         'be skipped')
+    else:
+        LOG.debug('no state dir given, job durations will not be saved')
+
+        if manifest_config is not None:
+            LOG.warning('manifest is disabled since there is no state dir')
+
+    scan_threads = config.get('scan_threads', DEFAULT_THREADS)
+
+    if args.scan_threads is not None:
+        scan_threads = args.scan_threads
+
+    throttle = get_throttle(config, args.bwlimit)
+
+    mgr = Manager(rsync_path, workers, history=history,
+                  scan_threads=scan_threads, manifest=manifest,
+                  throttle=throttle, journal=journal,
+                  allowed_returncodes=allowed_returncodes,
+                  override_returncodes=args.allowed_returncodes is not None)
     mgr.queue_jobs(config)
 
     if args.noop:
+        mgr.drain()
+        mgr.find_orphans(noop=True)
         LOG.info('exiting before changes now because of noop arg')
         sys.exit(0)
 
-    for j in mgr.queue:
-        j.prepare()
+    if args.estimate:
+        throughputs = None
+
+        if run_history is not None:
+            throughputs = get_throughputs(run_history)
+
+        estimator = Estimator(workers, throughputs=throughputs)
+        jobs = mgr.scheduler.order(mgr.explode())
+
+        LOG.info('estimating %i jobs with %i workers' % (
+                 len(jobs), workers))
+
+        print_report(estimator, estimator.run(jobs))
+        sys.exit(0)
+
+    metrics_file = config.get('metrics_file', None)
+
+    if args.metrics_file is not None:
+        metrics_file = os.path.expanduser(args.metrics_file)
+
+    exporter = None
+
+    if metrics_file is not None:
+        exporter = MetricsExporter(metrics_file, mgr)
+        metrics_interval = config.get('metrics_interval', 0)
+
+        if metrics_interval > 0:
+            mgr.supervisor.every(metrics_interval, exporter.progress)
+
+    autotune = config.get('autotune', None)
+    tuner = None
+
+    if autotune is not None and args.workers is not None:
+        LOG.info('not tuning workers since the amount of workers was '
+                 'given as argument')
+    elif autotune is not None:
+        tuner = get_tuner(autotune, mgr.supervisor, workers)
+
+    status_socket = get_socket_path(config, state_dir)
+
+    if status_socket is not None:
+        mgr.supervisor.serve(StatusServer(status_socket, mgr, run_id))
 
     jobs = mgr.run()
 
+    if journal is not None:
+        journal.start(run_id)
+
+    if exporter is not None:
+        exporter.begin()
+
     mgr.wait()
 
+    if tuner is not None:
+        LOG.info('changed the amount of workers %i times, ended with '
+                 '%i workers' % (tuner.adjustments,
+                                 mgr.supervisor.workers))
+
     toplist = {}
     return_value = 0
 
     success_count = 0
     failed_count = 0
 
+    killed_count = 0
+
+    retried_count = 0
+    retry_attempts = 0
+    retry_seconds = 0
+
+    records = []
+
     # now results
     for job_id in jobs:
         result = jobs[job_id]
         ready = result.ready()
+        job = result.job
+
+        if result.attempt > 1:
+            retried_count += 1
+            retry_attempts += result.attempt - 1
+            retry_seconds += result.lost
+
+            LOG.info('job %s ran %i times, %i secs was lost to '
+                     'failed attempts and waiting between them' % (
+                         job_id, result.attempt, result.lost))
 
         if ready is False:
             LOG.error('job %s was never completed due '
                       'to unknown error' % job_id)
 
+            records.append(JobRecord(job_id, job.source, job.destination,
+                                     None, False, 0, key=job.key))
             failed_count += 1
             return_value = 1
             continue
@@ -134,41 +391,100 @@ def main():
         success = result.successful()
 
         if success:
-            job_ret, job_secs = result.get()
+            job_result = result.get()
+            job_ret = job_result.returncode
+            job_secs = job_result.seconds
             job_mins = job_secs / 60
 
             log_method = LOG.info
             result_str = 'was successful'
+            job_success = True
 
-            if (allowed_returncodes is not None and job_ret not
-                    in allowed_returncodes):
+            if not mgr.allowed(job, job_ret):
                 log_method = LOG.error
                 result_str = 'failed'
+                job_success = False
                 failed_count += 1
             else:
                 toplist[job_id] = int(job_secs)
                 success_count += 1
+                mgr.scheduler.history.record(job.key, job_secs)
+
+                if manifest is not None:
+                    manifest.record(job)
+
+            records.append(JobRecord(job_id, job.source, job.destination,
+                                     job_ret, job_success, job_secs,
+                                     bytes=job_result.bytes_sent,
+                                     files=job_result.files_transferred,
+                                     key=job.key))
 
             log_method('job %s %s with return code: %i '
                        '(%i mins or %i secs)' %
                        (job_id, result_str, job_ret, job_mins,
                         job_secs))
+
+            if job_result.bytes_sent is not None:
+                LOG.debug('job %s transferred %s files, sent %i bytes '
+                          '(literal %s matched %s speedup %s)' %
+                          (job_id, job_result.files_transferred,
+                           job_result.bytes_sent, job_result.literal_data,
+                           job_result.matched_data, job_result.speedup))
         else:
             try:
-                job_ret, job_secs = result.get()
+                job_result = result.get()
+                job_ret = job_result.returncode
+                job_secs = job_result.seconds
             except Exception as exc:
                 job_ret = six.text_type(exc)
                 job_secs = 0
 
-            job_mins = job_secs / 60
+            if result.state == KILLED:
+                # Tells how long it was hung before being killed.
+                job_secs = result.elapsed
+                killed_count += 1
+
+                LOG.error('job %s %s -> %s was killed since it %s '
+                          '(%i mins or %i secs)' %
+                          (job_id, job.source, job.destination,
+                           result.killed, job_secs / 60, job_secs))
+            else:
+                job_mins = job_secs / 60
+
+                LOG.error('job %s was not completed due to '
+                          'error: %s (%i mins or %i secs)' %
+                          (job_id, job_ret, job_mins, job_secs))
 
-            LOG.error('job %s was not completed due to '
-                      'error: %s (%i mins or %i secs)' %
-                      (job_id, job_ret, job_mins, job_secs))
+            records.append(JobRecord(job_id, job.source, job.destination,
+                                     None, False, job_secs, key=job.key))
 
             return_value = 1
             failed_count += 1
 
+    if not mgr.supervisor.stopping:
+        remover = mgr.remove_orphans(mgr.find_orphans())
+
+        if remover.errors > 0:
+            LOG.error('failed to remove %i orphaned files or '
+                      'directories' % remover.errors)
+            return_value = 1
+
+    if mgr.scan_errors:
+        LOG.error('failed to scan %i directories, the jobs below them '
+                  'was not run' % len(mgr.scan_errors))
+        return_value = 1
+
+    if mgr.prepare_errors:
+        LOG.error('failed to prepare the destination of %i jobs, they '
+                  'was not run' % len(mgr.prepare_errors))
+        return_value = 1
+
+    if not mgr.finish_snapshots():
+        return_value = 1
+
+    if unhealthy:
+        return_value = 1
+
     if args.toplist is not None:
         count = 1
         for top in sorted(toplist, key=toplist.get, reverse=True):
@@ -180,6 +496,63 @@ def main():
                 break
             count += 1
 
+    if killed_count > 0:
+        LOG.error('killed %i hung jobs, check the mounts used by them' % (
+                  killed_count))
+
+    if retried_count > 0:
+        LOG.info('retried %i jobs %i times, %i mins (%i secs) was lost '
+                 'to retries' % (retried_count, retry_attempts,
+                                 retry_seconds / 60, retry_seconds))
+
+    try:
+        mgr.scheduler.history.save()
+    except Exception as exc:
+        LOG.error('failed to save job durations: %s' % (
+                  six.text_type(exc)))
+
+    if manifest is not None:
+        LOG.info('skipped %i unchanged jobs saving about %i mins '
+                 '(%i secs)' % (manifest.skipped,
+                                manifest.skipped_seconds / 60,
+                                manifest.skipped_seconds))
+
+        try:
+            manifest.save()
+        except Exception as exc:
+            LOG.error('failed to save manifest: %s' % (
+                      six.text_type(exc)))
+
+    finished = time.time()
+
+    if journal is not None:
+        if journal.skipped > 0:
+            LOG.info('skipped %i jobs that was completed in the last '
+                     'run' % journal.skipped)
+
+        try:
+            journal.finish(return_value, failed_count)
+        except Exception as exc:
+            LOG.error('failed to finish journal: %s' % (
+                      six.text_type(exc)))
+
+        journal.close()
+
+    if exporter is not None:
+        skipped = manifest.skipped if manifest is not None else 0
+        exporter.finish(records, started, finished, return_value,
+                        skipped=skipped)
+
+    if run_history is not None:
+        try:
+            run_history.record_run(run_id, started, finished, workers,
+                                   return_value, records)
+        except Exception as exc:
+            LOG.error('failed to record run history: %s' % (
+                      six.text_type(exc)))
+
+        run_history.close()
+
     total_secs = timer() - start
     total_mins = total_secs / 60
 
@@ -190,3 +563,116 @@ def main():
              return_value, total_mins, total_secs))
 
     sys.exit(return_value)
+
+
+def watch(argv):
+    parser = argparse.ArgumentParser(prog='rsync-backup watch')
+
+    parser.add_argument('-c', '--config', type=str, required=True,
+                        help='configuration file')
+    parser.add_argument('-d', '--debug', action='store_true',
+                        help='enable debug output')
+    parser.add_argument('-l', '--logfile', type=six.text_type,
+                        help='append output to a log file')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='override amount of workers')
+    parser.add_argument('--scan-threads', type=int,
+                        help='override amount of threads used to scan '
+                        'directories when exploding jobs')
+    parser.add_argument('-s', '--state-dir', type=six.text_type,
+                        help='directory to keep state such as job '
+                        'durations between runs in')
+    parser.add_argument('--bwlimit', type=int,
+                        help='override the total bandwidth limit in KiB/s '
+                        'shared by all workers')
+    parser.add_argument('--debounce', type=int, default=DEFAULT_DEBOUNCE,
+                        help='seconds without changes before a changed '
+                        'shard is run')
+    parser.add_argument('--sweep-interval', type=int, default=0,
+                        help='run every shard again with this interval '
+                        'in seconds, zero disables it')
+    parser.add_argument('--no-initial', action='store_true',
+                        help='do not run every shard when starting, only '
+                        'changes from now on is synced')
+    parser.add_argument('-a', '--allowed-returncodes',
+                        type=int, nargs='+',
+                        help=('allowed return codes, separate by '
+                              'spaces for multiple'))
+
+    args = parser.parse_args(argv)
+
+    setup_logging(args.debug, args.logfile)
+
+    LOG.info('starting rsync-backup in watch mode')
+
+    rsync_path = get_rsync_path()
+
+    LOG.debug('loading configuration file %s' % (args.config))
+    config = load_config(args.config)
+
+    for job in config['jobs']:
+        if 'snapshots' in job:
+            LOG.error('snapshots cannot be used in watch mode, %s uses '
+                      'them' % job['destination']['path'])
+            sys.exit(1)
+
+    check_jobs(config)
+
+    if not config['jobs']:
+        LOG.error('no jobs left to watch')
+        sys.exit(1)
+
+    workers = config['workers']
+
+    if args.workers is not None:
+        workers = args.workers
+
+    allowed_returncodes = config.get('allowed_returncodes', None)
+
+    if args.allowed_returncodes is not None:
+        allowed_returncodes = args.allowed_returncodes
+
+    state_dir = config.get('state_dir', None)
+
+    if args.state_dir is not None:
+        state_dir = os.path.expanduser(args.state_dir)
+
+    history = None
+
+    if state_dir is not None:
+        create_state_dir(state_dir)
+        history = DurationHistory(os.path.join(state_dir, 'timings.json'))
+
+    scan_threads = config.get('scan_threads', DEFAULT_THREADS)
+
+    if args.scan_threads is not None:
+        scan_threads = args.scan_threads
+
+    throttle = get_throttle(config, args.bwlimit)
+
+    mgr = Manager(rsync_path, workers, history=history,
+                  scan_threads=scan_threads, throttle=throttle,
+                  allowed_returncodes=allowed_returncodes,
+                  override_returncodes=args.allowed_returncodes is not None)
+    mgr.queue_jobs(config)
+
+    watcher = Watcher(mgr, debounce=args.debounce,
+                      sweep_interval=args.sweep_interval,
+                      initial=not args.no_initial)
+    watcher.run()
+
+    try:
+        mgr.scheduler.history.save()
+    except Exception as exc:
+        LOG.error('failed to save job durations: %s' % (
+                  six.text_type(exc)))
+
+    sys.exit(1 if watcher.failed > 0 else 0)
+
+
+COMMANDS = {
+    'benchmark': benchmark_cmd.main,
+    'history': history_cmd.main,
+    'status': status_cmd.main,
+    'watch': watch,
+}
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from rsync_backup.cmd.history import format_secs
+
+
+def format_bytes(value):
+    if value is None:
+        return '-'
+
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if value < 1024:
+            return '%.1f %s' % (value, unit)
+
+        value /= 1024.0
+
+    return '%.1f TiB' % value
+
+
+def print_report(estimator, estimates):
+    estimates = sorted(estimates, key=lambda e: e.seconds, reverse=True)
+
+    print('Jobs:')
+    print('  %10s %12s %10s %12s  %s' % (
+          'expected', 'transfer', 'files', 'rate', 'source -> destination'))
+
+    for estimate in estimates:
+        job = estimate.job
+        files = '-' if estimate.files is None else '%i' % estimate.files
+
+        print('  %10s %12s %10s %12s  %s -> %s' % (
+              format_secs(estimate.seconds), format_bytes(estimate.bytes),
+              files, format_bytes(estimate.throughput) + '/s',
+              job.source, job.destination))
+
+        if estimate.error is not None:
+            print('  %10s dry run failed: %s' % ('', estimate.error))
+
+    total_bytes = sum(e.bytes or 0 for e in estimates)
+    total_files = sum(e.files or 0 for e in estimates)
+    total_secs = sum(e.seconds for e in estimates)
+    failed = len([e for e in estimates if e.error is not None])
+
+    print('')
+    print('Would transfer %s in %i files with %i jobs, %s of work' % (
+          format_bytes(total_bytes), total_files, len(estimates),
+          format_secs(total_secs)))
+
+    if failed:
+        print('%i dry runs failed, their estimates is not complete' % (
+              failed))
+
+    if not estimates:
+        return
+
+    workers = estimator.workers
+    longest = estimates[0]
+
+    print('')
+    print('Expected run time:')
+
+    for count in (workers, workers * 2):
+        print('  %10s with %i workers' % (
+              format_secs(estimator.makespan(estimates, count)), count))
+
+    # No amount of workers makes the run shorter than its longest job.
+    print('  %10s longest job %s -> %s' % (
+          format_secs(longest.seconds), longest.job.source,
+          longest.job.destination))
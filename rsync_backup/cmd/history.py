@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import datetime
+from rsync_backup.config import load_config
+from rsync_backup.history import HISTORY_FILE, RunHistory
+import os
+import six
+import sys
+
+
+def format_secs(value):
+    if value is None:
+        return '-'
+
+    return '%im%02is' % (value // 60, value % 60)
+
+
+def format_rate(nbytes, secs):
+    if nbytes is None or not secs:
+        return '-'
+
+    return '%.1f MiB/s' % (nbytes / secs / 1024 / 1024)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='rsync-backup history')
+
+    parser.add_argument('-c', '--config', type=str,
+                        help='configuration file to read state_dir from')
+    parser.add_argument('-s', '--state-dir', type=six.text_type,
+                        help='directory with the run history')
+    parser.add_argument('-r', '--runs', type=int, default=30,
+                        help='amount of latest runs to look at')
+    parser.add_argument('-t', '--threshold', type=float, default=50,
+                        help='percent a job must be slower than its '
+                        'median to be reported as a regression')
+
+    args = parser.parse_args(argv)
+
+    state_dir = None
+
+    if args.state_dir is not None:
+        state_dir = os.path.expanduser(args.state_dir)
+    elif args.config is not None:
+        state_dir = load_config(args.config).get('state_dir', None)
+
+    if state_dir is None:
+        sys.stderr.write('a state dir must be given with --state-dir '
+                         'or through state_dir in --config\n')
+        sys.exit(1)
+
+    path = os.path.join(state_dir, HISTORY_FILE)
+
+    if not os.path.exists(path):
+        sys.stderr.write('no run history found at %s\n' % path)
+        sys.exit(1)
+
+    history = RunHistory(path)
+
+    print('Runs:')
+    print('  %-20s %8s %8s %8s %10s %14s' % (
+          'started', 'workers', 'jobs', 'failed', 'duration',
+          'throughput'))
+
+    for run in history.runs(args.runs):
+        started = datetime.datetime.fromtimestamp(run[2])
+        secs = run[3] - run[2]
+        print('  %-20s %8i %8i %8i %10s %14s' % (
+              started.strftime('%Y-%m-%d %H:%M:%S'), run[4], run[6],
+              run[8], format_secs(secs), format_rate(run[9], secs)))
+
+    print('')
+    print('Job durations:')
+    print('  %8s %8s %8s %6s  %s' % (
+          'p50', 'p95', 'latest', 'runs', 'source -> destination'))
+
+    for job in history.summary(args.runs):
+        print('  %8s %8s %8s %6i  %s' % (
+              format_secs(job['p50']), format_secs(job['p95']),
+              format_secs(job['latest']), job['runs'], job['key']))
+
+    regressions = history.regressions(args.runs, args.threshold)
+
+    print('')
+    print('Regressions (more than %i%% above median):' % args.threshold)
+
+    if not regressions:
+        print('  none')
+
+    for job in regressions:
+        increase = job['increase']
+        print('  %8s -> %8s %7s  %s' % (
+              format_secs(job['baseline']), format_secs(job['latest']),
+              '+%i%%' % increase if increase is not None else '-',
+              job['key']))
+
+    history.close()
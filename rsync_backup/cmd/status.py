@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+from rsync_backup.cmd.estimate import format_bytes
+from rsync_backup.cmd.history import format_secs
+from rsync_backup.config import load_config
+from rsync_backup.status import DEFAULT_TIMEOUT, get_socket_path, get_status
+from rsync_backup.supervisor import DONE, FAILED, QUEUED, RUNNING
+import json
+import os
+import six
+import sys
+
+
+def format_rate(value):
+    if value is None:
+        return '-'
+
+    return format_bytes(value) + '/s'
+
+
+def print_status(status):
+    jobs = status['jobs']
+    states = [QUEUED, RUNNING, DONE, FAILED]
+    states += sorted(s for s in jobs if s not in states)
+
+    print('Run %s with pid %i running for %s with %i workers%s' % (
+          status['run_id'], status['pid'], format_secs(status['elapsed']),
+          status['workers'], ', stopping' if status['stopping'] else ''))
+    print('Jobs: %s' % ', '.join(
+          '%i %s' % (jobs[s], s) for s in states if s in jobs))
+    print('Throughput: %s, transferred %s' % (
+          format_rate(status['throughput']),
+          format_bytes(status['transferred'])))
+
+    eta = format_secs(status['eta'])
+
+    if status['producing']:
+        eta = 'at least %s, still finding jobs' % eta
+
+    print('ETA: %s' % eta)
+
+    if status['running']:
+        print('')
+        print('Running:')
+        print('  %10s %12s %8s %12s  %s' % (
+              'elapsed', 'transfer', 'percent', 'rate',
+              'source -> destination'))
+
+    for job in status['running']:
+        percent = '-'
+
+        if job['percent'] is not None:
+            percent = '%i%%' % job['percent']
+
+        bundled = ''
+
+        if job['jobs'] > 1:
+            bundled = ' (%i jobs)' % job['jobs']
+
+        print('  %10s %12s %8s %12s  %s -> %s%s' % (
+              format_secs(job['elapsed']), format_bytes(job['bytes']),
+              percent, format_rate(job['rate']), job['source'],
+              job['destination'], bundled))
+
+    if status['failed']:
+        print('')
+        print('Failed:')
+
+    for job in status['failed']:
+        print('  %s %s -> %s %s: %s' % (
+              job['id'], job['source'], job['destination'], job['state'],
+              job['error']))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='rsync-backup status')
+
+    parser.add_argument('-c', '--config', type=str,
+                        help='configuration file to read state_dir and '
+                        'status_socket from')
+    parser.add_argument('-s', '--state-dir', type=six.text_type,
+                        help='state dir of the run')
+    parser.add_argument('-S', '--socket', type=six.text_type,
+                        help='status socket of the run')
+    parser.add_argument('-j', '--json', action='store_true',
+                        help='print the status as JSON')
+    parser.add_argument('-t', '--timeout', type=int,
+                        default=DEFAULT_TIMEOUT,
+                        help='seconds to wait for the run to answer')
+
+    args = parser.parse_args(argv)
+
+    config = {}
+    state_dir = None
+
+    if args.config is not None:
+        config = load_config(args.config)
+        state_dir = config.get('state_dir', None)
+
+    if args.state_dir is not None:
+        state_dir = os.path.expanduser(args.state_dir)
+
+    path = get_socket_path(config, state_dir)
+
+    if args.socket is not None:
+        path = os.path.expanduser(args.socket)
+
+    if path is None:
+        sys.stderr.write('a status socket must be given with --socket, '
+                         '--state-dir or through --config\n')
+        sys.exit(1)
+
+    try:
+        status = get_status(path, args.timeout)
+    except (IOError, OSError) as exc:
+        sys.stderr.write('no run is answering on %s: %s\n' % (
+                         path, six.text_type(exc)))
+        sys.exit(1)
+    except ValueError as exc:
+        sys.stderr.write('invalid status from %s: %s\n' % (
+                         path, six.text_type(exc)))
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(status, indent=2, sort_keys=True))
+        return
+
+    print_status(status)
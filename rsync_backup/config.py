@@ -24,6 +24,10 @@ from voluptuous import Schema, Invalid, Optional
 
 LOG = logging.getLogger(__name__)
 
+# Defaults for jobs with a retry policy.
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 10
+
 
 def validate_steps(value):
     if not isinstance(value, int):
@@ -35,6 +39,113 @@ def validate_steps(value):
     return value
 
 
+def validate_split(value):
+    if not isinstance(value, dict):
+        raise Invalid('split must be a dict')
+
+    limits = [k for k in ('target_shards', 'max_bytes', 'max_files')
+              if k in value]
+
+    if len(limits) != 1:
+        raise Invalid('split must contain exactly one of target_shards, '
+                      'max_bytes or max_files')
+
+    for key in value:
+        if key == 'by':
+            if value[key] not in ('bytes', 'files'):
+                raise Invalid('split by must be bytes or files')
+            continue
+
+        if key not in limits:
+            raise Invalid('unknown split option %s' % key)
+
+        if not isinstance(value[key], int) or value[key] <= 0:
+            raise Invalid('split %s must be a positive integer' % key)
+
+    return value
+
+
+def validate_bundle(value):
+    if not isinstance(value, dict):
+        raise Invalid('bundle must be a dict')
+
+    for key in value:
+        if key not in ('max_bytes', 'max_files', 'max_jobs'):
+            raise Invalid('unknown bundle option %s' % key)
+
+        if not isinstance(value[key], int) or value[key] <= 0:
+            raise Invalid('bundle %s must be a positive integer' % key)
+
+    return value
+
+
+def validate_retry(value):
+    if not isinstance(value, dict):
+        raise Invalid('retry must be a dict')
+
+    returncodes = value.get('returncodes', None)
+
+    if not isinstance(returncodes, list) or not returncodes:
+        raise Invalid('retry must contain a list of returncodes')
+
+    for val in returncodes:
+        if not isinstance(val, int):
+            raise Invalid('all retry returncodes must be integers')
+
+    for key in value:
+        if key not in ('returncodes', 'attempts', 'backoff'):
+            raise Invalid('unknown retry option %s' % key)
+
+    attempts = value.get('attempts', RETRY_ATTEMPTS)
+
+    if not isinstance(attempts, int) or attempts <= 0:
+        raise Invalid('retry attempts must be a positive integer')
+
+    backoff = value.get('backoff', RETRY_BACKOFF)
+
+    if not isinstance(backoff, (int, float)) or backoff < 0:
+        raise Invalid('retry backoff must be zero or above')
+
+    return value
+
+
+def validate_timeout(value):
+    if not isinstance(value, (int, float)) or value <= 0:
+        raise Invalid('timeout must be a positive number of seconds')
+
+    return value
+
+
+def validate_stall_timeout(value):
+    if not isinstance(value, (int, float)) or value <= 0:
+        raise Invalid('stall_timeout must be a positive number of seconds')
+
+    return value
+
+
+def validate_delete_orphans(value):
+    if not isinstance(value, bool):
+        raise Invalid('delete_orphans must be a boolean')
+
+    return value
+
+
+def validate_snapshots(value):
+    if not isinstance(value, dict):
+        raise Invalid('snapshots must be a dict')
+
+    for key in value:
+        if key != 'keep':
+            raise Invalid('unknown snapshots option %s' % key)
+
+    keep = value.get('keep', None)
+
+    if not isinstance(keep, int) or keep <= 0:
+        raise Invalid('snapshots keep must be a positive integer')
+
+    return value
+
+
 def validate_path(value):
     if not isinstance(value, dict):
         raise Invalid('must be a dict')
@@ -44,20 +155,28 @@ def validate_path(value):
 
     path = value.get('path')
 
-    if not os.path.isdir(path):
-        raise Invalid('%s must be a existing directory' % path)
-
+    # The path itself is checked by the preflight checks before
+    # running since it could be on a hung mount.
     if not os.path.isabs(path):
         raise Invalid('%s must be a absolute path' % path)
 
+    if 'max_workers' in value:
+        max_workers = value.get('max_workers')
+
+        if not isinstance(max_workers, int) or max_workers <= 0:
+            raise Invalid('max_workers must be a positive integer')
+
     if 'mount' in value:
         mount = value.get('mount')
 
         if not isinstance(mount, bool):
             raise Invalid('mount must be a boolean')
 
-        if mount and not os.path.ismount(path):
-            raise Invalid('%s must be a mount' % path)
+    if 'min_free' in value:
+        min_free = value.get('min_free')
+
+        if not isinstance(min_free, int) or min_free < 0:
+            raise Invalid('min_free must be zero or above')
 
     return value
 
@@ -109,17 +228,176 @@ def validate_workers(value):
     return value
 
 
+def validate_device_workers(value):
+    if not isinstance(value, int):
+        raise Invalid('device_workers must be a integer')
+
+    if value <= 0:
+        raise Invalid('device_workers must be a positive value '
+                      'above zero')
+
+    return value
+
+
+def validate_bandwidth_limit(value):
+    if not isinstance(value, int):
+        raise Invalid('bandwidth_limit must be a integer')
+
+    if value <= 0:
+        raise Invalid('bandwidth_limit must be a positive value '
+                      'above zero')
+
+    return value
+
+
+def validate_ionice_class(value):
+    if value not in (1, 2, 3):
+        raise Invalid('ionice_class must be 1, 2 or 3')
+
+    return value
+
+
+def validate_ionice_level(value):
+    if not isinstance(value, int) or not 0 <= value <= 7:
+        raise Invalid('ionice_level must be a integer from 0 to 7')
+
+    return value
+
+
+def validate_nice(value):
+    if not isinstance(value, int) or not -20 <= value <= 19:
+        raise Invalid('nice must be a integer from -20 to 19')
+
+    return value
+
+
+def validate_metrics_file(value):
+    if not isinstance(value, str):
+        raise Invalid('metrics_file must be a string')
+
+    if not os.path.isabs(value):
+        raise Invalid('metrics_file %s must be a absolute path' % value)
+
+    return value
+
+
+def validate_metrics_interval(value):
+    if not isinstance(value, int) or value < 0:
+        raise Invalid('metrics_interval must be zero or above')
+
+    return value
+
+
+def validate_status_socket(value):
+    if not isinstance(value, str):
+        raise Invalid('status_socket must be a string')
+
+    if not os.path.isabs(value):
+        raise Invalid('status_socket %s must be a absolute path' % value)
+
+    return value
+
+
+def validate_autotune(value):
+    if not isinstance(value, dict):
+        raise Invalid('autotune must be a dict')
+
+    for key in value:
+        if key in ('min_workers', 'max_workers'):
+            if not isinstance(value[key], int) or value[key] <= 0:
+                raise Invalid('autotune %s must be a positive integer' % (
+                              key))
+        elif key in ('interval', 'max_iowait', 'max_load'):
+            if not isinstance(value[key], (int, float)) or value[key] <= 0:
+                raise Invalid('autotune %s must be a positive number' % (
+                              key))
+        else:
+            raise Invalid('unknown autotune option %s' % key)
+
+    if 'min_workers' in value and 'max_workers' in value:
+        if value['min_workers'] > value['max_workers']:
+            raise Invalid('autotune min_workers cannot be above '
+                          'max_workers')
+
+    return value
+
+
+def validate_preflight_timeout(value):
+    if not isinstance(value, (int, float)) or value <= 0:
+        raise Invalid('preflight_timeout must be a positive number of '
+                      'seconds')
+
+    return value
+
+
+def validate_scan_threads(value):
+    if not isinstance(value, int):
+        raise Invalid('scan_threads must be a integer')
+
+    if value <= 0:
+        raise Invalid('scan_threads must be a positive value '
+                      'above zero')
+
+    return value
+
+
+def validate_manifest(value):
+    if not isinstance(value, dict):
+        raise Invalid('manifest must be a dict')
+
+    for key in value:
+        if key != 'full_every':
+            raise Invalid('unknown manifest option %s' % key)
+
+    full_every = value.get('full_every', 0)
+
+    if not isinstance(full_every, int) or full_every < 0:
+        raise Invalid('manifest full_every must be zero or above')
+
+    return value
+
+
+def validate_state_dir(value):
+    if not isinstance(value, str):
+        raise Invalid('state_dir must be a string')
+
+    if not os.path.isabs(value):
+        raise Invalid('state_dir %s must be a absolute path' % value)
+
+    return value
+
+
 job_schema = Schema({
     'source': validate_path,
     'destination': validate_path,
     'exclusions': validate_exclusions,
     'options': validate_options,
     'steps': validate_steps,
+    Optional('split'): validate_split,
+    Optional('bundle'): validate_bundle,
+    Optional('retry'): validate_retry,
+    Optional('timeout'): validate_timeout,
+    Optional('stall_timeout'): validate_stall_timeout,
+    Optional('delete_orphans'): validate_delete_orphans,
+    Optional('snapshots'): validate_snapshots,
     Optional('allowed_returncodes'): validate_allowed_returncodes
 })
 
 config_schema = Schema({
     'workers': validate_workers,
+    Optional('device_workers'): validate_device_workers,
+    Optional('bandwidth_limit'): validate_bandwidth_limit,
+    Optional('ionice_class'): validate_ionice_class,
+    Optional('ionice_level'): validate_ionice_level,
+    Optional('nice'): validate_nice,
+    Optional('state_dir'): validate_state_dir,
+    Optional('scan_threads'): validate_scan_threads,
+    Optional('manifest'): validate_manifest,
+    Optional('metrics_file'): validate_metrics_file,
+    Optional('metrics_interval'): validate_metrics_interval,
+    Optional('preflight_timeout'): validate_preflight_timeout,
+    Optional('autotune'): validate_autotune,
+    Optional('status_socket'): validate_status_socket,
     'jobs': [job_schema]
 })
 
@@ -154,4 +432,11 @@ def load_config(path):
                   expanded_path, six.text_type(exc)))
         sys.exit(1)
 
+    for job in data['jobs']:
+        if 'split' in job and job['steps'] > 0:
+            LOG.error('failed to validate config %s: job with source %s '
+                      'cannot use both split and steps' % (
+                          expanded_path, job['source']['path']))
+            sys.exit(1)
+
     return data
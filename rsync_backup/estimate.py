@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+from rsync_backup.history import percentile
+from rsync_backup.scheduler import DEFAULT_THROUGHPUT, simulate_makespan
+from rsync_backup.supervisor import Supervisor
+import six
+
+
+LOG = logging.getLogger(__name__)
+
+# Runs that sent less than this is mostly spent comparing files and
+# tells little about how fast data is transferred.
+MIN_THROUGHPUT_BYTES = 64 * 1024 * 1024
+
+
+def get_dry_run_command(command):
+    return command[:1] + ['--dry-run'] + command[1:]
+
+
+def get_throughputs(run_history, limit=30):
+    # Median bytes per second of earlier runs for each job key, the
+    # median of all of them is under the None key.
+    throughputs = {}
+    rates = []
+
+    for key, values in run_history.job_durations(limit).items():
+        job_rates = []
+
+        for seconds, nbytes in values:
+            if nbytes is None or nbytes < MIN_THROUGHPUT_BYTES:
+                continue
+
+            if seconds > 0:
+                job_rates.append(nbytes / seconds)
+
+        if job_rates:
+            throughputs[key] = percentile(job_rates, 50)
+            rates += job_rates
+
+    if rates:
+        throughputs[None] = percentile(rates, 50)
+
+    return throughputs
+
+
+class Estimate(object):
+    __slots__ = ('job', 'bytes', 'files', 'total_bytes', 'check_seconds',
+                 'throughput', 'error')
+
+    def __init__(self, job, throughput):
+        self.job = job
+        self.throughput = throughput
+        self.bytes = None
+        self.files = None
+        self.total_bytes = None
+        self.check_seconds = 0
+        self.error = None
+
+    @property
+    def seconds(self):
+        # The dry run takes about as long as rsync needs to find what
+        # to transfer, the data is transferred on top of that.
+        return self.check_seconds + (self.bytes or 0) / self.throughput
+
+
+class Estimator(object):
+    """Predicts a run by running every job with rsync --dry-run.
+
+    The dry runs is run by workers at a time like a real run and the
+    bytes they would transfer is turned into durations using the
+    throughput of earlier runs.
+    """
+
+    def __init__(self, workers=1, throughputs=None,
+                 default_throughput=DEFAULT_THROUGHPUT):
+        self.workers = workers
+        self.throughputs = throughputs or {}
+        self.default_throughput = self.throughputs.get(None,
+                                                       default_throughput)
+
+    def throughput(self, job):
+        return self.throughputs.get(job.key, self.default_throughput)
+
+    def run(self, jobs):
+        supervisor = Supervisor(self.workers)
+
+        for job in jobs:
+            supervisor.submit(job, get_dry_run_command(job.command))
+
+        supervisor.run()
+
+        estimates = []
+
+        for job in jobs:
+            child = supervisor.children[job.id]
+            estimate = Estimate(job, self.throughput(job))
+            estimates.append(estimate)
+
+            try:
+                result = child.get()
+            except Exception as exc:
+                estimate.error = six.text_type(exc)
+                continue
+
+            if result.returncode != 0:
+                estimate.error = 'rsync returned %i' % result.returncode
+
+            estimate.bytes = result.transferred_size
+            estimate.files = result.files_transferred
+            estimate.total_bytes = result.total_size
+            estimate.check_seconds = result.seconds
+
+            LOG.debug('job %s would transfer %s bytes in %s files' % (
+                      job.id, estimate.bytes, estimate.files))
+
+        return estimates
+
+    def makespan(self, estimates, workers=None):
+        # The longest jobs is started first like in a real run.
+        durations = sorted((e.seconds for e in estimates), reverse=True)
+        return simulate_makespan(durations, workers or self.workers)
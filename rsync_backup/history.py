@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+import math
+from rsync_backup.scheduler import job_key
+import sqlite3
+
+
+LOG = logging.getLogger(__name__)
+
+HISTORY_FILE = 'history.db'
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS runs ('
+    '  id INTEGER PRIMARY KEY AUTOINCREMENT,'
+    '  run_id INTEGER NOT NULL,'
+    '  started REAL NOT NULL,'
+    '  finished REAL NOT NULL,'
+    '  workers INTEGER NOT NULL,'
+    '  return_value INTEGER NOT NULL,'
+    '  total_jobs INTEGER NOT NULL,'
+    '  successful INTEGER NOT NULL,'
+    '  failed INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS jobs ('
+    '  id INTEGER PRIMARY KEY AUTOINCREMENT,'
+    '  run INTEGER NOT NULL REFERENCES runs(id),'
+    '  job_id TEXT NOT NULL,'
+    '  source TEXT NOT NULL,'
+    '  destination TEXT NOT NULL,'
+    '  returncode INTEGER,'
+    '  successful INTEGER NOT NULL,'
+    '  seconds REAL NOT NULL,'
+    '  bytes INTEGER,'
+    '  files INTEGER,'
+    '  key TEXT)',
+    'CREATE INDEX IF NOT EXISTS jobs_source '
+    '  ON jobs (source, destination)',
+]
+
+# Created after histories without the key column is upgraded.
+KEY_INDEX = 'CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key)'
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+class JobRecord(object):
+    def __init__(self, job_id, source, destination, returncode, successful,
+                 seconds, bytes=None, files=None, key=None):
+        self.job_id = job_id
+        self.source = source
+        self.destination = destination
+        # Tells apart split jobs with the same source and destination.
+        self.key = key
+        self.returncode = returncode
+        self.successful = successful
+        self.seconds = seconds
+        self.bytes = bytes
+        self.files = files
+
+
+class RunHistory(object):
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+
+        with self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+
+            columns = [row[1] for row in
+                       self.conn.execute('PRAGMA table_info(jobs)')]
+
+            if 'key' not in columns:
+                self.conn.execute('ALTER TABLE jobs ADD COLUMN key TEXT')
+
+            self.conn.execute(KEY_INDEX)
+
+    def close(self):
+        self.conn.close()
+
+    def record_run(self, run_id, started, finished, workers, return_value,
+                   records):
+        successful = len([r for r in records if r.successful])
+
+        with self.conn:
+            cur = self.conn.execute(
+                'INSERT INTO runs (run_id, started, finished, workers, '
+                'return_value, total_jobs, successful, failed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (run_id, started, finished, workers, return_value,
+                 len(records), successful, len(records) - successful))
+            run = cur.lastrowid
+
+            self.conn.executemany(
+                'INSERT INTO jobs (run, job_id, source, destination, '
+                'returncode, successful, seconds, bytes, files, key) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(run, r.job_id, r.source, r.destination, r.returncode,
+                  int(r.successful), r.seconds, r.bytes, r.files, r.key)
+                 for r in records])
+
+        return run
+
+    def runs(self, limit):
+        cur = self.conn.execute(
+            'SELECT r.id, r.run_id, r.started, r.finished, r.workers, '
+            'r.return_value, r.total_jobs, r.successful, r.failed, '
+            'SUM(j.bytes), SUM(j.files) FROM runs r '
+            'LEFT JOIN jobs j ON j.run = r.id '
+            'GROUP BY r.id ORDER BY r.id DESC LIMIT ?', (limit,))
+
+        return list(reversed(cur.fetchall()))
+
+    def _jobs(self, limit):
+        # Successful jobs in the last limit runs by job key, ordered
+        # oldest first so that the last value is the latest run.
+        cur = self.conn.execute(
+            'SELECT j.key, j.source, j.destination, j.seconds, j.bytes '
+            'FROM jobs j WHERE j.successful = 1 AND j.run IN '
+            '(SELECT id FROM runs ORDER BY id DESC LIMIT ?) '
+            'ORDER BY j.run ASC', (limit,))
+
+        jobs = {}
+
+        for key, source, destination, seconds, nbytes in cur:
+            if key is None:
+                # Recorded before jobs had a key.
+                key = job_key(source, destination)
+
+            job = jobs.setdefault(key, (source, destination, []))
+            job[2].append((seconds, nbytes))
+
+        return jobs
+
+    def job_durations(self, limit):
+        # Split jobs shares source and destination so they is told
+        # apart by the job key.
+        return dict((key, job[2]) for key, job in self._jobs(limit).items())
+
+    def summary(self, limit):
+        result = []
+
+        jobs = self._jobs(limit)
+
+        for key in sorted(jobs):
+            source, destination, values = jobs[key]
+            seconds = [v[0] for v in values]
+
+            result.append({
+                'key': key,
+                'source': source,
+                'destination': destination,
+                'runs': len(seconds),
+                'p50': percentile(seconds, 50),
+                'p95': percentile(seconds, 95),
+                'latest': seconds[-1],
+            })
+
+        return result
+
+    def regressions(self, limit, threshold):
+        result = []
+
+        jobs = self._jobs(limit)
+
+        for key in sorted(jobs):
+            source, destination, values = jobs[key]
+            seconds = [v[0] for v in values]
+
+            # We need something to compare the latest run with.
+            if len(seconds) < 2:
+                continue
+
+            latest = seconds[-1]
+            baseline = percentile(seconds[:-1], 50)
+            allowed = baseline * (1 + threshold / 100.0)
+
+            if latest > allowed and latest > 0:
+                result.append({
+                    'key': key,
+                    'source': source,
+                    'destination': destination,
+                    'baseline': baseline,
+                    'latest': latest,
+                    'increase': ((latest / baseline - 1) * 100
+                                 if baseline > 0 else None),
+                })
+
+        return result
@@ -14,11 +14,16 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import asyncio
+import hashlib
+import json
 import logging
-from rsync_backup.rsync import run_rsync
+from rsync_backup.rsync import get_bundle_command, get_rsync_command
+from rsync_backup.rsync import read_output
+from rsync_backup.rsync import spawn_rsync, write_files_from
+from rsync_backup.scheduler import job_key
 import os
 import uuid
-import sys
 import six
 from timeit import default_timer as timer
 
@@ -26,103 +31,298 @@ from timeit import default_timer as timer
 LOG = logging.getLogger(__name__)
 
 
-class DestinationPath(object):
-    def __init__(self, path, uid, gid, mode):
-        self.path = path
-        self.uid = uid
-        self.gid = gid
-        self.mode = mode
+def get_device(path):
+    # Paths that does not exist yet is created on the device of their
+    # closest existing parent.
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError as exc:
+            parent = os.path.dirname(path)
 
-    def create(self):
-        if not os.path.isdir(self.path):
-            os.mkdir(self.path)
-            os.chown(self.path, self.uid, self.gid)
-            os.chmod(self.path, self.mode)
+            if parent == path:
+                LOG.debug('failed to find device of %s: %s' % (
+                          path, six.text_type(exc)))
+                return None
+
+            path = parent
+
+
+def get_devices(paths):
+    # Devices with a concurrency limit as (st_dev, limit) pairs from
+    # (path, limit) pairs, a device used by both source and destination
+    # is only counted once.
+    limits = {}
+
+    for path, limit in paths:
+        if limit is None:
+            continue
+
+        dev = get_device(path)
+
+        if dev is not None:
+            limits[dev] = min(limits.get(dev, limit), limit)
+
+    return tuple(sorted(limits.items()))
+
+
+class JobTemplate(object):
+    """Settings shared by every job exploded from the same config job."""
+
+    __slots__ = ('rsync_path', 'source', 'destination', 'exclusions',
+                 'options', 'allowed_returncodes', 'bundle', 'device_limits',
+                 'config_hash', 'retry', 'timeout', 'stall_timeout',
+                 'snapshot', 'target')
+
+    def __init__(self, rsync_path, data, device_workers=None,
+                 snapshot=None):
+        self.rsync_path = rsync_path
+        self.source = data['source']['path']
+        self.destination = data['destination']['path']
+        self.snapshot = snapshot
+        # Where rsync writes, the destination is what the job is known
+        # as in the history and metrics between runs.
+        self.target = self.destination
+
+        if snapshot is not None:
+            # Jobs writes into the generation of this run.
+            self.target = snapshot.path
+
+        self.exclusions = tuple(data.get('exclusions') or ())
+        self.options = tuple(data.get('options') or ())
+
+        allowed_returncodes = data.get('allowed_returncodes', None)
+
+        if allowed_returncodes is not None:
+            allowed_returncodes = tuple(allowed_returncodes)
+
+        self.allowed_returncodes = allowed_returncodes
+        self.bundle = data.get('bundle', None)
+        self.retry = data.get('retry', None)
+        self.timeout = data.get('timeout', None)
+        self.stall_timeout = data.get('stall_timeout', None)
+        # Limits for the source and destination device, the devices
+        # is found for each job since it can cross into other mounts.
+        self.device_limits = (
+            data['source'].get('max_workers', device_workers),
+            data['destination'].get('max_workers', device_workers))
+
+        # Tells if a job was exploded from the same config job.
+        config = json.dumps(data, sort_keys=True, default=str)
+        self.config_hash = hashlib.sha1(config.encode('utf-8')).hexdigest()
 
 
 class Job(object):
-    def __init__(self, data):
+    __slots__ = ('id', 'template', 'relpath', 'files_from', 'size',
+                 '_command', '_devices')
+
+    def __init__(self, template, relpath=None, files_from=None, size=None):
+        self.id = six.text_type(uuid.uuid4())
+        self.template = template
+        # Path relative to the template source, None if not exploded.
+        self.relpath = relpath
+        self.files_from = files_from
+        self.size = size
+        self._command = None
+        self._devices = None
+
+    @property
+    def exploded(self):
+        return self.relpath is not None
+
+    @property
+    def source(self):
+        if self.relpath is None:
+            return self.template.source
+
+        return os.path.join(self.template.source, self.relpath)
+
+    @property
+    def destination(self):
+        if self.relpath is None:
+            return self.template.destination
+
+        return os.path.join(self.template.destination, self.relpath)
+
+    @property
+    def target(self):
+        if self.relpath is None:
+            return self.template.target
+
+        return os.path.join(self.template.target, self.relpath)
+
+    @property
+    def parent_source(self):
+        return self.template.source
+
+    @property
+    def parent_destination(self):
+        return self.template.destination
+
+    @property
+    def parent_target(self):
+        return self.template.target
+
+    @property
+    def exclusions(self):
+        return self.template.exclusions
+
+    @property
+    def options(self):
+        return self.template.options
+
+    @property
+    def allowed_returncodes(self):
+        return self.template.allowed_returncodes
+
+    def find_devices(self):
+        # Stats the source and target which can hang on a dead mount so
+        # it is done when the job is produced, not in the event loop.
+        self._devices = get_devices(zip(
+            (self.source, self.target), self.template.device_limits))
+
+        return self._devices
+
+    @property
+    def devices(self):
+        if self._devices is None:
+            return self.find_devices()
+
+        return self._devices
+
+    @property
+    def retry(self):
+        return self.template.retry
+
+    @property
+    def timeout(self):
+        return self.template.timeout
+
+    @property
+    def stall_timeout(self):
+        return self.template.stall_timeout
+
+    @property
+    def link_dest(self):
+        if self.template.snapshot is None:
+            return None
+
+        return self.template.snapshot.link_dest(self.relpath)
+
+    @property
+    def command(self):
+        if self._command is None:
+            self._command = get_rsync_command(
+                self.template.rsync_path, self.source, self.target,
+                self.exclusions, options=self.options,
+                files_from=self.files_from, link_dest=self.link_dest)
+
+        return self._command
+
+    @property
+    def key(self):
+        key = job_key(self.source, self.destination)
+
+        if self.files_from is not None:
+            # Files directly in a split directory, first name tells
+            # the chunks apart.
+            key = '%s [files from %s]' % (key, self.files_from[0])
+
+        return key
+
+
+class JobBundle(object):
+    """Small exploded jobs from the same template run by one rsync."""
+
+    __slots__ = ('id', 'template', 'members', 'size', '_command',
+                 '_devices')
+
+    files_from = None
+
+    def __init__(self, template, members):
         self.id = six.text_type(uuid.uuid4())
-        self.source = data.get('source')
-        self.destination = data.get('destination')
-        self.exclusions = data.get('exclusions')
-        self.options = data.get('options')
-        self.exploded = data.get('exploded', False)
-        self.parent_source = data.get('parent_source', None)
-        self.parent_destination = data.get('parent_destination', None)
-
-        self.destination_paths = []
-
-        self._process_destination()
-
-    def _process_destination(self):
-        # If it was not exploded we dont need to fix anything on
-        # the destination.
-        if self.exploded is False:
-            return
-
-        parent_dst_diff = os.path.relpath(self.destination,
-                                          self.parent_destination)
-        normalized_dst_diff = os.path.normpath(parent_dst_diff)
-
-        all_parts = normalized_dst_diff.split(os.sep)
-
-        previous_dest = self.parent_destination
-        previous_src = self.parent_source
-
-        for part in all_parts:
-            part_path = os.path.join(previous_dest, part)
-            source_part = os.path.join(previous_src, part)
-            LOG.debug('source_part is %s' % source_part)
-
-            if not os.path.isdir(part_path):
-                if not os.path.isdir(source_part):
-                    LOG.error('cannot create destination %s because '
-                              'source %s does not exist' %
-                              (part_path, source_part))
-                    sys.exit(1)
-
-                source_part_stat = os.stat(source_part)
-
-                LOG.info('this run will create destination dir: {} '
-                         'with owner {} group: {} and '
-                         'mode: {:o}'.format(
-                             part_path, source_part_stat.st_uid,
-                             source_part_stat.st_gid,
-                             source_part_stat.st_mode))
-
-                new_dest_path = DestinationPath(part_path,
-                                                source_part_stat.st_uid,
-                                                source_part_stat.st_gid,
-                                                source_part_stat.st_mode)
-
-                LOG.debug('adding destination path %s (uid: %i gid: %i '
-                          ' mode: %i) for creation' %
-                          (part_path, source_part_stat.st_uid,
-                           source_part_stat.st_gid,
-                           source_part_stat.st_mode))
-
-                self.destination_paths.append(new_dest_path)
-
-            previous_src = source_part
-            previous_dest = part_path
-
-    def prepare(self):
-        if len(self.destination_paths) <= 0:
-            return
-
-        for dest_path in self.destination_paths:
-            try:
-                dest_path.create()
-            except Exception as exc:
-                LOG.error('failed to prepare destination path %s: %s' % (
-                          dest_path.path, six.text_type(exc)))
-                sys.exit(1)
-
-
-def backup_job(rsync_path, source, dest, exclusions, options):
+        self.template = template
+        self.members = members
+        self.size = sum(m.size or 0 for m in members)
+        self._command = None
+        self._devices = None
+
+    @property
+    def source(self):
+        return self.template.source
+
+    @property
+    def destination(self):
+        return self.template.destination
+
+    def find_devices(self):
+        # Every device used by any of the bundled jobs.
+        limits = {}
+
+        for member in self.members:
+            for dev, limit in member.devices:
+                limits[dev] = min(limits.get(dev, limit), limit)
+
+        self._devices = tuple(sorted(limits.items()))
+
+        return self._devices
+
+    @property
+    def devices(self):
+        if self._devices is None:
+            return self.find_devices()
+
+        return self._devices
+
+    @property
+    def retry(self):
+        return self.template.retry
+
+    @property
+    def timeout(self):
+        return self.template.timeout
+
+    @property
+    def stall_timeout(self):
+        return self.template.stall_timeout
+
+    @property
+    def link_dest(self):
+        if self.template.snapshot is None:
+            return None
+
+        # Paths is kept with --relative so it is the same root.
+        return self.template.snapshot.link_dest()
+
+    @property
+    def command(self):
+        if self._command is None:
+            self._command = get_bundle_command(
+                self.template.rsync_path, self.template.source,
+                [m.relpath for m in self.members],
+                self.template.target, self.template.exclusions,
+                options=self.template.options, link_dest=self.link_dest)
+
+        return self._command
+
+
+async def backup_job(child):
     start = timer()
-    result = run_rsync(rsync_path, source, dest, exclusions,
-                       options=options)
+    files_from = child.job.files_from
+    process, transport = await spawn_rsync(child.command,
+                                           files_from=files_from)
+    child.attach(process, transport)
+
+    parser = child.output
+    tasks = [read_output(process.stdout, parser),
+             read_output(process.stderr, parser, stderr=True)]
+
+    if files_from is not None:
+        tasks.append(write_files_from(process.stdin, files_from))
+
+    await asyncio.gather(*tasks)
+    parser.close()
+
+    returncode = await process.wait()
     end = timer()
-    return result, (end - start)
+    return parser.result(returncode, end - start)
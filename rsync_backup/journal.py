@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+JOURNAL_FILE = 'journal.log'
+
+
+class Journal(object):
+    """Append only log of the jobs completed in a run.
+
+    Every completion is written as a single line and synced to disk
+    before moving on so the jobs completed before a crash or reboot
+    can be skipped when resuming. Jobs is identified by their key and
+    a hash of the config job they was exploded from.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.completed = set()
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._torn = False
+
+        if resume:
+            self._load()
+
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+
+        # A new run starts over unless there is something to resume.
+        if not self.completed:
+            flags |= os.O_TRUNC
+            self._torn = False
+
+        self.fd = os.open(path, flags, 0o644)
+        self._sync_dir()
+
+        if self._torn:
+            # Do not let the next line be glued to a partial line.
+            self._write('\n')
+
+    def _sync_dir(self):
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)),
+                     os.O_RDONLY)
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            LOG.info('no journal found at %s, nothing to resume' % (
+                     self.path))
+            return
+
+        with open(self.path) as f:
+            data = f.read()
+
+        self._torn = bool(data) and not data.endswith('\n')
+        last = {}
+
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line can be partial after a crash.
+                LOG.debug('ignoring broken journal line: %s' % line)
+                continue
+
+            if 'key' in entry:
+                self.completed.add((entry['key'], entry['config']))
+
+            last = entry
+
+        if last.get('return_value', None) == 0 and not last['failed']:
+            LOG.info('the last run finished successfully, nothing '
+                     'to resume')
+            self.completed = set()
+            return
+
+        LOG.info('resuming, %i jobs was completed in the last run' % (
+                 len(self.completed)))
+
+    def _write(self, line):
+        with self._lock:
+            # O_APPEND makes each write land at the end even with
+            # several writers.
+            os.write(self.fd, line.encode('utf-8'))
+            os.fsync(self.fd)
+
+    def _append(self, entry):
+        self._write(json.dumps(entry, sort_keys=True) + '\n')
+
+    def start(self, run_id):
+        self._append({'run': run_id, 'started': time.time()})
+
+    def done(self, job):
+        return (job.key, job.template.config_hash) in self.completed
+
+    def skip(self, job):
+        self.skipped += 1
+
+    def record(self, job):
+        self._append({'key': job.key, 'config': job.template.config_hash,
+                      'time': time.time()})
+
+    def finish(self, return_value, failed):
+        self._append({'finished': time.time(),
+                      'return_value': return_value, 'failed': failed})
+
+    def close(self):
+        os.close(self.fd)
@@ -14,124 +14,447 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import copy
 import logging
-import multiprocessing
-from rsync_backup.job import Job, backup_job
-from rsync_backup.rsync import get_rsync_command
+from rsync_backup.job import Job, JobBundle, JobTemplate
+from rsync_backup.orphans import TreeRemover, find_orphans
+from rsync_backup.planner import DestinationPlanner
+from rsync_backup.scheduler import Scheduler, measure_tree
+from rsync_backup.snapshot import Snapshots
+from rsync_backup.split import split_tree
+from rsync_backup.supervisor import Supervisor
+from rsync_backup.walker import DEFAULT_THREADS, Walker
 import os
+import six
+import threading
+from timeit import default_timer as timer
 
 
 LOG = logging.getLogger(__name__)
 
+# Maximum amount of jobs to prepare destinations for at once.
+PREPARE_BATCH = 256
+
+# Defaults for what is a small job that can be bundled with others.
+BUNDLE_MAX_BYTES = 1024 * 1024
+BUNDLE_MAX_FILES = 100
+BUNDLE_MAX_JOBS = 64
+
 
 class Manager(object):
-    def __init__(self, rsync_path, workers=1):
+    def __init__(self, rsync_path, workers=1, history=None,
+                 scan_threads=DEFAULT_THREADS, manifest=None, throttle=None,
+                 journal=None, allowed_returncodes=None,
+                 override_returncodes=False):
         self.rsync_path = rsync_path
-        self.pool = multiprocessing.Pool(processes=workers)
-        self.queue = []
+        self.supervisor = Supervisor(workers, throttle=throttle)
+        self.scheduler = Scheduler(history)
+        self.walker = Walker(scan_threads)
+        self.planner = DestinationPlanner(scan_threads)
+        self.manifest = manifest
+        self.journal = journal
+        self.allowed_returncodes = allowed_returncodes or [0]
+        # Return codes given as argument overrides the job.
+        self.override_returncodes = override_returncodes
+        self.device_workers = None
+        self.execute_seconds = 0
+        # Directories that could not be scanned when exploding jobs.
+        self.scan_errors = []
+        # Jobs that was not run since their destination could not be
+        # prepared.
+        self.prepare_errors = []
+        self.jobs = []
+        # Snapshots of the config jobs using them, by index.
+        self.snapshots = {}
+        self._pruner = None
 
-    def _process_steps(self, job):
-        src_dict = job.get('source')
-        src = src_dict['path']
-        dst_dict = job.get('destination')
-        dst = dst_dict['path']
+    def _scan_failed(self, template, entries):
+        # Nothing below the directory is synced so the run must fail
+        # and the snapshot being written is incomplete.
+        LOG.error('directories below %s is not synced since it could '
+                  'not be scanned: %s' % (
+                      entries.path, six.text_type(entries.error)))
 
-        steps = job.get('steps')
+        self.scan_errors.append(entries.path)
 
-        last_dirs = [src]
-        new_sources = []
+        if template.snapshot is not None:
+            template.snapshot.failed = True
 
-        while (steps > 0):
-            new_dirs = []
+    def _prepare_failed(self, job):
+        LOG.error('job %s %s -> %s is not run since its destination '
+                  'could not be prepared' % (
+                      job.id, job.source, job.destination))
 
-            for dir in last_dirs:
-                objs = os.listdir(dir)
+        self.prepare_errors.append(job)
 
-                for obj in objs:
-                    obj_path = os.path.join(dir, obj)
+        if job.template.snapshot is not None:
+            job.template.snapshot.failed = True
 
-                    if not os.path.isdir(obj_path):
-                        continue
+    def _process_steps(self, template, steps):
+        src = template.source
 
-                    new_dirs.append(obj_path)
+        if steps <= 0:
+            yield [Job(template)]
+            return
 
-            steps -= 1
+        # Jobs is produced in batches, one for each directory scanned
+        # on the level above.
+        errors = []
+        level = self.walker.dirs_at_depth(src, steps - 1, errors=errors)
 
-            if steps == 0:
-                new_sources = new_dirs
-            else:
-                last_dirs = new_dirs
+        for entries in errors:
+            self._scan_failed(template, entries)
+
+        for entries in self.walker.iter_scan(level):
+            if entries.error is not None:
+                self._scan_failed(template, entries)
+                continue
+
+            yield [Job(template, relpath=os.path.relpath(d, src))
+                   for d in entries.dirs]
+
+    def _process_split(self, template, split):
+        src = template.source
 
-        new_jobs = []
+        # The whole tree must be scanned before it can be split.
+        shards = split_tree(src, split, walker=self.walker)
 
-        for new_src in new_sources:
-            src_path_diff = os.path.relpath(new_src, src)
-            new_dst = os.path.join(dst, src_path_diff)
+        LOG.info('split %s into %i shards' % (src, len(shards)))
 
-            new_job = copy.deepcopy(job)
-            new_job['source'] = new_src
-            new_job['destination'] = new_dst
-            new_job['parent_source'] = src
-            new_job['parent_destination'] = dst
-            new_job['exploded'] = True
+        jobs = []
 
-            new_jobs.append(new_job)
+        for shard in shards:
+            relpath = None
 
-        return new_jobs
+            if shard.path != src:
+                relpath = os.path.relpath(shard.path, src)
+
+            jobs.append(Job(template, relpath=relpath,
+                            files_from=shard.files, size=shard.bytes))
+
+        yield jobs
 
     def _explode_jobs(self, jobs):
-        exploded_jobs = []
+        for i, j in enumerate(jobs):
+            template = JobTemplate(self.rsync_path, j,
+                                   device_workers=self.device_workers,
+                                   snapshot=self.snapshots.get(i, None))
+
+            paths = (template.source, template.target)
 
-        for j in jobs:
-            steps = j.get('steps')
+            for path, limit in zip(paths, template.device_limits):
+                if limit is not None:
+                    LOG.debug('at most %i jobs will use each device below '
+                              '%s at the same time' % (limit, path))
 
-            if steps > 0:
-                exploded_jobs += self._process_steps(j)
+            if 'split' in j:
+                batches = self._process_split(template, j['split'])
             else:
-                j['exploded'] = False
+                batches = self._process_steps(template, j.get('steps'))
+
+            for batch in batches:
+                # Keep batches small so the first jobs can start
+                # while the rest is prepared.
+                for start in range(0, len(batch), PREPARE_BATCH):
+                    yield batch[start:start + PREPARE_BATCH]
+
+    def explode(self):
+        jobs = []
+
+        for batch in self._explode_jobs(self.jobs):
+            jobs += batch
+
+        return jobs
+
+    def _iter_batches(self):
+        for batch in self._explode_jobs(self.jobs):
+            for job in batch:
+                LOG.info('adding job %s %s -> %s to queue' % (
+                         job.id, job.source, job.destination))
+
+                LOG.debug('job %s rsync command: %s' % (
+                          job.id, ' '.join(job.command)))
+
+            yield batch
+
+        LOG.info('scanned %i directories in %.2f secs using %i threads' % (
+                 self.walker.scanned, self.walker.scan_seconds,
+                 self.walker.threads))
+
+    def _unchanged(self, job):
+        # Every job must write its part of a new snapshot.
+        if self.manifest is None or job.template.snapshot is not None:
+            return False
+
+        if not self.manifest.unchanged(job):
+            return False
+
+        LOG.info('skipping job %s %s -> %s because source is '
+                 'unchanged' % (job.id, job.source, job.destination))
+
+        self.manifest.skip(job, self.scheduler.history.get(job.key))
+        return True
+
+    def _completed(self, job):
+        if self.journal is None or not self.journal.done(job):
+            return False
+
+        LOG.info('skipping job %s %s -> %s because it was completed in '
+                 'the last run' % (job.id, job.source, job.destination))
+
+        self.journal.skip(job)
+        return True
+
+    def allowed(self, job, returncode):
+        allowed_returncodes = self.allowed_returncodes
+
+        if not self.override_returncodes:
+            if job.allowed_returncodes is not None:
+                allowed_returncodes = job.allowed_returncodes
+
+        return returncode in allowed_returncodes
+
+    def _on_finished(self, child):
+        successful = child.successful()
+
+        if successful:
+            successful = self.allowed(child.job, child.get().returncode)
+
+        snapshot = child.job.template.snapshot
+
+        if snapshot is not None and not successful:
+            snapshot.failed = True
+
+        if self.journal is not None and successful:
+            self.journal.record(child.job)
+
+    def _bundle_small(self, job):
+        bundle = job.template.bundle
+
+        if bundle is None or not job.exploded or job.files_from is not None:
+            return False
+
+        # Anchored exclusions would match differently with --relative.
+        for exclude in job.exclusions:
+            if exclude.lstrip('-').split('=')[-1].startswith('/'):
+                return False
+
+        max_bytes = bundle.get('max_bytes', BUNDLE_MAX_BYTES)
+        max_files = bundle.get('max_files', BUNDLE_MAX_FILES)
+
+        if job.size is not None and job.size > max_bytes:
+            return False
+
+        size, files, complete = measure_tree(job.source, max_files + 1)
+
+        if job.size is None:
+            job.size = size
+
+        return complete and files <= max_files and size <= max_bytes
+
+    def _make_bundle(self, pending):
+        if len(pending) == 1:
+            return pending[0]
 
-                src_dict = j['source']
-                dst_dict = j['destination']
-                j['source'] = src_dict['path']
-                j['destination'] = dst_dict['path']
+        bundle = JobBundle(pending[0][0].template, [p[0] for p in pending])
+        bundle.find_devices()
 
-                exploded_jobs.append(j)
+        LOG.info('bundling %i small jobs into job %s: %s' % (
+                 len(pending), bundle.id,
+                 ', '.join(p[0].id for p in pending)))
 
-        return exploded_jobs
+        LOG.debug('job %s rsync command: %s' % (
+                  bundle.id, ' '.join(bundle.command)))
+
+        return bundle, bundle.command, sum(p[2] for p in pending)
+
+    def _iter_pipeline(self):
+        bundles = {}
+
+        for batch in self._iter_batches():
+            failed = self.planner.prepare(batch)
+
+            for job in failed:
+                self._prepare_failed(job)
+
+            for job in batch:
+                if job in failed:
+                    continue
+
+                if self._completed(job) or self._unchanged(job):
+                    continue
+
+                # The longest running jobs found so far is started
+                # first so that a huge job does not start last and
+                # stretch the run.
+                expected = self.scheduler.expected_seconds(job)
+                item = (job, job.command, expected)
+                job.find_devices()
+
+                if not self._bundle_small(job):
+                    yield item
+                    continue
+
+                template = job.template
+                pending = bundles.setdefault(template, [])
+                pending.append(item)
+
+                max_jobs = template.bundle.get('max_jobs', BUNDLE_MAX_JOBS)
+
+                if len(pending) >= max_jobs:
+                    yield self._make_bundle(bundles.pop(template))
+
+        for pending in bundles.values():
+            yield self._make_bundle(pending)
+
+        LOG.info('created %i destination directories in %.2f secs' % (
+                 self.planner.created, self.planner.prepare_seconds))
 
     def queue_jobs(self, config):
-        jobs = config['jobs']
+        # Jobs are exploded and handed to the workers while running
+        # so scanning directories overlaps with running rsync.
+        self.jobs = config['jobs']
+        self.device_workers = config.get('device_workers', None)
+
+        resume = self.journal is not None and bool(self.journal.completed)
+
+        for i, j in enumerate(self.jobs):
+            if 'snapshots' not in j:
+                continue
+
+            self.snapshots[i] = Snapshots(j['destination']['path'],
+                                          j['snapshots']['keep'],
+                                          resume=resume)
 
-        exploded_jobs = self._explode_jobs(jobs)
+    def drain(self):
+        jobs = []
 
-        for j in exploded_jobs:
-            job = Job(j)
+        for batch in self._iter_batches():
+            for job in batch:
+                try:
+                    self.planner.plan(job)
+                except OSError as exc:
+                    LOG.error('job %s would fail: %s' % (
+                              job.id, six.text_type(exc)))
+                    continue
 
-            LOG.info('adding job %s %s -> %s to queue' % (
+                jobs.append(job)
+
+        jobs = self.scheduler.order(jobs)
+
+        for job in jobs:
+            LOG.info('job %s would run %s -> %s' % (
                      job.id, job.source, job.destination))
 
-            rsync_command = get_rsync_command(
-                self.rsync_path, job.source, job.destination,
-                job.exclusions, options=job.options)
+        for snapshot in self.snapshots.values():
+            LOG.info('would write snapshot %s linked to %s' % (
+                     snapshot.path, snapshot.previous))
 
-            LOG.debug('job %s rsync command: %s' % (
-                      job.id, ' '.join(rsync_command)))
+            for generation in snapshot.expired():
+                LOG.info('would remove expired snapshot %s' % (
+                         os.path.join(snapshot.destination, generation)))
 
-            self.queue.append(job)
+        return jobs
 
-    def run(self):
-        results = {}
+    def find_orphans(self, noop=False):
+        # Only jobs that removes orphans is checked unless it is a noop
+        # run where every orphan is listed.
+        orphans = []
+
+        for j in self.jobs:
+            steps = j.get('steps') or 0
+            remove = j.get('delete_orphans', False)
+
+            # Generations of snapshots is not orphans.
+            if 'split' in j or 'snapshots' in j or steps <= 0:
+                continue
 
-        for job in self.queue:
-            args = (self.rsync_path, job.source, job.destination,
-                    job.exclusions, job.options)
-            res = self.pool.apply_async(backup_job, args=args)
-            results[job.id] = res
+            if not remove and not noop:
+                continue
 
-        self.pool.close()
-        return results
+            for path in find_orphans(j['source']['path'],
+                                     j['destination']['path'], steps,
+                                     self.walker):
+                if not remove:
+                    LOG.warning('destination %s is orphaned since its '
+                                'source no longer exists' % path)
+                    continue
+
+                if noop:
+                    LOG.info('would remove orphaned destination %s' % path)
+                else:
+                    LOG.info('removing orphaned destination %s' % path)
+
+                orphans.append(path)
+
+        return orphans
+
+    def remove_orphans(self, orphans):
+        remover = TreeRemover(self.walker.threads)
+
+        if not orphans:
+            return remover
+
+        remover.remove(orphans)
+
+        LOG.info('removed %i orphaned destinations with %i directories '
+                 'and %i files in %.2f secs using %i threads' % (
+                     len(orphans), remover.removed_dirs,
+                     remover.removed_files, remover.remove_seconds,
+                     remover.threads))
+
+        return remover
+
+    def _prune(self):
+        for snapshot in self.snapshots.values():
+            try:
+                snapshot.prune(self.walker.threads)
+            except Exception as exc:
+                LOG.error('failed to remove expired snapshots of %s: %s' % (
+                          snapshot.destination, six.text_type(exc)))
+
+    def finish_snapshots(self):
+        # Waits for the expired snapshots to be removed and points
+        # latest to the new snapshots that is complete.
+        if self._pruner is not None:
+            self._pruner.join()
+
+        complete = True
+
+        for snapshot in self.snapshots.values():
+            if self.supervisor.stopping or snapshot.failed:
+                LOG.error('snapshot %s is incomplete, latest is not '
+                          'updated' % snapshot.path)
+                complete = False
+                continue
+
+            try:
+                snapshot.publish()
+            except OSError as exc:
+                LOG.error('failed to update latest snapshot of %s: %s' % (
+                          snapshot.destination, six.text_type(exc)))
+                complete = False
+
+        return complete
+
+    def run(self):
+        # Filled in with results as jobs are produced while waiting.
+        return self.supervisor.children
 
     def wait(self):
         LOG.info('main process is now waiting for jobs to complete...')
-        self.pool.join()
+        self.supervisor.on_finished(self._on_finished)
+
+        for snapshot in self.snapshots.values():
+            snapshot.create()
+
+        if self.snapshots:
+            # Expired snapshots is removed while the jobs run.
+            self._pruner = threading.Thread(target=self._prune)
+            self._pruner.start()
+
+        start = timer()
+
+        try:
+            self.supervisor.run(self._iter_pipeline())
+        finally:
+            self.execute_seconds = timer() - start
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import json
+import logging
+import os
+import six
+import stat
+import tempfile
+
+
+LOG = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def _lstat(path):
+    try:
+        return os.lstat(path)
+    except OSError:
+        return None
+
+
+def fingerprint(path, files_from=None, command=None):
+    """Cheap fingerprint of a source tree.
+
+    Built from the mtime and amount of entries of every directory and
+    the total size and newest mtime of all files, all from a single
+    scandir pass without reading any file.
+    """
+
+    digest = hashlib.sha1()
+
+    if command is not None:
+        digest.update(os.fsencode(' '.join(command)))
+
+    total_size = 0
+    newest = 0
+
+    dirs = [path]
+
+    if files_from is not None:
+        st = _lstat(path)
+        digest.update(b'%d\0' % (st.st_mtime_ns if st else 0))
+        dirs = []
+
+        for name in files_from:
+            digest.update(os.fsencode(name) + b'\0')
+            st = _lstat(os.path.join(path, name))
+
+            if st is None:
+                digest.update(b'missing\0' + os.fsencode(name))
+                continue
+
+            if stat.S_ISDIR(st.st_mode):
+                # Directories is synced with everything below them.
+                dirs.append(os.path.join(path, name))
+                continue
+
+            total_size += st.st_size
+            newest = max(newest, st.st_mtime_ns)
+
+    while dirs:
+        current = dirs.pop()
+        st = _lstat(current)
+
+        if st is None:
+            digest.update(b'missing\0' + os.fsencode(current))
+            continue
+
+        subdirs = []
+        count = 0
+
+        try:
+            entries = sorted(os.scandir(current), key=lambda e: e.name)
+        except OSError as exc:
+            LOG.debug('failed to scan %s for fingerprint: %s' % (
+                      current, six.text_type(exc)))
+            entries = []
+
+        for entry in entries:
+            count += 1
+
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+
+                entry_st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+
+            total_size += entry_st.st_size
+            newest = max(newest, entry_st.st_mtime_ns)
+
+        digest.update(os.fsencode(os.path.relpath(current, path)))
+        digest.update(b'\0%d\0%d\n' % (st.st_mtime_ns, count))
+
+        dirs.extend(reversed(subdirs))
+
+    digest.update(b'%d\0%d' % (total_size, newest))
+    return digest.hexdigest()
+
+
+class Manifest(object):
+    def __init__(self, path, full_every=0, force_full=False):
+        self.path = path
+        self.full_every = full_every
+        self.runs = 0
+        self.fingerprints = {}
+        self.pending = {}
+        self.skipped = 0
+        self.skipped_seconds = 0
+
+        self._load()
+
+        self.full = force_full
+
+        if full_every > 0 and self.runs % full_every == 0:
+            self.full = True
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, ValueError) as exc:
+            LOG.warning('ignoring unreadable manifest %s: %s' % (
+                        self.path, six.text_type(exc)))
+            return
+
+        self.runs = data.get('runs', 0)
+        self.fingerprints = data.get('fingerprints', {})
+
+    def unchanged(self, job):
+        fp = fingerprint(job.source, files_from=job.files_from,
+                         command=job.command)
+        self.pending[job.id] = fp
+
+        if not self.full and self.fingerprints.get(job.key, None) == fp:
+            return True
+
+        # The job will run so forget the old fingerprint, it is only
+        # recorded again if the job succeeds.
+        self.fingerprints.pop(job.key, None)
+        return False
+
+    def skip(self, job, seconds):
+        del self.pending[job.id]
+        self.skipped += 1
+        self.skipped_seconds += seconds or 0
+
+    def record(self, job):
+        fp = self.pending.pop(job.id, None)
+
+        if fp is not None:
+            self.fingerprints[job.key] = fp
+
+    def save(self):
+        dirname = os.path.dirname(self.path)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.manifest')
+
+        data = {
+            'runs': self.runs + 1,
+            'fingerprints': self.fingerprints,
+        }
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import logging
+import os
+import re
+from rsync_backup.scheduler import job_key
+import six
+import tempfile
+from timeit import default_timer as timer
+
+
+LOG = logging.getLogger(__name__)
+
+PREFIX = 'rsync_backup_'
+
+LAST_SUCCESS = PREFIX + 'last_success_timestamp_seconds'
+
+LAST_SUCCESS_LINE = re.compile(
+    r'^' + LAST_SUCCESS + r'\{source="((?:[^"\\]|\\.)*)"\} (\S+)$')
+
+
+def escape(value):
+    value = six.text_type(value)
+    value = value.replace('\\', '\\\\').replace('\n', '\\n')
+    return value.replace('"', '\\"')
+
+
+def unescape(value):
+    return re.sub(r'\\(.)',
+                  lambda m: '\n' if m.group(1) == 'n' else m.group(1),
+                  value)
+
+
+def load_last_success(path):
+    # The metrics file itself keeps the last success of sources that
+    # did not succeed in this run.
+    last_success = {}
+
+    try:
+        with open(path) as f:
+            for line in f:
+                match = LAST_SUCCESS_LINE.match(line.rstrip('\n'))
+
+                if match is not None:
+                    source = unescape(match.group(1))
+                    last_success[source] = float(match.group(2))
+    except IOError:
+        pass
+    except ValueError as exc:
+        LOG.warning('ignoring unreadable metrics in %s: %s' % (
+                    path, six.text_type(exc)))
+
+    return last_success
+
+
+class Metrics(object):
+    def __init__(self):
+        self.families = collections.OrderedDict()
+
+    def add(self, name, value, help, labels=None, type='gauge'):
+        name = PREFIX + name
+
+        if name not in self.families:
+            self.families[name] = (help, type, [])
+
+        self.families[name][2].append((labels, value))
+
+    def render(self):
+        lines = []
+
+        for name, (help, type, samples) in self.families.items():
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, type))
+
+            for labels, value in samples:
+                label_str = ''
+
+                if labels:
+                    label_str = '{%s}' % ','.join(
+                        '%s="%s"' % (k, escape(v))
+                        for k, v in sorted(labels.items()))
+
+                lines.append('%s%s %s' % (name, label_str, repr(value)))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        dirname = os.path.dirname(path)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.metrics')
+
+        try:
+            # The collector only picks up complete files so it is
+            # written aside and moved into place.
+            os.fchmod(fd, 0o644)
+
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render())
+
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+class MetricsExporter(object):
+    """Writes a node_exporter textfile collector file for a run."""
+
+    def __init__(self, path, manager):
+        self.path = path
+        self.manager = manager
+        self.last_success = load_last_success(path)
+        self.start = None
+
+    def _busy_seconds(self):
+        # Jobs in a bundle share one rsync so it is only counted once.
+        processes = {}
+
+        for child in self.manager.supervisor.children.values():
+            process = child.bundle or child
+            processes[id(process)] = process.elapsed
+
+        return sum(processes.values())
+
+    def _common(self, metrics, execute_seconds):
+        workers = self.manager.supervisor.workers
+
+        metrics.add('phase_seconds', self.manager.walker.scan_seconds,
+                    'Seconds spent in each phase of the run.',
+                    labels={'phase': 'scan'})
+        metrics.add('phase_seconds', self.manager.planner.prepare_seconds,
+                    'Seconds spent in each phase of the run.',
+                    labels={'phase': 'prepare'})
+        metrics.add('phase_seconds', execute_seconds,
+                    'Seconds spent in each phase of the run.',
+                    labels={'phase': 'execute'})
+
+        metrics.add('workers', workers, 'Maximum amount of rsync running '
+                    'at the same time.')
+
+        utilization = 0.0
+
+        if execute_seconds > 0:
+            utilization = self._busy_seconds() / (workers * execute_seconds)
+
+        metrics.add('worker_utilization_ratio', min(utilization, 1.0),
+                    'Share of the available worker time spent running '
+                    'rsync.')
+
+        for source in sorted(self.last_success):
+            metrics.add('last_success_timestamp_seconds',
+                        self.last_success[source],
+                        'Time when every job of a source last succeeded.',
+                        labels={'source': source})
+
+    def _write(self, metrics):
+        try:
+            metrics.write(self.path)
+        except Exception as exc:
+            LOG.error('failed to write metrics to %s: %s' % (
+                      self.path, six.text_type(exc)))
+
+    def begin(self):
+        self.start = timer()
+
+    def progress(self):
+        metrics = Metrics()
+        self._common(metrics, timer() - self.start)
+
+        metrics.add('run_in_progress', 1, 'If a run is in progress.')
+
+        states = collections.Counter(
+            c.state for c in self.manager.supervisor.children.values())
+
+        for state in sorted(states):
+            metrics.add('jobs', states[state], 'Amount of jobs in each '
+                        'state in the current run.', labels={'state': state})
+
+        self._write(metrics)
+
+    def finish(self, records, started, finished, return_value, skipped=0):
+        children = self.manager.supervisor.children
+        failed_sources = set()
+
+        for record in records:
+            child = children.get(record.job_id, None)
+
+            if not record.successful and child is not None:
+                failed_sources.add(child.job.template.source)
+
+        if not self.manager.supervisor.stopping:
+            for job in self.manager.jobs:
+                source = job['source']['path']
+
+                if source not in failed_sources:
+                    self.last_success[source] = finished
+
+        metrics = Metrics()
+        self._common(metrics, self.manager.execute_seconds)
+
+        successful = len([r for r in records if r.successful])
+
+        metrics.add('run_in_progress', 0, 'If a run is in progress.')
+        metrics.add('run_start_timestamp_seconds', started,
+                    'Time when the last run started.')
+        metrics.add('run_end_timestamp_seconds', finished,
+                    'Time when the last run ended.')
+        metrics.add('run_duration_seconds', finished - started,
+                    'Duration of the last run.')
+        metrics.add('run_return_value', return_value,
+                    'Return value of the last run.')
+
+        for result, count in (('successful', successful),
+                              ('failed', len(records) - successful),
+                              ('skipped', skipped)):
+            metrics.add('run_jobs', count, 'Amount of jobs in the last '
+                        'run by result.', labels={'result': result})
+
+        metrics.add('run_bytes_sent', sum(r.bytes or 0 for r in records),
+                    'Bytes sent by all jobs in the last run.')
+        metrics.add('run_files_transferred',
+                    sum(r.files or 0 for r in records),
+                    'Files transferred by all jobs in the last run.')
+
+        for record in records:
+            # Split jobs share source and destination so the key
+            # keeps every series unique.
+            key = record.key
+
+            if key is None:
+                key = job_key(record.source, record.destination)
+
+            labels = {'source': record.source,
+                      'destination': record.destination, 'key': key}
+
+            metrics.add('job_duration_seconds', record.seconds,
+                        'Duration of the job in the last run.',
+                        labels=labels)
+            metrics.add('job_success', int(record.successful),
+                        'If the job succeeded in the last run.',
+                        labels=labels)
+
+            if record.returncode is not None:
+                metrics.add('job_returncode', record.returncode,
+                            'Return code of rsync in the last run.',
+                            labels=labels)
+
+            if record.bytes is not None:
+                metrics.add('job_bytes_sent', record.bytes,
+                            'Bytes sent by the job in the last run.',
+                            labels=labels)
+
+            if record.files is not None:
+                metrics.add('job_files_transferred', record.files,
+                            'Files transferred by the job in the last '
+                            'run.', labels=labels)
+
+        self._write(metrics)
+
+        LOG.debug('wrote metrics to %s' % self.path)
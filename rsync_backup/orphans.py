@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from concurrent import futures
+import logging
+import os
+import six
+from timeit import default_timer as timer
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_THREADS = 8
+
+
+def find_orphans(source, destination, depth, walker):
+    """Destination directories down to depth that has no source.
+
+    Exploded jobs only covers the directories at depth so the copy of
+    a source directory that was removed is never deleted by rsync.
+    """
+
+    orphans = []
+    level = [(source, destination)]
+
+    for _ in range(depth):
+        src_entries = walker.scan([s for s, _ in level])
+        dst_entries = walker.scan([d for _, d in level],
+                                  follow_symlinks=False)
+
+        new_level = []
+
+        for (src, dst), src_ent, dst_ent in zip(level, src_entries,
+                                                dst_entries):
+            # Nothing can be told about a directory that cannot be read.
+            if src_ent.error is not None or dst_ent.error is not None:
+                continue
+
+            names = set(os.path.basename(d) for d in src_ent.dirs)
+
+            # An empty source is more likely to be a missing mount than
+            # a source where everything was removed.
+            if src == source and not names and not src_ent.files:
+                LOG.warning('source %s is empty, not looking for orphans '
+                            'in %s' % (source, destination))
+                return []
+
+            for path in dst_ent.dirs:
+                name = os.path.basename(path)
+
+                if name in names:
+                    new_level.append((os.path.join(src, name), path))
+                else:
+                    orphans.append(path)
+
+        level = new_level
+
+    return sorted(orphans)
+
+
+class TreeRemover(object):
+    """Removes directory trees using a thread pool.
+
+    Directories on the same level is emptied of files in parallel
+    while finding the directories below them, then every directory is
+    removed with the deepest level first. Removing is bound by the
+    latency of each unlink so this is a lot faster than rm -rf.
+    """
+
+    def __init__(self, threads=DEFAULT_THREADS):
+        self.threads = threads
+        self.removed_files = 0
+        self.removed_dirs = 0
+        self.errors = 0
+        self.remove_seconds = 0
+
+    def _empty(self, path):
+        # Unlinks everything but directories which is returned.
+        dirs = []
+        files = 0
+        errors = 0
+
+        try:
+            it = os.scandir(path)
+        except OSError as exc:
+            LOG.error('failed to scan directory %s: %s' % (
+                      path, six.text_type(exc)))
+            return dirs, files, 1
+
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                    continue
+
+                os.unlink(entry.path)
+            except OSError as exc:
+                LOG.error('failed to remove %s: %s' % (
+                          entry.path, six.text_type(exc)))
+                errors += 1
+                continue
+
+            files += 1
+
+        return dirs, files, errors
+
+    def _rmdir(self, path):
+        try:
+            os.rmdir(path)
+        except OSError as exc:
+            LOG.error('failed to remove directory %s: %s' % (
+                      path, six.text_type(exc)))
+            return False
+
+        return True
+
+    def remove(self, paths):
+        start = timer()
+
+        levels = []
+        level = list(paths)
+        threads = max(self.threads, 1)
+
+        with futures.ThreadPoolExecutor(max_workers=threads) as ex:
+            while level:
+                levels.append(level)
+                new_level = []
+
+                for dirs, files, errors in ex.map(self._empty, level):
+                    new_level += dirs
+                    self.removed_files += files
+                    self.errors += errors
+
+                level = new_level
+
+            for level in reversed(levels):
+                for removed in ex.map(self._rmdir, level):
+                    if removed:
+                        self.removed_dirs += 1
+                    else:
+                        self.errors += 1
+
+        self.remove_seconds += timer() - start
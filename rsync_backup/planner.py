@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from concurrent import futures
+import logging
+import os
+import six
+from timeit import default_timer as timer
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_THREADS = 8
+
+
+class DestinationPath(object):
+    __slots__ = ('path', 'uid', 'gid', 'mode')
+
+    def __init__(self, path, uid, gid, mode):
+        self.path = path
+        self.uid = uid
+        self.gid = gid
+        self.mode = mode
+
+    @property
+    def depth(self):
+        return self.path.count(os.sep)
+
+    def create(self):
+        try:
+            os.mkdir(self.path)
+        except FileExistsError:
+            # Someone else created it, leave it as it is.
+            return
+
+        os.chown(self.path, self.uid, self.gid)
+        os.chmod(self.path, self.mode)
+
+
+class DestinationPlanner(object):
+    """Plans and creates the destination directories for exploded jobs.
+
+    Every destination directory is only checked once no matter how
+    many jobs share it and missing directories is created in parallel,
+    parents before children.
+    """
+
+    def __init__(self, threads=DEFAULT_THREADS):
+        self.threads = threads
+        self.prepare_seconds = 0
+        self.created = 0
+        self._known = set()
+
+    def _parts(self, job):
+        # Every destination directory from the parent down to the job
+        # together with the source directory it mirrors.
+        parts = []
+
+        # If it was not exploded we dont need to fix anything on
+        # the destination.
+        if not job.exploded:
+            return parts
+
+        previous_dest = job.parent_target
+        previous_src = job.parent_source
+
+        for part in os.path.normpath(job.relpath).split(os.sep):
+            previous_dest = os.path.join(previous_dest, part)
+            previous_src = os.path.join(previous_src, part)
+            parts.append((previous_dest, previous_src))
+
+        return parts
+
+    def plan(self, job):
+        paths = []
+
+        for part_path, source_part in self._parts(job):
+            if part_path in self._known:
+                continue
+
+            if os.path.isdir(part_path):
+                self._known.add(part_path)
+                continue
+
+            try:
+                source_part_stat = os.stat(source_part)
+            except OSError as exc:
+                # The source can be removed after it was scanned, only
+                # the jobs below it fails.
+                raise OSError(exc.errno, 'cannot create destination %s '
+                              'because source %s does not exist' % (
+                                  part_path, source_part))
+
+            self._known.add(part_path)
+
+            LOG.info('this run will create destination dir: {} '
+                     'with owner {} group: {} and '
+                     'mode: {:o}'.format(
+                         part_path, source_part_stat.st_uid,
+                         source_part_stat.st_gid,
+                         source_part_stat.st_mode))
+
+            paths.append(DestinationPath(part_path,
+                                         source_part_stat.st_uid,
+                                         source_part_stat.st_gid,
+                                         source_part_stat.st_mode))
+
+        return paths
+
+    def _create(self, dest_path):
+        try:
+            dest_path.create()
+        except Exception as exc:
+            LOG.error('failed to prepare destination path %s: %s' % (
+                      dest_path.path, six.text_type(exc)))
+            return False
+
+        return True
+
+    def create(self, paths):
+        # Returns the paths that could not be created.
+        levels = {}
+        failed = set()
+
+        for dest_path in paths:
+            levels.setdefault(dest_path.depth, []).append(dest_path)
+
+        for depth in sorted(levels):
+            level = []
+
+            for dest_path in levels[depth]:
+                # Nothing can be created below a failed parent.
+                if os.path.dirname(dest_path.path) in failed:
+                    failed.add(dest_path.path)
+                else:
+                    level.append(dest_path)
+
+            if self.threads <= 1 or len(level) <= 1:
+                results = [self._create(p) for p in level]
+            else:
+                threads = min(self.threads, len(level))
+
+                with futures.ThreadPoolExecutor(max_workers=threads) as ex:
+                    results = list(ex.map(self._create, level))
+
+            for dest_path, created in zip(level, results):
+                if created:
+                    self.created += 1
+                else:
+                    failed.add(dest_path.path)
+
+        # Tried again by the next jobs that needs them.
+        self._known -= failed
+
+        return failed
+
+    def prepare(self, jobs):
+        # Returns the jobs whose destination could not be prepared,
+        # the other jobs can still run.
+        start = timer()
+
+        paths = []
+        failed = []
+
+        for job in jobs:
+            try:
+                paths += self.plan(job)
+            except OSError as exc:
+                LOG.error('failed to prepare destination of job %s: %s' % (
+                          job.id, six.text_type(exc)))
+                failed.append(job)
+
+        failed_paths = self.create(paths)
+
+        if failed_paths:
+            for job in jobs:
+                if job in failed:
+                    continue
+
+                if any(p in failed_paths for p, _ in self._parts(job)):
+                    failed.append(job)
+
+        self.prepare_seconds += timer() - start
+
+        return failed
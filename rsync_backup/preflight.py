@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import logging
+import os
+import six
+import tempfile
+import threading
+from timeit import default_timer as timer
+
+
+LOG = logging.getLogger(__name__)
+
+# Seconds to wait for the checks of all paths.
+DEFAULT_TIMEOUT = 30
+
+
+def check_path(path, mount=False, writable=False, min_free=None):
+    # Returns what is wrong with the path or None if it is healthy.
+    if not os.path.isdir(path):
+        return 'is not a existing directory'
+
+    if mount and not os.path.ismount(path):
+        return 'is not a mount'
+
+    if min_free is not None:
+        stat = os.statvfs(path)
+        free = stat.f_bavail * stat.f_frsize
+
+        if free < min_free:
+            return 'has %i bytes free which is less than %i' % (
+                free, min_free)
+
+    if writable:
+        fd, tmp_path = tempfile.mkstemp(dir=path, prefix='.rsync-backup')
+        os.close(fd)
+        os.unlink(tmp_path)
+
+    return None
+
+
+class PathCheck(object):
+    __slots__ = ('path', 'mount', 'writable', 'min_free', 'error')
+
+    def __init__(self, path, mount=False, writable=False, min_free=None):
+        self.path = path
+        self.mount = mount
+        self.writable = writable
+        self.min_free = min_free
+        self.error = None
+
+    def run(self):
+        try:
+            self.error = check_path(self.path, mount=self.mount,
+                                    writable=self.writable,
+                                    min_free=self.min_free)
+        except Exception as exc:
+            self.error = six.text_type(exc)
+
+
+def get_checks(job):
+    source = job['source']
+    destination = job['destination']
+
+    return [
+        (source['path'], source.get('mount', False), False,
+         source.get('min_free', None)),
+        (destination['path'], destination.get('mount', False), True,
+         destination.get('min_free', None)),
+    ]
+
+
+def run_checks(checks, timeout=DEFAULT_TIMEOUT):
+    # Every path is checked in its own daemon thread so a path on a
+    # hung mount neither holds back the others nor the process from
+    # exiting.
+    threads = []
+
+    for check in checks:
+        thread = threading.Thread(target=check.run, daemon=True,
+                                  name='preflight %s' % check.path)
+        thread.start()
+        threads.append(thread)
+
+    deadline = timer() + timeout
+    errors = {}
+
+    for thread, check in zip(threads, checks):
+        thread.join(max(deadline - timer(), 0))
+
+        if thread.is_alive():
+            errors[check] = 'did not respond within %i secs' % timeout
+        elif check.error is not None:
+            errors[check] = check.error
+
+    return errors
+
+
+def preflight(jobs, timeout=DEFAULT_TIMEOUT):
+    """Checks the source and destination of every job.
+
+    Returns the jobs that can be run and the jobs that is skipped
+    because a path is missing, not mounted, full or not writable.
+    """
+
+    start = timer()
+    checks = collections.OrderedDict()
+
+    # Paths shared by several jobs is only checked once.
+    for job in jobs:
+        for key in get_checks(job):
+            if key not in checks:
+                checks[key] = PathCheck(*key)
+
+    errors = run_checks(list(checks.values()), timeout)
+
+    LOG.debug('checked %i paths in %.2f secs' % (
+              len(checks), timer() - start))
+
+    healthy = []
+    skipped = []
+
+    for job in jobs:
+        problems = ['%s %s' % (checks[key].path, errors[checks[key]])
+                    for key in get_checks(job) if checks[key] in errors]
+
+        if problems:
+            LOG.error('skipping job %s -> %s since %s' % (
+                      job['source']['path'], job['destination']['path'],
+                      ', '.join(problems)))
+            skipped.append(job)
+            continue
+
+        healthy.append(job)
+
+    return healthy, skipped
@@ -14,9 +14,15 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import asyncio
 import os
-import six
-import subprocess
+
+
+# Amount of bytes to read from rsync output at a time.
+READ_SIZE = 64 * 1024
+
+# Buffer limit of the output streams, the asyncio default.
+STREAM_LIMIT = 64 * 1024
 
 
 def strip_trailing_slash(directory):
@@ -57,8 +63,36 @@ def get_exclusions(exclusions=[]):
     return result
 
 
+def get_stats_options(options=[]):
+    # The stats are parsed from the output to report how much
+    # was transferred.
+    if '--stats' in options:
+        return []
+
+    return ['--stats']
+
+
+def get_files_from_options(files_from=None):
+    if files_from is None:
+        return []
+
+    # The file list is written null separated on stdin, -a does not
+    # imply --recursive with --files-from and directories in the list
+    # must be synced with everything below them.
+    return ['--files-from=-', '--from0', '--recursive']
+
+
+def get_link_dest_options(link_dest=None):
+    if link_dest is None:
+        return []
+
+    # Unchanged files is hard linked from here instead of copied.
+    return ['--link-dest=%s' % link_dest]
+
+
 def get_rsync_command(rsync_path, source, destination, exclusions=[],
-                      sync_source_contents=True, options=[]):
+                      sync_source_contents=True, options=[],
+                      files_from=None, link_dest=None):
     if os.path.isfile(source):
         sync_source_contents = False
 
@@ -66,23 +100,88 @@ def get_rsync_command(rsync_path, source, destination, exclusions=[],
                                    sync_source_contents)
 
     exclusions = get_exclusions(exclusions)
+    stats = get_stats_options(options)
+    files = get_files_from_options(files_from)
+    links = get_link_dest_options(link_dest)
 
-    rsync_command = [rsync_path]
-    return (rsync_command + options + exclusions + dirs)
+    rsync_command = [rsync_path] + list(options)
+    return (rsync_command + stats + files + links + exclusions + dirs)
 
 
-def run_rsync(rsync_path, source, destination, exclusions=[],
-              sync_source_contents=True, options=[]):
-    rsync_command = get_rsync_command(
-        rsync_path, source, destination, exclusions,
-        sync_source_contents, options)
+def get_bundle_command(rsync_path, source, relpaths, destination,
+                       exclusions=[], options=[], link_dest=None):
+    # The /./ marks where the path to keep on the destination starts
+    # when using --relative.
+    sources = [os.path.join(strip_trailing_slash(source), '.', relpath)
+               for relpath in relpaths]
 
-    ret_code = 0
+    exclusions = get_exclusions(exclusions)
+    stats = get_stats_options(options)
+    links = get_link_dest_options(link_dest)
 
-    if six.PY2:
-        ret_code = subprocess.call(rsync_command, stdout=subprocess.PIPE)
-    else:
-        process = subprocess.run(rsync_command, stdout=subprocess.PIPE)
-        ret_code = process.returncode
+    sources.append(add_trailing_slash(destination))
+
+    rsync_command = [rsync_path] + list(options) + stats + ['--relative']
+    return (rsync_command + links + exclusions + sources)
+
+
+def has_progress_output(command):
+    # If rsync prints its progress while running.
+    for arg in command:
+        if arg in ('--progress', '--info=progress2'):
+            return True
+
+        if arg.startswith('--info=') and 'progress' in arg:
+            return True
+
+        if arg.startswith('-') and not arg.startswith('--') and 'P' in arg:
+            return True
+
+    return False
+
+
+async def spawn_rsync(rsync_command, files_from=None):
+    # Does what asyncio.create_subprocess_exec does but also returns
+    # the transport, closing it closes the pipes even when rsync never
+    # exits. SubprocessStreamProtocol and the Process constructor is
+    # not documented, test_spawn_rsync catches if they change.
+    loop = asyncio.get_event_loop()
+    stdin = asyncio.subprocess.DEVNULL
+
+    if files_from is not None:
+        stdin = asyncio.subprocess.PIPE
+
+    def protocol_factory():
+        return asyncio.subprocess.SubprocessStreamProtocol(STREAM_LIMIT,
+                                                           loop)
+
+    # rsync gets its own session so that it can be signaled as a
+    # group without also signaling us.
+    transport, protocol = await loop.subprocess_exec(
+        protocol_factory, *rsync_command, stdin=stdin,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        start_new_session=True)
+
+    return asyncio.subprocess.Process(transport, protocol, loop), transport
+
+
+async def write_files_from(stream, files_from):
+    try:
+        for name in files_from:
+            stream.write(os.fsencode(name) + b'\0')
+            await stream.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # rsync exited early, the error is reported from its output.
+        pass
+    finally:
+        stream.close()
+
+
+async def read_output(stream, parser, stderr=False):
+    while True:
+        data = await stream.read(READ_SIZE)
+
+        if not data:
+            break
 
-    return ret_code
+        parser.feed(data, stderr=stderr)
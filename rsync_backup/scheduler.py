@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import heapq
+import json
+import logging
+import os
+import six
+import tempfile
+
+
+LOG = logging.getLogger(__name__)
+
+# Used to turn a size estimate into seconds for jobs that
+# has never been run before, 50 MiB/s.
+DEFAULT_THROUGHPUT = 50 * 1024 * 1024
+
+# Maximum amount of directory entries to look at when
+# estimating the size of a job without history.
+ESTIMATE_ENTRIES = 10000
+
+# Weight of the latest run when updating the stored duration.
+HISTORY_WEIGHT = 0.5
+
+
+def job_key(source, destination):
+    return '%s -> %s' % (source, destination)
+
+
+def measure_tree(path, limit=ESTIMATE_ENTRIES):
+    # Returns the size and amount of entries found while looking at
+    # no more than limit entries and if the whole tree was seen.
+    total = 0
+    seen = 0
+    dirs = [path]
+
+    while dirs and seen < limit:
+        current = dirs.pop()
+
+        try:
+            it = os.scandir(current)
+        except OSError as exc:
+            LOG.debug('could not scan %s for size estimate: %s' % (
+                      current, six.text_type(exc)))
+            continue
+
+        for entry in it:
+            seen += 1
+
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                else:
+                    total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                pass
+
+            if seen >= limit:
+                return total, seen, False
+
+    return total, seen, not dirs
+
+
+def estimate_size(path, limit=ESTIMATE_ENTRIES):
+    return measure_tree(path, limit)[0]
+
+
+def simulate_makespan(durations, workers):
+    # Each duration is started on the first free worker in the given
+    # order, like the supervisor does.
+    finish = [0.0] * workers
+
+    for duration in durations:
+        start = heapq.heappop(finish)
+        heapq.heappush(finish, start + duration)
+
+    return max(finish)
+
+
+class DurationHistory(object):
+    def __init__(self, path=None):
+        self.path = path
+        self.durations = {}
+
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            LOG.debug('no duration history found at %s' % self.path)
+            return
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, ValueError) as exc:
+            LOG.warning('ignoring unreadable duration history %s: %s' % (
+                        self.path, six.text_type(exc)))
+            return
+
+        if isinstance(data, dict):
+            self.durations = data
+
+    def get(self, key):
+        return self.durations.get(key, None)
+
+    def record(self, key, seconds):
+        previous = self.durations.get(key, None)
+
+        if previous is None:
+            self.durations[key] = seconds
+        else:
+            latest = HISTORY_WEIGHT * seconds
+            self.durations[key] = latest + (1 - HISTORY_WEIGHT) * previous
+
+    def save(self):
+        if self.path is None:
+            return
+
+        dirname = os.path.dirname(self.path)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.timings')
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.durations, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+class Scheduler(object):
+    def __init__(self, history=None, throughput=DEFAULT_THROUGHPUT):
+        if history is None:
+            history = DurationHistory()
+
+        self.history = history
+        self.throughput = throughput
+
+    def expected_seconds(self, job):
+        seconds = self.history.get(job.key)
+
+        if seconds is not None:
+            return seconds
+
+        size = job.size
+
+        if size is None:
+            size = estimate_size(job.source)
+
+        seconds = float(size) / self.throughput
+
+        LOG.debug('job %s has no history, estimated %i bytes '
+                  '(%.1f secs)' % (job.id, size, seconds))
+
+        return seconds
+
+    def order(self, jobs):
+        expected = {}
+
+        for job in jobs:
+            expected[job.id] = self.expected_seconds(job)
+
+        return sorted(jobs, key=lambda j: expected[j.id], reverse=True)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+from rsync_backup.orphans import DEFAULT_THREADS, TreeRemover
+import os
+import re
+import six
+import sys
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+LATEST = 'latest'
+
+GENERATION_FORMAT = '%Y-%m-%dT%H%M%S'
+
+GENERATION = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{6}$')
+
+
+class Snapshots(object):
+    """Dated generations of a destination.
+
+    Every run writes a new generation and files that did not change
+    is hard linked from the last complete generation that the latest
+    symlink points to. The symlink is only switched once every job
+    of the generation has succeeded.
+    """
+
+    def __init__(self, destination, keep, resume=False, now=None):
+        self.destination = destination
+        self.keep = keep
+        self.previous = self._latest()
+        self.generation = time.strftime(GENERATION_FORMAT,
+                                        time.localtime(now))
+        # Set when any job writing the generation failed.
+        self.failed = False
+
+        if resume:
+            # Continue writing the generation of the interrupted run.
+            newer = self.generations()
+
+            if self.previous is not None:
+                previous = os.path.basename(self.previous)
+                newer = [g for g in newer if g > previous]
+
+            if newer:
+                self.generation = newer[-1]
+                LOG.info('resuming snapshot %s of %s' % (
+                         self.generation, destination))
+
+        self.path = os.path.join(destination, self.generation)
+
+        if self.previous == self.path:
+            self.previous = None
+
+    def _latest(self):
+        try:
+            target = os.readlink(os.path.join(self.destination, LATEST))
+        except OSError:
+            return None
+
+        path = os.path.join(self.destination, target)
+
+        if not os.path.isdir(path):
+            LOG.warning('latest snapshot %s of %s does not exist' % (
+                        target, self.destination))
+            return None
+
+        return os.path.normpath(path)
+
+    def generations(self):
+        try:
+            names = os.listdir(self.destination)
+        except OSError as exc:
+            LOG.error('failed to list snapshots in %s: %s' % (
+                      self.destination, six.text_type(exc)))
+            return []
+
+        return sorted(n for n in names if GENERATION.match(n))
+
+    def link_dest(self, relpath=None):
+        if self.previous is None:
+            return None
+
+        path = self.previous
+
+        if relpath is not None:
+            path = os.path.join(path, relpath)
+
+        # Directories that is new since the last generation has nothing
+        # to link against.
+        if not os.path.isdir(path):
+            return None
+
+        return path
+
+    def create(self):
+        try:
+            os.mkdir(self.path)
+        except FileExistsError:
+            pass
+        except OSError as exc:
+            LOG.error('failed to create snapshot %s: %s' % (
+                      self.path, six.text_type(exc)))
+            sys.exit(1)
+
+    def publish(self):
+        latest = os.path.join(self.destination, LATEST)
+        tmp_path = os.path.join(self.destination, '.%s.tmp' % LATEST)
+
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+
+        # The link is relative so the snapshots can be moved, it is
+        # created aside and renamed over the old one.
+        os.symlink(self.generation, tmp_path)
+        os.replace(tmp_path, latest)
+
+        LOG.info('snapshot %s of %s is complete' % (
+                 self.generation, self.destination))
+
+    def expired(self):
+        # The generation being written is not counted, the latest is
+        # never removed.
+        kept = set([self.generation])
+
+        if self.previous is not None:
+            kept.add(os.path.basename(self.previous))
+
+        generations = [g for g in self.generations() if g != self.generation]
+
+        return [g for g in generations[:-self.keep] if g not in kept]
+
+    def prune(self, threads=DEFAULT_THREADS):
+        expired = self.expired()
+
+        if not expired:
+            return None
+
+        LOG.info('removing %i expired snapshots of %s: %s' % (
+                 len(expired), self.destination, ', '.join(expired)))
+
+        # The subtrees of every generation is removed in parallel.
+        remover = TreeRemover(threads)
+        remover.remove([os.path.join(self.destination, g)
+                        for g in expired])
+
+        LOG.info('removed %i expired snapshots of %s with %i files in '
+                 '%.2f secs' % (len(expired), self.destination,
+                                remover.removed_files,
+                                remover.remove_seconds))
+
+        return remover
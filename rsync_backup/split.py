@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import heapq
+import itertools
+import logging
+import os
+from rsync_backup.walker import Walker
+import six
+
+
+LOG = logging.getLogger(__name__)
+
+BY_BYTES = 'bytes'
+BY_FILES = 'files'
+
+
+class TreeNode(object):
+    __slots__ = ('path', 'children', 'own_bytes', 'own_files',
+                 'total_bytes', 'total_files')
+
+    def __init__(self, path):
+        self.path = path
+        self.children = []
+        self.own_bytes = 0
+        self.own_files = 0
+        self.total_bytes = 0
+        self.total_files = 0
+
+
+class Shard(object):
+    __slots__ = ('path', 'files', 'bytes', 'count')
+
+    def __init__(self, path, bytes, count, files=None):
+        self.path = path
+        self.bytes = bytes
+        self.count = count
+        # If set only these names directly inside path is synced,
+        # directories with everything below them.
+        self.files = files
+
+
+def scan_files(path):
+    files = []
+
+    try:
+        it = os.scandir(path)
+    except OSError as exc:
+        LOG.warning('failed to scan %s: %s' % (path, six.text_type(exc)))
+        return files
+
+    for entry in it:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                continue
+
+            size = entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            continue
+
+        files.append((entry.name, size))
+
+    return files
+
+
+def scan_tree(path, walker=None):
+    if walker is None:
+        walker = Walker()
+
+    root = TreeNode(path)
+    level = [root]
+    order = []
+
+    while level:
+        order += level
+        new_level = []
+
+        results = walker.scan([n.path for n in level], sizes=True,
+                              follow_symlinks=False)
+
+        for node, entries in zip(level, results):
+            node.own_bytes = entries.bytes
+            node.own_files = entries.files
+            node.children = [TreeNode(d) for d in entries.dirs]
+            new_level += node.children
+
+        level = new_level
+
+    # Children is always after their parent so summing up in
+    # reverse gives the totals for each subtree.
+    for node in reversed(order):
+        node.total_bytes += node.own_bytes
+        node.total_files += node.own_files
+
+        for child in node.children:
+            node.total_bytes += child.total_bytes
+            node.total_files += child.total_files
+
+    return root
+
+
+def _weight(nbytes, files, by):
+    return nbytes if by == BY_BYTES else files
+
+
+def _pack(path, entries, limit, by):
+    # Worst fit decreasing, every entry goes into the least full
+    # shard it fits in so the shards gets about the same size.
+    heap = []
+    counter = itertools.count()
+
+    entries = sorted(entries, key=lambda e: (-_weight(e[1], e[2], by), e[0]))
+
+    for name, nbytes, nfiles in entries:
+        weight = _weight(nbytes, nfiles, by)
+
+        if heap and heap[0][0] + weight <= limit:
+            load, i, shard = heapq.heappop(heap)
+        else:
+            load, i, shard = 0, next(counter), Shard(path, 0, 0, files=[])
+
+        shard.files.append(name)
+        shard.bytes += nbytes
+        shard.count += nfiles
+        heapq.heappush(heap, (load + weight, i, shard))
+
+    for _, _, shard in sorted(heap, key=lambda h: h[1]):
+        shard.files.sort()
+        yield shard
+
+
+def partition(node, limit, by=BY_BYTES):
+    stack = [node]
+
+    while stack:
+        node = stack.pop()
+        weight = _weight(node.total_bytes, node.total_files, by)
+
+        if weight <= limit:
+            yield Shard(node.path, node.total_bytes, node.total_files)
+            continue
+
+        # Subdirectories that fits and files directly in a split
+        # directory is packed together by name, the rest is split
+        # further.
+        entries = []
+        large = []
+
+        for child in node.children:
+            if _weight(child.total_bytes, child.total_files, by) > limit:
+                large.append(child)
+                continue
+
+            entries.append((os.path.basename(child.path),
+                            child.total_bytes, child.total_files))
+
+        if node.own_files > 0:
+            entries += [(name, size, 1)
+                        for name, size in scan_files(node.path)]
+
+        stack.extend(reversed(large))
+
+        for shard in _pack(node.path, entries, limit, by):
+            yield shard
+
+
+def get_limit(root, split):
+    if 'max_bytes' in split:
+        return split['max_bytes'], BY_BYTES
+
+    if 'max_files' in split:
+        return split['max_files'], BY_FILES
+
+    by = split.get('by', BY_BYTES)
+    total = _weight(root.total_bytes, root.total_files, by)
+    # Rounded up so the remainder does not end up in a shard of its
+    # own.
+    shards = split['target_shards']
+    return max(-(-total // shards), 1), by
+
+
+def split_tree(path, split, walker=None):
+    root = scan_tree(path, walker=walker)
+    limit, by = get_limit(root, split)
+
+    LOG.debug('splitting %s (%i bytes %i files) into shards of at '
+              'most %i %s' % (path, root.total_bytes, root.total_files,
+                              limit, by))
+
+    return list(partition(root, limit, by))
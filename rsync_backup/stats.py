@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import logging
+import re
+
+
+LOG = logging.getLogger(__name__)
+
+# Longest line we keep in memory, anything above is cut.
+MAX_LINE = 64 * 1024
+
+# Amount of stderr lines to keep for error reporting.
+MAX_ERRORS = 20
+
+UNITS = {
+    '': 1,
+    'K': 1000,
+    'M': 1000 ** 2,
+    'G': 1000 ** 3,
+    'T': 1000 ** 4,
+    'P': 1000 ** 5,
+}
+
+NUMBER = r'([\d,.]+)([KMGTP]?)'
+
+# --stats lines, older rsync versions call regular files just files.
+STATS = [
+    ('files', re.compile(r'^Number of files: ' + NUMBER)),
+    ('files_created', re.compile(r'^Number of created files: ' + NUMBER)),
+    ('files_deleted', re.compile(r'^Number of deleted files: ' + NUMBER)),
+    ('files_transferred', re.compile(
+        r'^Number of (?:regular )?files transferred: ' + NUMBER)),
+    ('total_size', re.compile(r'^Total file size: ' + NUMBER)),
+    ('transferred_size', re.compile(
+        r'^Total transferred file size: ' + NUMBER)),
+    ('literal_data', re.compile(r'^Literal data: ' + NUMBER)),
+    ('matched_data', re.compile(r'^Matched data: ' + NUMBER)),
+    ('bytes_sent', re.compile(r'^Total bytes sent: ' + NUMBER)),
+    ('bytes_received', re.compile(r'^Total bytes received: ' + NUMBER)),
+    ('speedup', re.compile(r'speedup is ([\d,.]+)')),
+]
+
+STATS_PREFIXES = ('Number of ', 'Total ', 'Literal data', 'Matched data',
+                  'total size')
+
+# --info=progress2 line, like:
+# 1,238,099,968  42%   59.01MB/s    0:00:13 (xfr#5, to-chk=1004/1051)
+PROGRESS = re.compile(
+    r'^\s*' + NUMBER + r'\s+(\d+)%\s+([\d,.]+)([kKMGTP]?)B/s'
+    r'(?:.*xfr#(\d+))?')
+
+
+def parse_number(value, unit=''):
+    value = value.replace(',', '')
+
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+
+    return int(number * UNITS.get(unit.upper(), 1))
+
+
+class RsyncResult(object):
+    FIELDS = [name for name, _ in STATS]
+
+    def __init__(self, returncode, seconds, stats=None, errors=None):
+        self.returncode = returncode
+        self.seconds = seconds
+        self.errors = errors or []
+
+        stats = stats or {}
+
+        for name in self.FIELDS:
+            setattr(self, name, stats.get(name, None))
+
+    def share(self, fraction):
+        # Used to split the result of a bundled rsync between the jobs
+        # in it, the values is divided by the fraction of the size.
+        stats = {}
+
+        for name in self.FIELDS:
+            value = getattr(self, name)
+
+            if value is not None and name != 'speedup':
+                value = int(value * fraction)
+
+            stats[name] = value
+
+        return RsyncResult(self.returncode, self.seconds * fraction,
+                           stats=stats, errors=self.errors)
+
+    @property
+    def throughput(self):
+        if self.bytes_sent is None or not self.seconds:
+            return None
+
+        return self.bytes_sent / self.seconds
+
+
+class OutputParser(object):
+    """Parses rsync output as it is read.
+
+    Only the parsed values and the last few stderr lines are kept
+    so memory is bounded no matter how much rsync prints.
+    """
+
+    def __init__(self, job_id=None):
+        self.job_id = job_id
+        self.stats = {}
+        self.errors = collections.deque(maxlen=MAX_ERRORS)
+        self.output_bytes = 0
+        self.progress_bytes = None
+        self.progress_percent = None
+        self.progress_rate = None
+        self.progress_files = None
+        self._partial = {False: b'', True: b''}
+
+    def feed(self, data, stderr=False):
+        self.output_bytes += len(data)
+
+        buf = self._partial[stderr] + data
+        lines = re.split(b'[\r\n]', buf)
+        partial = lines.pop()
+
+        if len(partial) > MAX_LINE:
+            partial = partial[:MAX_LINE]
+
+        self._partial[stderr] = partial
+
+        for line in lines:
+            if line:
+                self.line(line.decode('utf-8', 'replace'), stderr)
+
+    def close(self):
+        for stderr in (False, True):
+            partial = self._partial[stderr]
+            self._partial[stderr] = b''
+
+            if partial:
+                self.line(partial.decode('utf-8', 'replace'), stderr)
+
+    def line(self, line, stderr=False):
+        if stderr:
+            LOG.warning('job %s rsync: %s' % (self.job_id, line))
+            self.errors.append(line)
+            return
+
+        match = PROGRESS.match(line)
+
+        if match:
+            self.progress_bytes = parse_number(match.group(1),
+                                               match.group(2))
+            self.progress_percent = int(match.group(3))
+            self.progress_rate = parse_number(match.group(4),
+                                              match.group(5))
+
+            if match.group(6) is not None:
+                self.progress_files = int(match.group(6))
+
+            return
+
+        # Cheap check so file listings from -v is not matched
+        # against every regex.
+        if not line.startswith(STATS_PREFIXES):
+            return
+
+        for name, regex in STATS:
+            match = regex.search(line)
+
+            if match is None:
+                continue
+
+            if name == 'speedup':
+                self.stats[name] = float(match.group(1).replace(',', ''))
+            else:
+                self.stats[name] = parse_number(*match.groups())
+
+            return
+
+    def result(self, returncode, seconds):
+        return RsyncResult(returncode, seconds, stats=self.stats,
+                           errors=list(self.errors))
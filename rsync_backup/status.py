@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import json
+import logging
+from rsync_backup.scheduler import simulate_makespan
+from rsync_backup.supervisor import CANCELLED, DONE, FAILED, KILLED
+from rsync_backup.supervisor import QUEUED, RUNNING
+import os
+import six
+import socket
+import stat
+import time
+from timeit import default_timer as timer
+
+
+LOG = logging.getLogger(__name__)
+
+STATUS_SOCKET = 'status.sock'
+
+# Seconds the status command waits for a answer.
+DEFAULT_TIMEOUT = 10
+
+
+def get_socket_path(config, state_dir=None):
+    # Served in the state dir unless the config says otherwise.
+    path = config.get('status_socket', None)
+
+    if path is None and state_dir is not None:
+        path = os.path.join(state_dir, STATUS_SOCKET)
+
+    return path
+
+
+def get_status(path, timeout=DEFAULT_TIMEOUT):
+    # The server writes the status and closes the connection.
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    data = b''
+
+    try:
+        sock.connect(path)
+
+        while True:
+            chunk = sock.recv(65536)
+
+            if not chunk:
+                break
+
+            data += chunk
+    finally:
+        sock.close()
+
+    return json.loads(data.decode('utf-8'))
+
+
+def remaining_seconds(child):
+    # Guessed from the progress of rsync when it prints it and from
+    # the expected duration when it does not.
+    percent = child.output.progress_percent
+
+    if percent:
+        return child.elapsed * (100 - percent) / percent
+
+    return max(child.priority - child.elapsed, 0.0)
+
+
+class StatusServer(object):
+    """Serves the live status of a run as JSON on a UNIX socket.
+
+    Every connection is answered with the status at that time and
+    closed, ``rsync-backup status`` reads and prints it.
+    """
+
+    def __init__(self, path, manager, run_id=None):
+        self.path = path
+        self.manager = manager
+        self.run_id = run_id
+        self.started = time.time()
+        self._start = timer()
+        self._server = None
+
+    def _failure(self, child):
+        if child.state == DONE:
+            return 'rsync returned %i' % child.value.returncode
+
+        return six.text_type(child.exception)
+
+    def _running(self, process):
+        output = process.output
+
+        return {
+            'id': process.job.id,
+            'source': process.job.source,
+            'destination': process.job.destination,
+            'jobs': len(process.members) or 1,
+            'pid': process.pid,
+            'attempt': process.attempt,
+            'elapsed': process.elapsed,
+            'expected': process.priority,
+            'bytes': output.progress_bytes,
+            'percent': output.progress_percent,
+            'rate': output.progress_rate,
+            'files': output.progress_files,
+        }
+
+    def snapshot(self):
+        supervisor = self.manager.supervisor
+        counts = dict((s, 0) for s in (QUEUED, RUNNING, DONE, FAILED))
+        processes = {}
+        failed = []
+        transferred = 0
+
+        for child in supervisor.children.values():
+            state = child.state
+            # Bundled jobs share one rsync.
+            process = child.bundle or child
+
+            if state == DONE:
+                result = child.get()
+                transferred += result.transferred_size or 0
+
+                if not self.manager.allowed(child.job, result.returncode):
+                    state = FAILED
+
+            if state in (QUEUED, RUNNING):
+                processes[id(process)] = process
+
+            if state in (FAILED, KILLED, CANCELLED) and not child.retrying:
+                failed.append({
+                    'id': child.job.id,
+                    'source': child.job.source,
+                    'destination': child.job.destination,
+                    'state': state,
+                    'error': self._failure(child),
+                })
+
+            counts[state] = counts.get(state, 0) + 1
+
+        running = []
+        remaining = []
+        queued = []
+
+        for process in processes.values():
+            if process.state == RUNNING:
+                running.append(self._running(process))
+                remaining.append(remaining_seconds(process))
+            else:
+                queued.append(process.priority)
+
+        rates = [r['rate'] for r in running if r['rate'] is not None]
+        transferred += sum(r['bytes'] or 0 for r in running)
+
+        # Running jobs keeps their workers and the queued jobs is
+        # started longest first on the first free worker.
+        durations = remaining + sorted(queued, reverse=True)
+        eta = 0.0
+
+        if durations:
+            eta = simulate_makespan(durations, max(supervisor.workers, 1))
+
+        return {
+            'run_id': self.run_id,
+            'pid': os.getpid(),
+            'started': self.started,
+            'elapsed': timer() - self._start,
+            'workers': supervisor.workers,
+            'stopping': supervisor.stopping,
+            # Jobs that is not found yet is missing from the eta.
+            'producing': supervisor.producing,
+            'jobs': counts,
+            'running': sorted(running, key=lambda r: -r['elapsed']),
+            'failed': failed,
+            'throughput': sum(rates) if rates else None,
+            'transferred': transferred,
+            'eta': eta,
+        }
+
+    async def _handle(self, reader, writer):
+        try:
+            data = json.dumps(self.snapshot()) + '\n'
+            writer.write(data.encode('utf-8'))
+            await writer.drain()
+        except Exception as exc:
+            LOG.debug('failed to send status: %s' % six.text_type(exc))
+        finally:
+            writer.close()
+
+    def _in_use(self):
+        try:
+            mode = os.stat(self.path).st_mode
+        except OSError:
+            return False
+
+        if not stat.S_ISSOCK(mode):
+            raise RuntimeError('%s exists and is not a socket' % self.path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            sock.connect(self.path)
+        except OSError:
+            # Left behind by a run that did not exit cleanly.
+            os.unlink(self.path)
+            return False
+        finally:
+            sock.close()
+
+        return True
+
+    async def start(self):
+        if self._in_use():
+            raise RuntimeError('another run is serving status on %s' % (
+                               self.path))
+
+        self._server = await asyncio.start_unix_server(self._handle,
+                                                       path=self.path)
+        LOG.info('serving status on %s' % self.path)
+
+    async def stop(self):
+        if self._server is None:
+            return
+
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+        try:
+            os.unlink(self.path)
+        except OSError as exc:
+            LOG.debug('failed to remove %s: %s' % (
+                      self.path, six.text_type(exc)))
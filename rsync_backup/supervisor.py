@@ -0,0 +1,668 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+from rsync_backup.config import RETRY_ATTEMPTS, RETRY_BACKOFF
+from rsync_backup.job import backup_job
+from rsync_backup.rsync import has_progress_output
+from rsync_backup.stats import OutputParser
+import os
+import signal
+import six
+from timeit import default_timer as timer
+
+
+LOG = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+KILLED = 'killed'
+
+# Most seconds between checking jobs with a timeout, and seconds to
+# wait for rsync to exit after each signal when killing it.
+WATCHDOG_INTERVAL = 5
+KILL_GRACE = 10
+
+
+def get_io_counters(pid):
+    # Characters read and written by the process, None if /proc is not
+    # available or readable.
+    try:
+        with open('/proc/%i/io' % pid) as f:
+            counters = dict(line.split(':', 1) for line in f)
+
+        return int(counters['rchar']) + int(counters['wchar'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+class Child(object):
+    """Live state of a single rsync process.
+
+    Has the same ready(), successful() and get() methods as the
+    multiprocessing AsyncResult that was used before so results can
+    be handled the same way.
+    """
+
+    def __init__(self, job, command, bundle=None):
+        self.job = job
+        self.command = command
+        self.submitted_command = command
+        self.priority = 0
+        # Attempt number and seconds spent on earlier failed attempts.
+        self.attempt = 1
+        self.lost = 0.0
+        self.retrying = False
+        # Set for jobs that is run as part of a bundle.
+        self.bundle = bundle
+        self.members = []
+        self.state = QUEUED
+        self.process = None
+        self.transport = None
+        self.start = None
+        self.end = None
+        self.value = None
+        self.exception = None
+        self.cancelled = False
+        # Why the job was killed by the watchdog.
+        self.killed = None
+        # Devices that limits how many jobs can run at the same time.
+        self.devices = ()
+        # Share of the bandwidth limit given when started.
+        self.bwlimit = None
+        self.output = OutputParser(job.id)
+
+        if bundle is not None:
+            self.output = bundle.output
+
+    @property
+    def pid(self):
+        if self.process is None:
+            return None
+
+        return self.process.pid
+
+    @property
+    def elapsed(self):
+        if self.start is None:
+            return 0
+
+        end = self.end if self.end is not None else timer()
+        return end - self.start
+
+    def attach(self, process, transport=None):
+        self.process = process
+        self.transport = transport
+        LOG.debug('job %s started rsync with pid %i' % (
+                  self.job.id, process.pid))
+        self.update_members()
+
+        # The job could have been cancelled or killed while rsync was
+        # starting.
+        if self.cancelled or self.killed is not None:
+            self.signal(signal.SIGTERM)
+
+    def signal(self, signum):
+        if self.process is None or self.process.returncode is not None:
+            return
+
+        try:
+            # rsync is started in its own session so the whole
+            # process group including any ssh child is signaled.
+            os.killpg(self.process.pid, signum)
+        except OSError as exc:
+            LOG.debug('failed to signal job %s: %s' % (
+                      self.job.id, six.text_type(exc)))
+
+    def cancel(self):
+        if self.bundle is not None:
+            self.bundle.cancel()
+            return
+
+        if self.ready():
+            return
+
+        LOG.info('cancelling job %s' % self.job.id)
+        self.cancelled = True
+
+        if self.state == QUEUED:
+            self.state = CANCELLED
+            self.exception = RuntimeError('job was cancelled')
+            self.update_members()
+        else:
+            self.signal(signal.SIGTERM)
+
+    def update_members(self):
+        if not self.members:
+            return
+
+        total = sum(m.job.size or 0 for m in self.members)
+
+        for member in self.members:
+            member.state = self.state
+            member.process = self.process
+            member.start = self.start
+            member.end = self.end
+            member.cancelled = self.cancelled
+            member.killed = self.killed
+            member.exception = self.exception
+
+            if self.value is None:
+                continue
+
+            if total > 0:
+                fraction = float(member.job.size or 0) / total
+            else:
+                fraction = 1.0 / len(self.members)
+
+            member.value = self.value.share(fraction)
+
+    def ready(self):
+        if self.retrying:
+            return False
+
+        return self.state in (DONE, FAILED, CANCELLED, KILLED)
+
+    def successful(self):
+        if not self.ready():
+            raise ValueError('job %s is not ready' % self.job.id)
+
+        return self.state == DONE
+
+    def get(self):
+        if self.exception is not None:
+            raise self.exception
+
+        return self.value
+
+
+class Supervisor(object):
+    """Runs rsync processes from a single event loop.
+
+    Jobs can be submitted before running or be produced while
+    running, at most workers rsync processes is running at the same
+    time and the pending job with the highest priority is started
+    first. Jobs using a device that already runs as many jobs as its
+    limit is held back while jobs on other devices is started.
+    """
+
+    def __init__(self, workers=1, throttle=None):
+        self.workers = workers
+        self.throttle = throttle
+        self.loop = asyncio.new_event_loop()
+        self.children = collections.OrderedDict()
+        self.stopping = False
+        # One heap for each set of limited devices.
+        self._pending = {}
+        self._counter = itertools.count()
+        self._running = 0
+        self._device_running = collections.Counter()
+        self._device_limits = {}
+        self._periodic = []
+        self._services = []
+        self._finished = []
+        self._delayed = 0
+        self._producing = False
+        self._done = None
+
+    def submit(self, job, command, priority=0):
+        child = Child(job, command)
+        child.priority = priority
+        members = getattr(job, 'members', None)
+
+        if members:
+            # Results is reported for each job in the bundle.
+            child.members = [Child(m, command, bundle=child)
+                             for m in members]
+
+            for member in child.members:
+                self.children[member.job.id] = member
+        else:
+            self.children[job.id] = child
+
+        for dev, limit in getattr(job, 'devices', ()):
+            current = self._device_limits.get(dev, limit)
+            self._device_limits[dev] = min(current, limit)
+            child.devices += (dev,)
+
+        self._requeue(child)
+
+        if self._done is not None:
+            self._dispatch()
+
+        return child
+
+    def on_finished(self, callback):
+        # Called from the event loop with every child that finishes,
+        # for bundles once for each job in it.
+        self._finished.append(callback)
+
+    def _notify(self, child):
+        for member in child.members or [child]:
+            for callback in self._finished:
+                try:
+                    callback(member)
+                except Exception as exc:
+                    LOG.error('finished callback for job %s failed: %s' % (
+                              member.job.id, six.text_type(exc)))
+
+    def every(self, interval, callback):
+        # Called from the event loop with this interval while running.
+        self._periodic.append((interval, callback))
+
+    async def _repeat(self, interval, callback):
+        while True:
+            await asyncio.sleep(interval)
+
+            try:
+                callback()
+            except Exception as exc:
+                LOG.error('periodic callback failed: %s' % (
+                          six.text_type(exc)))
+
+    def serve(self, service):
+        # The start and stop coroutines of the service is awaited in
+        # the event loop before the first job and after the last one.
+        self._services.append(service)
+
+    @property
+    def producing(self):
+        return self._producing
+
+    def resize(self, workers):
+        # Running jobs is left alone when there is fewer workers, no
+        # new jobs is started until enough of them is done.
+        self.workers = workers
+
+        if self._done is not None:
+            self._dispatch()
+
+    def running(self):
+        return [c for c in self.children.values() if c.state == RUNNING]
+
+    def pending(self):
+        return sum(len(heap) for heap in self._pending.values())
+
+    def cancel(self, job_id):
+        child = self.children[job_id]
+        self.loop.call_soon_threadsafe(child.cancel)
+
+    def cancel_all(self):
+        self.stopping = True
+
+        for child in list(self.children.values()):
+            child.cancel()
+
+    def forget(self, job_id):
+        # Long running producers drop finished children so they do
+        # not pile up.
+        child = self.children.get(job_id, None)
+
+        if child is not None and child.ready():
+            del self.children[job_id]
+
+    def _on_signal(self, signum):
+        LOG.warning('received signal %i, cancelling all jobs' % signum)
+        self.cancel_all()
+
+    def _has_capacity(self, devices):
+        for dev in devices:
+            if self._device_running[dev] >= self._device_limits[dev]:
+                return False
+
+        return True
+
+    def _next_child(self):
+        best = None
+
+        for devices, heap in self._pending.items():
+            if not self._has_capacity(devices):
+                continue
+
+            if best is None or heap[0] < self._pending[best][0]:
+                best = devices
+
+        if best is None:
+            return None
+
+        heap = self._pending[best]
+        _, _, child = heapq.heappop(heap)
+
+        if not heap:
+            del self._pending[best]
+
+        return child
+
+    def _dispatch(self):
+        while self._running < self.workers:
+            child = self._next_child()
+
+            if child is None:
+                break
+
+            if child.state == CANCELLED:
+                continue
+
+            if self.throttle is not None and not self._limit(child):
+                # Started when a running job gives back its bandwidth.
+                self._requeue(child)
+                break
+
+            self._running += 1
+
+            for dev in child.devices:
+                self._device_running[dev] += 1
+
+            self.loop.create_task(self._supervise(child))
+
+        self._check_done()
+
+    def _check_done(self):
+        if self._done is None or self._done.done():
+            return
+
+        if self._producing or self._pending or self._running > 0:
+            return
+
+        if self._delayed > 0:
+            return
+
+        self._done.set_result(None)
+
+    def _limit(self, child):
+        # While jobs is still produced more jobs is expected to start
+        # so the bandwidth is split over every worker. The child is
+        # not counted as running or pending yet.
+        expected = self.workers
+
+        if not self._producing:
+            expected = min(self.workers, self._running + self.pending() + 1)
+
+        command, bwlimit = self.throttle.limit(child.command, expected,
+                                               self.workers)
+
+        if command is None:
+            return False
+
+        child.command, child.bwlimit = command, bwlimit
+
+        if child.bwlimit is not None:
+            LOG.debug('job %s is limited to %i KiB/s' % (
+                      child.job.id, child.bwlimit))
+
+        return True
+
+    def _requeue(self, child):
+        heap = self._pending.setdefault(child.devices, [])
+        heapq.heappush(heap, (-child.priority, next(self._counter), child))
+
+    async def _watchdog(self, child, task, timeout, stall_timeout):
+        limits = [t for t in (timeout, stall_timeout) if t]
+        interval = min([WATCHDOG_INTERVAL] + [t / 4.0 for t in limits])
+
+        progress = None
+        progress_time = timer()
+        watch_output = has_progress_output(child.command)
+        blind = False
+
+        while child.killed is None:
+            await asyncio.sleep(interval)
+            now = timer()
+
+            if timeout and now - child.start >= timeout:
+                child.killed = 'exceeded the timeout of %i secs' % timeout
+                break
+
+            # Output like --info=progress2 or reads and writes done by
+            # rsync itself tells that it is still moving.
+            counters = get_io_counters(child.pid) if child.pid else None
+
+            if counters is None and not watch_output:
+                # A quiet rsync cannot be told apart from a stuck one.
+                if stall_timeout and child.pid and not blind:
+                    LOG.warning('cannot tell if job %s makes progress '
+                                'without --info=progress2 or /proc io '
+                                'counters, it will not be killed for '
+                                'stalling' % child.job.id)
+                    blind = True
+
+                progress_time = now
+                continue
+
+            current = (child.output.output_bytes, counters)
+
+            if current != progress:
+                progress = current
+                progress_time = now
+            elif stall_timeout and now - progress_time >= stall_timeout:
+                child.killed = 'made no progress for %i secs' % (
+                    stall_timeout)
+
+        LOG.error('job %s %s, killing it' % (child.job.id, child.killed))
+        child.signal(signal.SIGTERM)
+        await asyncio.sleep(KILL_GRACE)
+        child.signal(signal.SIGKILL)
+        await asyncio.sleep(KILL_GRACE)
+
+        # rsync can be stuck in the kernel, like on a dead NFS mount,
+        # where not even SIGKILL gets through. It is left behind so the
+        # slot can be used by other jobs.
+        LOG.error('job %s did not exit after being killed, giving up on '
+                  'pid %s' % (child.job.id, child.pid))
+        task.cancel()
+
+        if child.transport is not None:
+            # Closes the pipes so the loop can be closed without them.
+            child.transport.close()
+
+    async def _supervise(self, child):
+        child.state = RUNNING
+        child.start = timer()
+        child.update_members()
+
+        if child.members:
+            LOG.debug('job %s runs %i bundled jobs' % (
+                      child.job.id, len(child.members)))
+
+        task = self.loop.create_task(backup_job(child))
+        watchdog = None
+
+        timeouts = (getattr(child.job, 'timeout', None),
+                    getattr(child.job, 'stall_timeout', None))
+
+        if any(timeouts):
+            watchdog = self.loop.create_task(
+                self._watchdog(child, task, *timeouts))
+
+        try:
+            child.value = await task
+        except asyncio.CancelledError:
+            if child.killed is None:
+                raise
+        except Exception as exc:
+            child.exception = exc
+            child.state = FAILED
+        else:
+            if child.cancelled:
+                child.exception = RuntimeError(
+                    'job was cancelled with return code %i' %
+                    child.value.returncode)
+                child.state = CANCELLED
+            else:
+                child.state = DONE
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+
+            if child.killed is not None:
+                child.exception = RuntimeError(
+                    'job was killed since it %s' % child.killed)
+                child.state = KILLED
+
+            child.end = timer()
+            child.update_members()
+            self._running -= 1
+
+            for dev in child.devices:
+                self._device_running[dev] -= 1
+
+            if self.throttle is not None:
+                self.throttle.release(child.bwlimit)
+
+            if not self._retry(child):
+                self._notify(child)
+
+            self._dispatch()
+
+    def _retry(self, child):
+        policy = getattr(child.job, 'retry', None)
+
+        if policy is None or self.stopping or child.state != DONE:
+            return False
+
+        if child.value.returncode not in policy['returncodes']:
+            return False
+
+        attempts = policy.get('attempts', RETRY_ATTEMPTS)
+
+        if child.attempt >= attempts:
+            return False
+
+        delay = policy.get('backoff', RETRY_BACKOFF) * 2 ** (child.attempt - 1)
+
+        LOG.warning('job %s failed with return code %i on attempt %i of '
+                    '%i, retrying in %i secs' % (
+                        child.job.id, child.value.returncode,
+                        child.attempt, attempts, delay))
+
+        # The run is not done while a retry is waiting.
+        self._delayed += 1
+
+        for c in [child] + child.members:
+            c.retrying = True
+
+        self.loop.call_later(delay, self._resubmit, child)
+        return True
+
+    def _resubmit(self, child):
+        self._delayed -= 1
+
+        for c in [child] + child.members:
+            c.retrying = False
+
+        if self.stopping:
+            # The failed attempt is what gets reported.
+            self._notify(child)
+            self._check_done()
+            return
+
+        retry = self.submit(child.job, child.submitted_command,
+                            child.priority)
+
+        # The failed attempt and the backoff after it is lost.
+        lost = child.lost + child.elapsed + timer() - child.end
+
+        for c in [retry] + retry.members:
+            c.attempt = child.attempt + 1
+            c.lost = lost
+
+    async def _produce(self, items):
+        iterator = iter(items)
+
+        while not self.stopping:
+            # The producer can block on scanning directories so it is
+            # advanced in a thread while jobs keep running.
+            item = await self.loop.run_in_executor(None, next, iterator,
+                                                   None)
+
+            if item is None:
+                break
+
+            self.submit(*item)
+
+    async def _start_services(self):
+        started = []
+
+        for service in self._services:
+            try:
+                await service.start()
+            except Exception as exc:
+                LOG.error('failed to start %s: %s' % (
+                          type(service).__name__, six.text_type(exc)))
+                continue
+
+            started.append(service)
+
+        return started
+
+    async def _stop_services(self, services):
+        for service in services:
+            try:
+                await service.stop()
+            except Exception as exc:
+                LOG.error('failed to stop %s: %s' % (
+                          type(service).__name__, six.text_type(exc)))
+
+    async def _run(self, items):
+        self._done = self.loop.create_future()
+        self._producing = True
+        services = await self._start_services()
+        self._dispatch()
+
+        tasks = [self.loop.create_task(self._repeat(i, c))
+                 for i, c in self._periodic]
+
+        try:
+            await self._produce(items)
+        except BaseException:
+            # Do not leave any rsync running behind when failing.
+            self.cancel_all()
+            self._producing = False
+            self._check_done()
+            await self._done
+            raise
+        finally:
+            if not self._done.done():
+                self._producing = False
+                self._check_done()
+                await self._done
+
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._stop_services(services)
+
+    def run(self, items=()):
+        asyncio.set_event_loop(self.loop)
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, self._on_signal, signum)
+
+        try:
+            self.loop.run_until_complete(self._run(items))
+        finally:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                self.loop.remove_signal_handler(signum)
+
+            self.loop.close()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+
+from rsync_backup import benchmark
+from rsync_backup.scheduler import measure_tree
+from rsync_backup.tests import base as base
+
+
+class TestBenchmark(base.TestCase):
+    def setUp(self):
+        super(TestBenchmark, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_generate_reproducible(self):
+        spec = benchmark.TreeSpec(depth=2, fanout=3, files=4, size=1000,
+                                  seed=7)
+
+        first = benchmark.generate_tree(os.path.join(self.root, 'a'), spec)
+        second = benchmark.generate_tree(os.path.join(self.root, 'b'), spec)
+
+        self.assertEqual(first, second)
+        self.assertEqual(13, first['dirs'])
+        self.assertEqual(52, first['files'])
+
+        with open(os.path.join(self.root, 'a', 'd1', 'd2', 'f3'), 'rb') as f:
+            data = f.read()
+
+        with open(os.path.join(self.root, 'b', 'd1', 'd2', 'f3'), 'rb') as f:
+            self.assertEqual(data, f.read())
+
+    def test_generate_skewed(self):
+        spec = benchmark.TreeSpec(depth=2, fanout=4, files=10,
+                                  distribution=benchmark.FIXED, skew=2.0)
+        benchmark.generate_tree(os.path.join(self.root, 'tree'), spec)
+
+        first = measure_tree(os.path.join(self.root, 'tree', 'd0'))[0]
+        last = measure_tree(os.path.join(self.root, 'tree', 'd3'))[0]
+        self.assertGreater(first, 10 * last)
+
+    def test_simulate_makespan(self):
+        durations = [1, 1, 1, 3]
+
+        self.assertEqual(6, benchmark.simulate_makespan(durations, 1))
+        self.assertEqual(4, benchmark.simulate_makespan(durations, 2))
+        self.assertEqual(3, benchmark.simulate_makespan(
+            sorted(durations, reverse=True), 2))
+
+    def test_compare(self):
+        baseline = {'explode': {'seconds': 2.0}, 'meta': {'timestamp': 1}}
+        current = {'explode': {'seconds': 3.0}, 'meta': {'timestamp': 2}}
+
+        self.assertEqual([('explode.seconds', 2.0, 3.0, 50.0)],
+                         benchmark.compare(baseline, current))
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+
+from rsync_backup import estimate
+from rsync_backup.history import JobRecord, RunHistory
+from rsync_backup.tests import base as base
+
+
+MIB = 1024 * 1024
+
+
+class FakeJob(object):
+    def __init__(self, id, command):
+        self.id = id
+        self.files_from = None
+        self.source = '/src/%s' % id
+        self.destination = '/dst/%s' % id
+        self.key = '%s -> %s' % (self.source, self.destination)
+        self.command = command
+
+
+class TestEstimate(base.TestCase):
+    def test_dry_run_command(self):
+        self.assertEqual(['rsync', '--dry-run', '-a', 'src/', 'dst'],
+                         estimate.get_dry_run_command(
+                             ['rsync', '-a', 'src/', 'dst']))
+
+    def test_throughputs(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+
+        history = RunHistory(os.path.join(root, 'history.db'))
+        self.addCleanup(history.close)
+
+        for seconds in (10, 20, 40):
+            history.record_run(1, 0, 100, 1, 0, [
+                JobRecord('1', '/src/a', '/dst/a', 0, True, seconds,
+                          bytes=1000 * MIB),
+                # Too little data sent to tell the throughput.
+                JobRecord('2', '/src/b', '/dst/b', 0, True, seconds,
+                          bytes=MIB),
+            ])
+
+        throughputs = estimate.get_throughputs(history)
+
+        self.assertEqual(50 * MIB, throughputs['/src/a -> /dst/a'])
+        self.assertNotIn('/src/b -> /dst/b', throughputs)
+        self.assertEqual(50 * MIB, throughputs[None])
+
+    def fake_rsync(self, root, transferred):
+        # Prints the stats of a dry run and ignores the arguments.
+        path = os.path.join(root, 'rsync-%i' % transferred)
+
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n')
+            f.write('echo "Total transferred file size: %i"\n' % (
+                    transferred))
+            f.write('echo "Number of files transferred: 3"\n')
+
+        os.chmod(path, 0o755)
+        return [path, '-a']
+
+    def test_estimate(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+
+        jobs = [FakeJob('a', self.fake_rsync(root, 100 * MIB)),
+                FakeJob('b', self.fake_rsync(root, 10 * MIB)),
+                FakeJob('c', self.fake_rsync(root, 10 * MIB))]
+
+        estimator = estimate.Estimator(
+            2, throughputs={'/src/a -> /dst/a': 50 * MIB},
+            default_throughput=10 * MIB)
+        estimates = estimator.run(jobs)
+
+        self.assertEqual([100 * MIB, 10 * MIB, 10 * MIB],
+                         [e.bytes for e in estimates])
+        self.assertEqual([3, 3, 3], [e.files for e in estimates])
+        self.assertIsNone(estimates[0].error)
+
+        # 2 secs for a and 1 sec each for b and c on top of the time
+        # the dry runs took.
+        self.assertAlmostEqual(2, estimates[0].seconds, delta=0.5)
+        self.assertAlmostEqual(1, estimates[1].seconds, delta=0.5)
+
+        self.assertAlmostEqual(2, estimator.makespan(estimates), delta=0.5)
+        self.assertAlmostEqual(4, estimator.makespan(estimates, 1),
+                               delta=0.5)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from rsync_backup.history import JobRecord, RunHistory, percentile
+from rsync_backup.tests import base as base
+
+
+class TestHistory(base.TestCase):
+    def setUp(self):
+        super(TestHistory, self).setUp()
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, 'history.db')
+        self.history = RunHistory(self.path)
+        self.addCleanup(self.history.close)
+
+    def _record(self, seconds):
+        records = [
+            JobRecord('1', '/src/a', '/dst/a', 0, True, seconds,
+                      bytes=1024, files=1),
+            JobRecord('2', '/src/b', '/dst/b', 0, True, 10),
+        ]
+        self.history.record_run(1, 0, 100, 4, 0, records)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, percentile(values, 50))
+        self.assertEqual(95, percentile(values, 95))
+        self.assertIsNone(percentile([], 50))
+
+    def test_summary(self):
+        for seconds in (10, 20, 30):
+            self._record(seconds)
+
+        summary = self.history.summary(30)
+        self.assertEqual(2, len(summary))
+        self.assertEqual('/src/a', summary[0]['source'])
+        self.assertEqual(20, summary[0]['p50'])
+        self.assertEqual(30, summary[0]['latest'])
+
+        runs = self.history.runs(30)
+        self.assertEqual(3, len(runs))
+        self.assertEqual(1024, runs[-1][9])
+
+    def test_regressions(self):
+        for seconds in (10, 10, 10, 30):
+            self._record(seconds)
+
+        regressions = self.history.regressions(30, 50)
+        self.assertEqual(1, len(regressions))
+        self.assertEqual('/src/a', regressions[0]['source'])
+        self.assertEqual(200, int(regressions[0]['increase']))
+
+    def test_split_jobs(self):
+        for seconds in (10, 20):
+            self.history.record_run(1, 0, 100, 4, 0, [
+                JobRecord('1', '/src', '/dst', 0, True, seconds,
+                          key='/src -> /dst [files from a]'),
+                JobRecord('2', '/src', '/dst', 0, True, 100,
+                          key='/src -> /dst [files from m]'),
+            ])
+
+        durations = self.history.job_durations(30)
+        self.assertEqual([(10, None), (20, None)],
+                         durations['/src -> /dst [files from a]'])
+        self.assertEqual([(100, None), (100, None)],
+                         durations['/src -> /dst [files from m]'])
+
+        summary = self.history.summary(30)
+        self.assertEqual([10, 100],
+                         [s['p50'] for s in summary])
+
+    def test_upgrade(self):
+        self.history.close()
+        os.unlink(self.path)
+
+        # Written before jobs had a key.
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE jobs (id INTEGER PRIMARY KEY, '
+                     'run INTEGER, job_id TEXT, source TEXT, '
+                     'destination TEXT, returncode INTEGER, '
+                     'successful INTEGER, seconds REAL, bytes INTEGER, '
+                     'files INTEGER)')
+        conn.commit()
+        conn.close()
+
+        self.history = RunHistory(self.path)
+        self.addCleanup(self.history.close)
+        self._record(10)
+
+        self.assertEqual(['/src/a -> /dst/a', '/src/b -> /dst/b'],
+                         [s['key'] for s in self.history.summary(30)])
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+
+from rsync_backup.job import Job, JobBundle, JobTemplate
+from rsync_backup.tests import base as base
+
+
+class TestJob(base.TestCase):
+    def setUp(self):
+        super(TestJob, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        self.src = os.path.join(self.root, 'src')
+        self.dst = os.path.join(self.root, 'dst')
+        os.makedirs(os.path.join(self.src, 'a', 'b'))
+        os.mkdir(self.dst)
+
+        self.template = JobTemplate('/usr/bin/rsync', {
+            'source': {'path': self.src},
+            'destination': {'path': self.dst},
+            'exclusions': ['.snapshots/'],
+            'options': ['-a'],
+            'allowed_returncodes': [0, 24],
+        })
+
+    def test_not_exploded(self):
+        job = Job(self.template)
+
+        self.assertFalse(job.exploded)
+        self.assertEqual(self.src, job.source)
+        self.assertEqual(self.dst, job.destination)
+        self.assertEqual((0, 24), job.allowed_returncodes)
+        self.assertFalse(hasattr(job, '__dict__'))
+
+    def test_exploded(self):
+        job = Job(self.template, relpath=os.path.join('a', 'b'))
+        other = Job(self.template, relpath='a')
+
+        self.assertTrue(job.exploded)
+        self.assertIs(job.exclusions, other.exclusions)
+        self.assertEqual(os.path.join(self.src, 'a', 'b'), job.source)
+        self.assertEqual(os.path.join(self.dst, 'a', 'b'),
+                         job.destination)
+
+    def test_command_cached(self):
+        job = Job(self.template, relpath='a')
+
+        self.assertEqual(['/usr/bin/rsync', '-a', '--stats',
+                          '--exclude=.snapshots/',
+                          os.path.join(self.src, 'a') + '/',
+                          os.path.join(self.dst, 'a')], job.command)
+        self.assertIs(job.command, job.command)
+
+    def test_bundle_command(self):
+        bundle = JobBundle(self.template, [
+            Job(self.template, relpath='a', size=10),
+            Job(self.template, relpath=os.path.join('a', 'b'), size=5),
+        ])
+
+        self.assertEqual(15, bundle.size)
+        self.assertEqual(['/usr/bin/rsync', '-a', '--stats', '--relative',
+                          '--exclude=.snapshots/',
+                          os.path.join(self.src, '.', 'a'),
+                          os.path.join(self.src, '.', 'a', 'b'),
+                          self.dst + '/'], bundle.command)
+
+    def test_devices(self):
+        template = JobTemplate('rsync', {
+            'source': {'path': self.src, 'max_workers': 4},
+            'destination': {'path': self.dst, 'max_workers': 2},
+        })
+
+        # Both is on the same device so the lowest limit wins.
+        dev = os.stat(self.src).st_dev
+        self.assertEqual(((dev, 2),), Job(template).devices)
+        self.assertEqual((), Job(self.template).devices)
+
+    def test_devices_nested_mount(self):
+        template = JobTemplate('rsync', {
+            'source': {'path': self.src, 'max_workers': 1},
+            'destination': {'path': self.dst},
+        })
+        stat = os.stat
+
+        def fake_stat(path, *args, **kwargs):
+            # b is a mount of its own below the source.
+            if path == os.path.join(self.src, 'b'):
+                return os.stat_result((0, 0, 99) + (0,) * 7)
+
+            return stat(path, *args, **kwargs)
+
+        self.patch(os, 'stat', fake_stat)
+
+        dev = stat(self.src).st_dev
+        jobs = [Job(template, relpath='a'), Job(template, relpath='b')]
+
+        self.assertEqual([((dev, 1),), ((99, 1),)],
+                         [j.devices for j in jobs])
+        self.assertEqual(tuple(sorted([(dev, 1), (99, 1)])),
+                         JobBundle(template, jobs).devices)
+
+    def test_devices_cached(self):
+        template = JobTemplate('rsync', {
+            'source': {'path': self.src, 'max_workers': 1},
+            'destination': {'path': self.dst},
+        })
+        dev = os.stat(self.src).st_dev
+
+        job = Job(template, relpath='a')
+        job.find_devices()
+        bundle = JobBundle(template, [job])
+        bundle.find_devices()
+
+        def hung_stat(path, *args, **kwargs):
+            raise AssertionError('stat of %s while submitting' % path)
+
+        # Only the cached devices is read later.
+        self.patch(os, 'stat', hung_stat)
+
+        self.assertEqual(((dev, 1),), job.devices)
+        self.assertEqual(((dev, 1),), bundle.devices)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+
+from rsync_backup.job import Job, JobTemplate
+from rsync_backup.journal import Journal
+from rsync_backup.tests import base as base
+
+
+class TestJournal(base.TestCase):
+    def setUp(self):
+        super(TestJournal, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = os.path.join(self.root, 'journal.log')
+
+        self.data = {
+            'source': {'path': '/src'},
+            'destination': {'path': '/dst'},
+            'options': ['-a'],
+        }
+        self.template = JobTemplate('rsync', self.data)
+        self.first = Job(self.template, relpath='a')
+        self.second = Job(self.template, relpath='b')
+
+    def _interrupted_run(self):
+        journal = Journal(self.path)
+        journal.start(1)
+        journal.record(self.first)
+        journal.close()
+
+    def test_resume(self):
+        self._interrupted_run()
+
+        journal = Journal(self.path, resume=True)
+        self.addCleanup(journal.close)
+
+        self.assertTrue(journal.done(Job(self.template, relpath='a')))
+        self.assertFalse(journal.done(self.second))
+
+    def test_changed_config(self):
+        self._interrupted_run()
+
+        self.data['options'] = ['-a', '--delete']
+        template = JobTemplate('rsync', self.data)
+
+        journal = Journal(self.path, resume=True)
+        self.addCleanup(journal.close)
+
+        self.assertFalse(journal.done(Job(template, relpath='a')))
+
+    def test_finished_run_is_not_resumed(self):
+        journal = Journal(self.path)
+        journal.record(self.first)
+        journal.finish(0, 0)
+        journal.close()
+
+        journal = Journal(self.path, resume=True)
+        self.addCleanup(journal.close)
+
+        self.assertFalse(journal.done(self.first))
+        self.assertEqual(0, os.path.getsize(self.path))
+
+    def test_failed_run_is_resumed(self):
+        journal = Journal(self.path)
+        journal.record(self.first)
+        journal.finish(0, 1)
+        journal.close()
+
+        journal = Journal(self.path, resume=True)
+        self.addCleanup(journal.close)
+
+        self.assertTrue(journal.done(self.first))
+
+    def test_torn_line(self):
+        self._interrupted_run()
+
+        with open(self.path, 'a') as f:
+            f.write('{"config": "abc", "key": "/sr')
+
+        journal = Journal(self.path, resume=True)
+        journal.record(self.second)
+        journal.close()
+
+        journal = Journal(self.path, resume=True)
+        self.addCleanup(journal.close)
+
+        self.assertTrue(journal.done(self.first))
+        self.assertTrue(journal.done(self.second))
+
+    def test_not_resuming_truncates(self):
+        self._interrupted_run()
+
+        journal = Journal(self.path)
+        self.addCleanup(journal.close)
+
+        self.assertFalse(journal.done(self.first))
+        self.assertEqual(0, os.path.getsize(self.path))
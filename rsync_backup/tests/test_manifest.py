@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+
+from rsync_backup.job import Job, JobTemplate
+from rsync_backup.manifest import Manifest, fingerprint
+from rsync_backup.tests import base as base
+
+
+class TestManifest(base.TestCase):
+    def setUp(self):
+        super(TestManifest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        self.src = os.path.join(self.root, 'src')
+        os.makedirs(os.path.join(self.src, 'sub'))
+        self.file = os.path.join(self.src, 'sub', 'file')
+
+        with open(self.file, 'w') as f:
+            f.write('data')
+
+        self.path = os.path.join(self.root, 'manifest.json')
+        self.template = JobTemplate('rsync', {
+            'source': {'path': self.src},
+            'destination': {'path': '/dst'},
+        })
+
+    def test_fingerprint(self):
+        fp = fingerprint(self.src)
+        self.assertEqual(fp, fingerprint(self.src))
+
+        # Same size but newer mtime.
+        st = os.stat(self.file)
+        os.utime(self.file, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+        changed = fingerprint(self.src)
+        self.assertNotEqual(fp, changed)
+
+        with open(os.path.join(self.src, 'sub', 'new'), 'w') as f:
+            f.write('')
+
+        self.assertNotEqual(changed, fingerprint(self.src))
+
+    def test_files_from(self):
+        fp = fingerprint(os.path.join(self.src, 'sub'), files_from=['file'])
+
+        with open(self.file, 'a') as f:
+            f.write('more')
+
+        self.assertNotEqual(fp, fingerprint(os.path.join(self.src, 'sub'),
+                                            files_from=['file']))
+
+    def test_files_from_directory(self):
+        # Packed directories is synced with everything below them.
+        fp = fingerprint(self.src, files_from=['sub'])
+
+        with open(self.file, 'a') as f:
+            f.write('more')
+
+        self.assertNotEqual(fp, fingerprint(self.src, files_from=['sub']))
+
+    def test_skip_unchanged(self):
+        manifest = Manifest(self.path, full_every=3)
+        job = Job(self.template)
+
+        self.assertTrue(manifest.full)
+        self.assertFalse(manifest.unchanged(job))
+        manifest.record(job)
+        manifest.save()
+
+        manifest = Manifest(self.path, full_every=3)
+        job = Job(self.template)
+        self.assertFalse(manifest.full)
+        self.assertTrue(manifest.unchanged(job))
+        manifest.skip(job, 60)
+        self.assertEqual(1, manifest.skipped)
+        self.assertEqual(60, manifest.skipped_seconds)
+        manifest.save()
+
+        # Forced full pass every third run.
+        Manifest(self.path).save()
+        self.assertTrue(Manifest(self.path, full_every=3).full)
+
+    def test_failed_job_runs_again(self):
+        manifest = Manifest(self.path)
+        job = Job(self.template)
+        manifest.unchanged(job)
+        manifest.record(job)
+
+        # Job runs because of --full but fails so it is not recorded.
+        manifest.full = True
+        manifest.unchanged(Job(self.template))
+        manifest.full = False
+
+        self.assertFalse(manifest.unchanged(Job(self.template)))
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import stat
+import tempfile
+
+from rsync_backup.history import JobRecord
+from rsync_backup.job import Job, JobTemplate
+from rsync_backup import metrics
+from rsync_backup.supervisor import Supervisor
+from rsync_backup.tests import base as base
+
+
+class FakeManager(object):
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.supervisor = Supervisor()
+        self.execute_seconds = 10
+        self.walker = self
+        self.planner = self
+        self.scan_seconds = 1
+        self.prepare_seconds = 1
+
+
+class TestMetrics(base.TestCase):
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = os.path.join(self.root, 'rsync_backup.prom')
+
+    def test_render(self):
+        m = metrics.Metrics()
+        m.add('jobs', 2, 'Jobs.', labels={'state': 'done'})
+        m.add('workers', 4, 'Workers.')
+        m.add('jobs', 1, 'Jobs.', labels={'state': 'failed'})
+
+        self.assertEqual(
+            '# HELP rsync_backup_jobs Jobs.\n'
+            '# TYPE rsync_backup_jobs gauge\n'
+            'rsync_backup_jobs{state="done"} 2\n'
+            'rsync_backup_jobs{state="failed"} 1\n'
+            '# HELP rsync_backup_workers Workers.\n'
+            '# TYPE rsync_backup_workers gauge\n'
+            'rsync_backup_workers 4\n', m.render())
+
+    def test_last_success_roundtrip(self):
+        source = '/data/with "quotes" and \\ slash'
+
+        m = metrics.Metrics()
+        m.add('last_success_timestamp_seconds', 1234.5, 'Last success.',
+              labels={'source': source})
+        m.add('last_success_timestamp_seconds', 99.0, 'Last success.',
+              labels={'source': '/other'})
+        m.write(self.path)
+
+        self.assertEqual(0o644, stat.S_IMODE(os.stat(self.path).st_mode))
+        self.assertEqual({source: 1234.5, '/other': 99.0},
+                         metrics.load_last_success(self.path))
+        self.assertEqual([os.path.basename(self.path)],
+                         os.listdir(self.root))
+
+    def test_load_missing(self):
+        self.assertEqual({}, metrics.load_last_success(self.path))
+
+    def test_split_shards(self):
+        config = {
+            'source': {'path': '/src'},
+            'destination': {'path': '/dst'},
+            'exclusions': [],
+            'options': ['-a'],
+        }
+        template = JobTemplate('rsync', config)
+
+        # Files directly in a split directory synced in two shards.
+        shards = [Job(template, relpath='a', files_from=['x', 'y']),
+                  Job(template, relpath='a', files_from=['z'])]
+        records = [JobRecord(j.id, j.source, j.destination, 0, True, 5,
+                             bytes=10, files=1, key=j.key) for j in shards]
+
+        exporter = metrics.MetricsExporter(self.path, FakeManager([config]))
+        exporter.finish(records, 100, 200, 0)
+
+        with open(self.path) as f:
+            series = [line.rsplit(' ', 1)[0] for line in f
+                      if line.startswith(metrics.PREFIX + 'job_')]
+
+        self.assertEqual(10, len(series))
+        self.assertEqual(len(series), len(set(series)))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+
+from rsync_backup.manager import Manager
+from rsync_backup.orphans import TreeRemover, find_orphans
+from rsync_backup.tests import base as base
+from rsync_backup.walker import Walker
+
+
+class TestOrphans(base.TestCase):
+    def setUp(self):
+        super(TestOrphans, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        self.src = os.path.join(self.root, 'src')
+        self.dst = os.path.join(self.root, 'dst')
+
+        for path in ('a/x', 'a/y', 'b/z'):
+            os.makedirs(os.path.join(self.src, path))
+
+        # a/gone and all of c was removed from the source.
+        for path in ('a/x', 'a/y', 'a/gone/deep', 'b/z', 'c/w'):
+            os.makedirs(os.path.join(self.dst, path))
+
+        with open(os.path.join(self.dst, 'a/gone/deep/f'), 'w') as f:
+            f.write('data')
+
+    def test_find_orphans(self):
+        orphans = find_orphans(self.src, self.dst, 2, Walker(4))
+
+        self.assertEqual([os.path.join(self.dst, 'a/gone'),
+                          os.path.join(self.dst, 'c')], orphans)
+
+        # Only the top level is compared with one step.
+        orphans = find_orphans(self.src, self.dst, 1, Walker(4))
+        self.assertEqual([os.path.join(self.dst, 'c')], orphans)
+
+    def test_empty_source(self):
+        empty = os.path.join(self.root, 'empty')
+        os.mkdir(empty)
+
+        self.assertEqual([], find_orphans(empty, self.dst, 2, Walker(4)))
+
+    def test_remove(self):
+        for threads in (1, 4):
+            tree = os.path.join(self.root, 'tree%i' % threads)
+
+            for i in range(3):
+                path = os.path.join(tree, 'd%i' % i, 's')
+                os.makedirs(path)
+
+                for j in range(5):
+                    with open(os.path.join(path, 'f%i' % j), 'w') as f:
+                        f.write('data')
+
+            os.symlink(self.src, os.path.join(tree, 'link'))
+
+            remover = TreeRemover(threads)
+            remover.remove([tree])
+
+            self.assertFalse(os.path.lexists(tree))
+            self.assertEqual(7, remover.removed_dirs)
+            self.assertEqual(16, remover.removed_files)
+            self.assertEqual(0, remover.errors)
+
+        # Symlinks is removed and not followed.
+        self.assertTrue(os.path.isdir(os.path.join(self.src, 'a')))
+
+    def test_manager(self):
+        job = {
+            'source': {'path': self.src},
+            'destination': {'path': self.dst},
+            'exclusions': [],
+            'options': ['-a'],
+            'steps': 2,
+        }
+
+        mgr = Manager('rsync')
+        mgr.queue_jobs({'jobs': [job]})
+
+        # Orphans is only removed when asked for.
+        self.assertEqual([], mgr.find_orphans())
+        self.assertEqual([], mgr.find_orphans(noop=True))
+
+        job['delete_orphans'] = True
+        orphans = mgr.find_orphans()
+        self.assertEqual(2, len(orphans))
+
+        mgr.remove_orphans(orphans)
+
+        self.assertEqual(['a', 'b'], sorted(os.listdir(self.dst)))
+        self.assertEqual(['x', 'y'],
+                         sorted(os.listdir(os.path.join(self.dst, 'a'))))
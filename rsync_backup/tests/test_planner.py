@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import stat
+import tempfile
+
+from rsync_backup.job import Job, JobTemplate
+from rsync_backup.planner import DestinationPath, DestinationPlanner
+from rsync_backup.tests import base as base
+
+
+class TestPlanner(base.TestCase):
+    def setUp(self):
+        super(TestPlanner, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        self.src = os.path.join(self.root, 'src')
+        self.dst = os.path.join(self.root, 'dst')
+        os.mkdir(self.dst)
+
+        for i in range(3):
+            for j in range(5):
+                os.makedirs(os.path.join(self.src, 'd%i' % i, 's%i' % j))
+
+        os.chmod(os.path.join(self.src, 'd1'), 0o700)
+
+        self.template = JobTemplate('rsync', {
+            'source': {'path': self.src},
+            'destination': {'path': self.dst},
+        })
+
+    def _jobs(self):
+        return [Job(self.template, relpath=os.path.join('d%i' % i,
+                                                        's%i' % j))
+                for i in range(3) for j in range(5)]
+
+    def test_plan_dedupes(self):
+        planner = DestinationPlanner()
+        paths = []
+
+        for job in self._jobs():
+            paths += planner.plan(job)
+
+        # Three shared parents and fifteen leaves.
+        self.assertEqual(18, len(paths))
+        self.assertEqual(18, len(set(p.path for p in paths)))
+
+    def test_prepare(self):
+        planner = DestinationPlanner(threads=4)
+        planner.prepare(self._jobs())
+
+        self.assertEqual(18, planner.created)
+
+        for i in range(3):
+            for j in range(5):
+                self.assertTrue(os.path.isdir(
+                    os.path.join(self.dst, 'd%i' % i, 's%i' % j)))
+
+        mode = os.stat(os.path.join(self.dst, 'd1')).st_mode
+        self.assertEqual(0o700, stat.S_IMODE(mode))
+
+        # Nothing left to do the next time.
+        self.assertEqual([], DestinationPlanner().plan(self._jobs()[0]))
+
+    def test_prepare_missing_source(self):
+        jobs = self._jobs()
+        shutil.rmtree(os.path.join(self.src, 'd1', 's2'))
+
+        planner = DestinationPlanner(threads=4)
+        failed = planner.prepare(jobs)
+
+        self.assertEqual([jobs[7]], failed)
+        self.assertEqual(17, planner.created)
+
+    def test_prepare_failed(self):
+        mkdir = os.mkdir
+
+        def fake_mkdir(path, *args):
+            if path == os.path.join(self.dst, 'd2'):
+                raise PermissionError('denied')
+
+            return mkdir(path, *args)
+
+        self.patch(os, 'mkdir', fake_mkdir)
+
+        jobs = self._jobs()
+        planner = DestinationPlanner(threads=4)
+
+        # Every job below the parent fails.
+        self.assertEqual(jobs[10:], planner.prepare(jobs))
+        self.assertEqual(12, planner.created)
+
+    def test_create_existing(self):
+        path = os.path.join(self.dst, 'exists')
+        os.mkdir(path, 0o755)
+
+        DestinationPath(path, 0, 0, 0o700).create()
+        self.assertEqual(0o755, stat.S_IMODE(os.stat(path).st_mode))
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from timeit import default_timer as timer
+
+from rsync_backup import preflight
+from rsync_backup.tests import base as base
+
+
+class TestPreflight(base.TestCase):
+    def setUp(self):
+        super(TestPreflight, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        for name in ('src', 'dst'):
+            os.mkdir(os.path.join(self.root, name))
+
+    def job(self, source='src', destination='dst', **kwargs):
+        dst = {'path': os.path.join(self.root, destination)}
+        dst.update(kwargs)
+
+        return {'source': {'path': os.path.join(self.root, source)},
+                'destination': dst}
+
+    def test_check_path(self):
+        path = os.path.join(self.root, 'dst')
+
+        self.assertIsNone(preflight.check_path(path, writable=True))
+        self.assertEqual([], os.listdir(path))
+
+        self.assertEqual('is not a existing directory',
+                         preflight.check_path(path + '-missing'))
+        self.assertEqual('is not a mount',
+                         preflight.check_path(path, mount=True))
+        self.assertIn('bytes free', preflight.check_path(
+            path, min_free=2 ** 62))
+
+    def test_skip_unhealthy(self):
+        healthy = self.job()
+        missing = self.job(source='missing')
+        full = self.job(min_free=2 ** 62)
+
+        jobs, skipped = preflight.preflight([healthy, missing, full])
+
+        self.assertEqual([healthy], jobs)
+        self.assertEqual([missing, full], skipped)
+
+    def test_timeout(self):
+        hung = os.path.join(self.root, 'hung')
+        calls = []
+        lock = threading.Lock()
+        check_path = preflight.check_path
+
+        def fake_check_path(path, **kwargs):
+            with lock:
+                calls.append(path)
+
+            if path == hung:
+                time.sleep(5)
+
+            return check_path(path, **kwargs)
+
+        self.patch(preflight, 'check_path', fake_check_path)
+
+        # The destination shared by both jobs is checked once.
+        jobs = [self.job(), self.job(source='hung')]
+
+        start = timer()
+        healthy, skipped = preflight.preflight(jobs, timeout=0.2)
+
+        self.assertLess(timer() - start, 2)
+        self.assertEqual([jobs[0]], healthy)
+        self.assertEqual([jobs[1]], skipped)
+        self.assertEqual(3, len(calls))
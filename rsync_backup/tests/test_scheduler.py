@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+
+from rsync_backup.scheduler import DurationHistory, Scheduler, job_key
+from rsync_backup.tests import base as base
+
+
+class FakeJob(object):
+    def __init__(self, id, source, destination):
+        self.id = id
+        self.source = source
+        self.destination = destination
+        self.size = None
+
+    @property
+    def key(self):
+        return job_key(self.source, self.destination)
+
+
+class TestScheduler(base.TestCase):
+    def setUp(self):
+        super(TestScheduler, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _make_source(self, name, size):
+        path = os.path.join(self.tmpdir, name)
+        os.mkdir(path)
+
+        with open(os.path.join(path, 'data'), 'wb') as f:
+            f.write(b'x' * size)
+
+        return path
+
+    def test_history_roundtrip(self):
+        path = os.path.join(self.tmpdir, 'timings.json')
+
+        history = DurationHistory(path)
+        history.record('a -> b', 10)
+        history.record('a -> b', 20)
+        history.save()
+
+        loaded = DurationHistory(path)
+        self.assertEqual(15, loaded.get('a -> b'))
+        self.assertIsNone(loaded.get('c -> d'))
+
+    def test_order_longest_first(self):
+        small = self._make_source('small', 10)
+        large = self._make_source('large', 4096)
+
+        history = DurationHistory()
+        history.record(job_key('/known', '/dst/known'), 3600)
+
+        jobs = [
+            FakeJob('small', small, '/dst/small'),
+            FakeJob('known', '/known', '/dst/known'),
+            FakeJob('large', large, '/dst/large'),
+        ]
+
+        ordered = Scheduler(history).order(jobs)
+        self.assertEqual(['known', 'large', 'small'],
+                         [j.id for j in ordered])
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+
+from rsync_backup.job import Job, JobTemplate
+from rsync_backup.manager import Manager
+from rsync_backup.snapshot import LATEST, Snapshots
+from rsync_backup.tests import base as base
+
+
+class TestSnapshots(base.TestCase):
+    def setUp(self):
+        super(TestSnapshots, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        self.src = os.path.join(self.root, 'src')
+        self.dst = os.path.join(self.root, 'dst')
+
+        for name in ('a', 'b'):
+            os.makedirs(os.path.join(self.src, name))
+
+        os.mkdir(self.dst)
+
+        # Two old generations where the newest is the latest.
+        for generation in ('2019-01-01T000000', '2019-01-02T000000'):
+            os.makedirs(os.path.join(self.dst, generation, 'a'))
+
+        os.symlink('2019-01-02T000000', os.path.join(self.dst, LATEST))
+
+    def job_config(self, keep=1):
+        return {
+            'source': {'path': self.src},
+            'destination': {'path': self.dst},
+            'exclusions': [],
+            'options': ['-a'],
+            'steps': 1,
+            'snapshots': {'keep': keep},
+        }
+
+    def test_link_dest(self):
+        snapshot = Snapshots(self.dst, 1)
+        previous = os.path.join(self.dst, '2019-01-02T000000')
+
+        self.assertEqual(previous, snapshot.previous)
+        self.assertEqual(os.path.join(previous, 'a'),
+                         snapshot.link_dest('a'))
+
+        # Nothing to link against for new directories.
+        self.assertIsNone(snapshot.link_dest('b'))
+
+        template = JobTemplate('rsync', self.job_config(),
+                               snapshot=snapshot)
+        job = Job(template, relpath='a')
+
+        self.assertEqual(os.path.join(snapshot.path, 'a'), job.target)
+        self.assertEqual(os.path.join(snapshot.path, 'a'), job.command[-1])
+        self.assertIn('--link-dest=%s' % os.path.join(previous, 'a'),
+                      job.command)
+
+    def test_job_key(self):
+        # The generation changes every run but the job must be known
+        # by the same key in the history.
+        keys = []
+
+        for now in (1546500000, 1546600000):
+            snapshot = Snapshots(self.dst, 1, now=now)
+            template = JobTemplate('rsync', self.job_config(),
+                                   snapshot=snapshot)
+            job = Job(template, relpath='a')
+
+            self.assertEqual(os.path.join(self.dst, 'a'), job.destination)
+            keys.append(job.key)
+
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotIn(snapshot.generation, keys[1])
+
+    def test_expired(self):
+        snapshot = Snapshots(self.dst, 1)
+        self.assertEqual(['2019-01-01T000000'], snapshot.expired())
+
+        snapshot.prune(threads=2)
+        self.assertEqual(['2019-01-02T000000', LATEST],
+                         sorted(os.listdir(self.dst)))
+
+        # The latest is kept even if there is newer generations.
+        os.mkdir(os.path.join(self.dst, '2019-01-03T000000'))
+        self.assertEqual([], Snapshots(self.dst, 1).expired())
+
+    def test_resume(self):
+        os.mkdir(os.path.join(self.dst, '2019-01-03T000000'))
+
+        snapshot = Snapshots(self.dst, 1, resume=True)
+        self.assertEqual('2019-01-03T000000', snapshot.generation)
+
+        snapshot = Snapshots(self.dst, 1)
+        self.assertNotEqual('2019-01-03T000000', snapshot.generation)
+
+    def test_publish(self):
+        mgr = Manager('true', 2)
+        mgr.queue_jobs({'jobs': [self.job_config()]})
+        mgr.wait()
+
+        self.assertTrue(mgr.finish_snapshots())
+
+        snapshot = mgr.snapshots[0]
+        self.assertEqual(snapshot.generation,
+                         os.readlink(os.path.join(self.dst, LATEST)))
+        self.assertEqual(['a', 'b'], sorted(os.listdir(snapshot.path)))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.dst, '2019-01-01T000000')))
+
+    def test_scan_failed(self):
+        os.makedirs(os.path.join(self.src, 'a', 'x'))
+        scandir = os.scandir
+
+        def fake_scandir(path):
+            if path == os.path.join(self.src, 'a'):
+                raise PermissionError('denied')
+
+            return scandir(path)
+
+        self.patch(os, 'scandir', fake_scandir)
+
+        config = self.job_config(keep=2)
+        config['steps'] = 2
+
+        mgr = Manager('true', 2)
+        mgr.queue_jobs({'jobs': [config]})
+        mgr.wait()
+
+        # Nothing below the directory was synced.
+        self.assertEqual([os.path.join(self.src, 'a')], mgr.scan_errors)
+        self.assertFalse(mgr.finish_snapshots())
+        self.assertEqual('2019-01-02T000000',
+                         os.readlink(os.path.join(self.dst, LATEST)))
+
+    def test_publish_failed(self):
+        mgr = Manager('false', 2)
+        mgr.queue_jobs({'jobs': [self.job_config(keep=2)]})
+        mgr.wait()
+
+        self.assertFalse(mgr.finish_snapshots())
+        self.assertEqual('2019-01-02T000000',
+                         os.readlink(os.path.join(self.dst, LATEST)))
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+
+from rsync_backup import split
+from rsync_backup.tests import base as base
+
+
+class TestSplit(base.TestCase):
+    def setUp(self):
+        super(TestSplit, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        # One huge directory with files in two subdirectories and
+        # directly in it, a few tiny siblings and a loose file at
+        # the top.
+        self._file('big/a/1', 400)
+        self._file('big/a/2', 400)
+        self._file('big/b/1', 400)
+        self._file('big/loose1', 300)
+        self._file('big/loose2', 300)
+        self._file('tiny1/1', 10)
+        self._file('tiny2/1', 10)
+        self._file('top', 5)
+
+    def _file(self, path, size):
+        full_path = os.path.join(self.root, path)
+        dirname = os.path.dirname(full_path)
+
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        with open(full_path, 'wb') as f:
+            f.write(b'x' * size)
+
+    def _covered(self, shards):
+        covered = []
+
+        for shard in shards:
+            paths = [shard.path]
+
+            if shard.files is not None:
+                paths = [os.path.join(shard.path, f) for f in shard.files]
+
+            for path in paths:
+                if not os.path.isdir(path):
+                    covered.append(path)
+                    continue
+
+                for dirpath, dirs, files in os.walk(path):
+                    covered += [os.path.join(dirpath, f) for f in files]
+
+        return sorted(os.path.relpath(p, self.root) for p in covered)
+
+    def test_scan_tree(self):
+        root = split.scan_tree(self.root)
+        self.assertEqual(1825, root.total_bytes)
+        self.assertEqual(8, root.total_files)
+        self.assertEqual(5, root.own_bytes)
+
+    def test_max_bytes(self):
+        shards = split.split_tree(self.root, {'max_bytes': 800})
+
+        for shard in shards:
+            self.assertLessEqual(shard.bytes, 800)
+
+        # Only big is split, what is in it and the tiny siblings at the
+        # top is packed together.
+        packed = [(os.path.relpath(s.path, self.root), s.files)
+                  for s in shards]
+        self.assertEqual([('.', ['tiny1', 'tiny2', 'top']),
+                          ('big', ['a']),
+                          ('big', ['b', 'loose1']),
+                          ('big', ['loose2'])], packed)
+
+        expected = ['big/a/1', 'big/a/2', 'big/b/1', 'big/loose1',
+                    'big/loose2', 'tiny1/1', 'tiny2/1', 'top']
+        self.assertEqual(expected, self._covered(shards))
+
+    def test_target_shards(self):
+        shards = split.split_tree(self.root, {'target_shards': 1})
+        self.assertEqual(1, len(shards))
+        self.assertEqual(self.root, shards[0].path)
+        self.assertIsNone(shards[0].files)
+
+    def test_max_files(self):
+        shards = split.split_tree(self.root, {'max_files': 1})
+
+        for shard in shards:
+            self.assertLessEqual(shard.count, 1)
+
+        self.assertEqual(8, len(self._covered(shards)))
+
+    def test_target_shards_packs_siblings(self):
+        # Many small directories of different sizes next to each other.
+        for i in range(100):
+            self._file('many/%02i/1' % i, 10 + i * 7)
+
+        for target in (4, 10, 25):
+            shards = split.split_tree(os.path.join(self.root, 'many'),
+                                      {'target_shards': target})
+
+            self.assertLessEqual(target, len(shards))
+            self.assertLessEqual(len(shards), target * 1.2 + 1)
+
+        self.assertEqual(100, len(self._covered(shards)))
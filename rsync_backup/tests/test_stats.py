@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from rsync_backup import stats
+from rsync_backup.tests import base as base
+
+
+STATS_OUTPUT = b"""
+Number of files: 1,234 (reg: 1,000, dir: 234)
+Number of created files: 3
+Number of deleted files: 0
+Number of regular files transferred: 12
+Total file size: 1,234,567 bytes
+Total transferred file size: 12,345 bytes
+Literal data: 12,000 bytes
+Matched data: 345 bytes
+File list size: 0
+Total bytes sent: 12,890
+Total bytes received: 35
+
+sent 12,890 bytes  received 35 bytes  25,850.00 bytes/sec
+total size is 1,234,567  speedup is 95.52
+"""
+
+
+class TestOutputParser(base.TestCase):
+    def test_stats(self):
+        parser = stats.OutputParser()
+
+        # Feed in small chunks so lines are split between reads.
+        for i in range(0, len(STATS_OUTPUT), 7):
+            parser.feed(STATS_OUTPUT[i:i + 7])
+
+        parser.close()
+        result = parser.result(0, 10)
+
+        self.assertEqual(0, result.returncode)
+        self.assertEqual(1234, result.files)
+        self.assertEqual(3, result.files_created)
+        self.assertEqual(12, result.files_transferred)
+        self.assertEqual(1234567, result.total_size)
+        self.assertEqual(12000, result.literal_data)
+        self.assertEqual(345, result.matched_data)
+        self.assertEqual(12890, result.bytes_sent)
+        self.assertEqual(35, result.bytes_received)
+        self.assertEqual(95.52, result.speedup)
+        self.assertEqual(1289, result.throughput)
+
+    def test_progress(self):
+        parser = stats.OutputParser()
+        parser.feed(b'    1,238,099,968  42%   59.01MB/s    0:00:13 '
+                    b'(xfr#5, to-chk=1004/1051)\r   1.30G  45%  '
+                    b'60.00MB/s    0:00:14\r')
+
+        self.assertEqual(1300000000, parser.progress_bytes)
+        self.assertEqual(45, parser.progress_percent)
+        self.assertEqual(60000000, parser.progress_rate)
+        self.assertEqual(5, parser.progress_files)
+
+    def test_bounded(self):
+        parser = stats.OutputParser()
+
+        for i in range(100):
+            parser.feed(b'x' * stats.MAX_LINE)
+
+        self.assertLessEqual(len(parser._partial[False]), stats.MAX_LINE)
+
+        for i in range(100):
+            parser.feed(b'error\n', stderr=True)
+
+        self.assertEqual(stats.MAX_ERRORS, len(parser.errors))
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+
+from rsync_backup import status
+from rsync_backup import supervisor
+from rsync_backup.tests import base as base
+from rsync_backup.tests.test_supervisor import FakeJob
+
+
+PROGRESS = '  1,048,576  25%  1.00MB/s  0:00:03 (xfr#1, to-chk=3/4)'
+
+
+class FakeManager(object):
+    def __init__(self, workers):
+        self.supervisor = supervisor.Supervisor(workers)
+
+    def allowed(self, job, returncode):
+        return returncode == 0
+
+    def submit(self, id, command, priority):
+        job = FakeJob(id)
+        job.source = '/src/%s' % id
+        job.destination = '/dst/%s' % id
+        self.supervisor.submit(job, command, priority)
+
+
+class TestStatus(base.TestCase):
+    def test_status(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+
+        path = os.path.join(root, status.STATUS_SOCKET)
+        mgr = FakeManager(workers=1)
+        mgr.supervisor.serve(status.StatusServer(path, mgr, run_id=1))
+
+        # Started in order of priority by the only worker.
+        mgr.submit('done', ['true'], 40)
+        mgr.submit('failed', ['false'], 30)
+        mgr.submit('running', ['sh', '-c', 'echo "%s"; sleep 1' % (
+                   PROGRESS)], 20)
+        mgr.submit('queued', ['true'], 10)
+
+        answers = []
+        timer = threading.Timer(
+            0.5, lambda: answers.append(status.get_status(path)))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        mgr.supervisor.run()
+        timer.join()
+
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(1, len(answers))
+
+        answer = answers[0]
+
+        self.assertEqual(1, answer['run_id'])
+        self.assertEqual({'queued': 1, 'running': 1, 'done': 1,
+                          'failed': 1}, answer['jobs'])
+
+        self.assertEqual(['failed'], [j['id'] for j in answer['failed']])
+        self.assertEqual('rsync returned 1', answer['failed'][0]['error'])
+
+        running = answer['running'][0]
+
+        self.assertEqual('running', running['id'])
+        self.assertEqual(1024 * 1024, running['bytes'])
+        self.assertEqual(25, running['percent'])
+        self.assertEqual(1000000, answer['throughput'])
+        self.assertEqual(1024 * 1024, answer['transferred'])
+
+        # Three times the elapsed time is left of the running job
+        # before the queued job runs for its expected 10 secs.
+        self.assertAlmostEqual(10 + 3 * running['elapsed'], answer['eta'],
+                               delta=0.5)
+
+    def test_stale_socket(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+
+        path = os.path.join(root, status.STATUS_SOCKET)
+        mgr = FakeManager(workers=1)
+        server = status.StatusServer(path, mgr)
+        mgr.supervisor.serve(server)
+
+        # Left behind without anyone listening on it.
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.close()
+
+        mgr.submit('a', ['true'], 0)
+        mgr.supervisor.run()
+
+        self.assertTrue(mgr.supervisor.children['a'].successful())
+        self.assertFalse(os.path.exists(path))
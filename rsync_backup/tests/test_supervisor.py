@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from timeit import default_timer as timer
+
+from rsync_backup import rsync
+from rsync_backup import supervisor
+from rsync_backup.tests import base as base
+from rsync_backup.throttle import Throttle
+
+
+class FakeJob(object):
+    def __init__(self, id, size=None, members=None, devices=(),
+                 retry=None, timeout=None, stall_timeout=None):
+        self.id = id
+        self.files_from = None
+        self.size = size
+        self.members = members
+        self.devices = devices
+        self.retry = retry
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+
+
+class TestSupervisor(base.TestCase):
+    def test_workers_limit(self):
+        sup = supervisor.Supervisor(workers=2)
+
+        children = [sup.submit(FakeJob(str(i)), ['sleep', '0.2'])
+                    for i in range(4)]
+
+        start = timer()
+        sup.run()
+        elapsed = timer() - start
+
+        self.assertGreaterEqual(elapsed, 0.4)
+
+        for child in children:
+            self.assertTrue(child.ready())
+            self.assertTrue(child.successful())
+            self.assertEqual(0, child.get().returncode)
+
+    def test_returncode(self):
+        sup = supervisor.Supervisor()
+        child = sup.submit(FakeJob('1'), ['sh', '-c', 'exit 23'])
+        sup.run()
+
+        self.assertTrue(child.successful())
+        self.assertEqual(23, child.get().returncode)
+
+    def test_cancel(self):
+        sup = supervisor.Supervisor(workers=1)
+        running = sup.submit(FakeJob('1'), ['sleep', '10'])
+        queued = sup.submit(FakeJob('2'), ['sleep', '10'])
+
+        sup.loop.call_later(0.2, sup.cancel_all)
+
+        start = timer()
+        sup.run()
+
+        self.assertLess(timer() - start, 5)
+        self.assertEqual(supervisor.CANCELLED, running.state)
+        self.assertEqual(supervisor.CANCELLED, queued.state)
+        self.assertFalse(running.successful())
+        self.assertRaises(RuntimeError, running.get)
+
+    def test_priority(self):
+        sup = supervisor.Supervisor(workers=1)
+        low = sup.submit(FakeJob('low'), ['true'], priority=1)
+        high = sup.submit(FakeJob('high'), ['true'], priority=10)
+        sup.run()
+
+        self.assertLess(high.start, low.start)
+
+    def test_produce_while_running(self):
+        sup = supervisor.Supervisor(workers=2)
+        seen = []
+
+        def produce():
+            yield FakeJob('1'), ['sleep', '0.5'], 0
+            time.sleep(0.2)
+            seen.append(sup.children['1'].state)
+            yield FakeJob('2'), ['true'], 0
+
+        sup.run(produce())
+
+        self.assertEqual([supervisor.RUNNING], seen)
+        self.assertEqual(2, len(sup.children))
+
+        for child in sup.children.values():
+            self.assertTrue(child.successful())
+
+    def test_bundle(self):
+        sup = supervisor.Supervisor()
+        members = [FakeJob('a', size=300), FakeJob('b', size=100)]
+        bundle = FakeJob('bundle', members=members)
+
+        sup.submit(bundle, ['sh', '-c', 'echo "Total bytes sent: 400"'])
+        sup.run()
+
+        self.assertEqual(['a', 'b'], list(sup.children))
+
+        a = sup.children['a'].get()
+        b = sup.children['b'].get()
+        self.assertEqual(0, a.returncode)
+        self.assertEqual(300, a.bytes_sent)
+        self.assertEqual(100, b.bytes_sent)
+        self.assertAlmostEqual(a.seconds, 3 * b.seconds)
+
+    def test_device_limit(self):
+        sup = supervisor.Supervisor(workers=3)
+        busy = [sup.submit(FakeJob(str(i), devices=((1, 1),)),
+                           ['sleep', '0.2'], priority=10)
+                for i in range(3)]
+        other = sup.submit(FakeJob('other', devices=((2, 1),)), ['true'])
+        sup.run()
+
+        # Only one job at a time on device 1 but device 2 is not
+        # held back by it.
+        busy.sort(key=lambda c: c.start)
+
+        for before, after in zip(busy, busy[1:]):
+            self.assertLessEqual(before.end, after.start)
+
+        self.assertLess(other.start, busy[1].start)
+
+    def test_bandwidth_limit(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+
+        # Ignores the --bwlimit it is given.
+        script = os.path.join(root, 'sleep')
+
+        with open(script, 'w') as f:
+            f.write('#!/bin/sh\nsleep 0.2\n')
+
+        os.chmod(script, 0o755)
+
+        sup = supervisor.Supervisor(workers=1, throttle=Throttle(1000))
+        first = sup.submit(FakeJob('first'), [script], priority=10)
+        rest = [sup.submit(FakeJob(str(i)), [script]) for i in range(2)]
+        sup.loop.call_later(0.05, sup.resize, 2)
+        sup.run()
+
+        # The first job got the whole limit so the others waits for it
+        # even though there is a free worker.
+        self.assertEqual(1000, first.bwlimit)
+        self.assertEqual([500, 500], [c.bwlimit for c in rest])
+
+        for child in rest:
+            self.assertLessEqual(first.end, child.start)
+
+        self.assertEqual(0, sup.throttle.allocated)
+
+    def test_every(self):
+        sup = supervisor.Supervisor()
+        calls = []
+
+        sup.every(0.05, lambda: calls.append(timer()))
+        sup.submit(FakeJob('1'), ['sleep', '0.3'])
+        sup.run()
+
+        self.assertGreaterEqual(len(calls), 3)
+
+    def test_retry(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+
+        # Fails with 23 the first time and succeeds after that.
+        marker = os.path.join(root, 'marker')
+        command = ['sh', '-c', 'test -e %s || { touch %s; exit 23; }' % (
+                   marker, marker)]
+
+        sup = supervisor.Supervisor(workers=2)
+        job = FakeJob('1', retry={'returncodes': [23], 'attempts': 3,
+                                  'backoff': 0.1})
+        other = sup.submit(FakeJob('2'), ['sh', '-c', 'exit 24'])
+        sup.submit(job, command)
+        sup.run()
+
+        child = sup.children['1']
+        self.assertEqual(0, child.get().returncode)
+        self.assertEqual(2, child.attempt)
+
+        # The backoff is lost on top of the failed attempt.
+        self.assertGreaterEqual(child.lost, 0.1)
+
+        # Only jobs with a policy and matching return code is retried.
+        self.assertEqual(1, other.attempt)
+        self.assertEqual(24, other.get().returncode)
+
+    def test_retry_gives_up(self):
+        sup = supervisor.Supervisor()
+        job = FakeJob('1', retry={'returncodes': [23], 'attempts': 2,
+                                  'backoff': 0})
+        sup.submit(job, ['sh', '-c', 'exit 23'])
+        sup.run()
+
+        child = sup.children['1']
+        self.assertEqual(23, child.get().returncode)
+        self.assertEqual(2, child.attempt)
+
+    def test_timeout(self):
+        sup = supervisor.Supervisor(workers=1)
+        hung = sup.submit(FakeJob('1', timeout=0.2), ['sleep', '10'])
+        other = sup.submit(FakeJob('2'), ['true'])
+
+        start = timer()
+        sup.run()
+
+        self.assertLess(timer() - start, 5)
+        self.assertEqual(supervisor.KILLED, hung.state)
+        self.assertFalse(hung.successful())
+        self.assertRaises(RuntimeError, hung.get)
+        self.assertTrue(other.successful())
+
+    def test_stall_timeout(self):
+        sup = supervisor.Supervisor(workers=2)
+        stalled = sup.submit(FakeJob('1', stall_timeout=0.3),
+                             ['sh', '-c', 'echo start; sleep 10'])
+        moving = sup.submit(FakeJob('2', stall_timeout=0.3),
+                            ['sh', '-c', 'for i in 1 2 3 4 5 6 7 8; do '
+                             'echo $i; sleep 0.1; done'])
+        sup.run()
+
+        self.assertEqual(supervisor.KILLED, stalled.state)
+        self.assertIn('no progress', stalled.killed)
+        self.assertTrue(moving.successful())
+        self.assertEqual(0, moving.get().returncode)
+
+    def test_stall_timeout_without_io_counters(self):
+        self.patch(supervisor, 'get_io_counters', lambda pid: None)
+
+        sup = supervisor.Supervisor(workers=2)
+        quiet = sup.submit(FakeJob('1', stall_timeout=0.3),
+                           ['sh', '-c', 'sleep 0.8'])
+        # Only the output can tell if it moves.
+        stalled = sup.submit(FakeJob('2', stall_timeout=0.3),
+                             ['sh', '-c', 'echo start; sleep 10',
+                              '--info=progress2'])
+        sup.run()
+
+        self.assertTrue(quiet.successful())
+        self.assertEqual(supervisor.KILLED, stalled.state)
+
+    def test_timeout_gives_up(self):
+        self.patch(supervisor, 'KILL_GRACE', 0.1)
+
+        # The output is held open by a process outside of the process
+        # group so rsync never looks done, like when stuck on a dead
+        # mount.
+        sup = supervisor.Supervisor()
+        child = sup.submit(FakeJob('1', timeout=0.2),
+                           ['sh', '-c', 'setsid sleep 2 & sleep 10'])
+
+        start = timer()
+        sup.run()
+
+        self.assertLess(timer() - start, 1.5)
+        self.assertEqual(supervisor.KILLED, child.state)
+        # The pipes was closed without waiting for the process.
+        self.assertTrue(child.transport.is_closing())
+
+    def test_spawn_rsync(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def spawn():
+            process, transport = await rsync.spawn_rsync(
+                ['sh', '-c', 'read name; echo $name; exit 3'],
+                files_from=[])
+            process.stdin.write(b'a\n')
+            process.stdin.close()
+
+            output = await process.stdout.read()
+            returncode = await process.wait()
+
+            return output, returncode, transport.get_returncode()
+
+        self.assertEqual((b'a\n', 3, 3), loop.run_until_complete(spawn()))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from rsync_backup.throttle import Throttle
+from rsync_backup.tests import base as base
+
+
+class TestThrottle(base.TestCase):
+    def test_split(self):
+        throttle = Throttle(1000)
+
+        shares = [throttle.acquire(4, 4) for _ in range(4)]
+        self.assertEqual([250] * 4, shares)
+        self.assertEqual(1000, throttle.allocated)
+
+        # Only two jobs left to run gets what the finished ones freed.
+        throttle.release(shares.pop())
+        throttle.release(shares.pop())
+        self.assertEqual(500, throttle.acquire(2, 4))
+
+    def test_never_above_total(self):
+        throttle = Throttle(1000)
+
+        # Workers growing from one to four while jobs is running.
+        first = throttle.acquire(1, 1)
+        self.assertEqual(1000, first)
+        self.assertIsNone(throttle.acquire(2, 2))
+        self.assertIsNone(throttle.acquire(4, 4))
+        self.assertEqual(1000, throttle.allocated)
+
+        throttle.release(first)
+        shares = [throttle.acquire(4, 4) for _ in range(5)]
+        self.assertEqual([250] * 4 + [None], shares)
+        self.assertEqual(1000, throttle.allocated)
+
+    def test_never_below_even_split(self):
+        throttle = Throttle(1000)
+
+        first = throttle.acquire(2, 2)
+        self.assertEqual(500, first)
+        self.assertEqual(250, throttle.acquire(4, 4))
+
+        # Less than a even split between two workers is left.
+        self.assertIsNone(throttle.acquire(1, 2))
+
+        throttle.release(first)
+        self.assertEqual(750, throttle.acquire(1, 2))
+
+    def test_limit_command(self):
+        throttle = Throttle(1000)
+
+        command, share = throttle.limit(['rsync', '-a', 'src/', 'dst'], 2, 2)
+        self.assertEqual(500, share)
+        self.assertEqual(['rsync', '--bwlimit=500', '-a', 'src/', 'dst'],
+                         command)
+
+        # Jobs with their own limit is left alone.
+        command, share = throttle.limit(['rsync', '--bwlimit=10'], 2, 2)
+        self.assertIsNone(share)
+        self.assertEqual(['rsync', '--bwlimit=10'], command)
+
+        # Nothing is left for a job that would be limited.
+        throttle.acquire(1, 2)
+        self.assertEqual((None, None),
+                         throttle.limit(['rsync', '-a'], 2, 2))
+
+    def test_no_limit(self):
+        throttle = Throttle()
+
+        command, share = throttle.limit(['rsync', '-a'], 2, 2)
+        self.assertIsNone(share)
+        self.assertEqual(['rsync', '-a'], command)
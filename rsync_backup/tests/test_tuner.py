@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+from timeit import default_timer as timer
+
+from rsync_backup import supervisor
+from rsync_backup import tuner
+from rsync_backup.tests import base as base
+from rsync_backup.tests.test_supervisor import FakeJob
+
+
+# Kept before the tests replaces them.
+read_cpu_times = tuner.read_cpu_times
+read_load = tuner.read_load
+
+
+class FakeChild(object):
+    def __init__(self, pid):
+        self.pid = pid
+        self.bundle = None
+
+
+class FakeSupervisor(object):
+    def __init__(self, workers, running, pending):
+        self.workers = workers
+        self.children = [FakeChild(i + 1) for i in range(running)]
+        self.waiting = pending
+
+    def running(self):
+        return self.children
+
+    def pending(self):
+        return self.waiting
+
+    def resize(self, workers):
+        self.workers = workers
+
+
+class TestTuner(base.TestCase):
+    def setUp(self):
+        super(TestTuner, self).setUp()
+        self.cpu_times = [(0, 1000)]
+        self.io = {}
+
+        self.patch(tuner, 'read_cpu_times', lambda: self.cpu_times[-1])
+        self.patch(tuner, 'read_load', lambda: 0.5)
+        self.patch(tuner, 'get_io_counters', lambda pid: self.io[pid])
+
+    def test_read_proc(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+
+        stat = os.path.join(root, 'stat')
+
+        with open(stat, 'w') as f:
+            f.write('cpu  10 0 20 60 10 0 0 0 0 0\ncpu0 1 2 3 4 5 6 7 8\n')
+
+        self.assertEqual((10, 100), read_cpu_times(stat))
+        self.assertIsNone(read_cpu_times(os.path.join(root, 'missing')))
+
+        loadavg = os.path.join(root, 'loadavg')
+
+        with open(loadavg, 'w') as f:
+            f.write('4.00 2.00 1.00 1/100 1234\n')
+
+        self.assertAlmostEqual(4.0 / (os.cpu_count() or 1),
+                               read_load(loadavg))
+
+    def test_increase(self):
+        sup = FakeSupervisor(2, running=2, pending=5)
+        self.io = {1: 0, 2: 0}
+
+        t = tuner.WorkerTuner(sup, min_workers=2, max_workers=3)
+        t.adjust()
+        self.assertEqual(3, sup.workers)
+
+        # Never above max_workers.
+        sup.children.append(FakeChild(3))
+        self.io[3] = 0
+        t.adjust()
+        self.assertEqual(3, sup.workers)
+
+    def test_decrease_on_iowait(self):
+        sup = FakeSupervisor(8, running=8, pending=5)
+        self.io = dict((c.pid, 0) for c in sup.children)
+
+        t = tuner.WorkerTuner(sup, min_workers=3, max_workers=8,
+                              max_iowait=30)
+        self.cpu_times.append((50, 1100))
+        t.adjust()
+        self.assertEqual(4, sup.workers)
+
+        # Never below min_workers.
+        self.cpu_times.append((100, 1200))
+        t.adjust()
+        self.assertEqual(3, sup.workers)
+
+    def test_decrease_on_slowdown(self):
+        sup = FakeSupervisor(4, running=4, pending=5)
+        self.io = dict((c.pid, 0) for c in sup.children)
+
+        t = tuner.WorkerTuner(sup, min_workers=1, max_workers=8)
+        t.adjust()
+        self.assertEqual(5, sup.workers)
+
+        # Adding a worker made the rsync processes move less data.
+        sup.children.append(FakeChild(5))
+        self.io = dict((c.pid, 1000000) for c in sup.children)
+        t.adjust()
+        self.assertEqual(6, sup.workers)
+
+        sup.children.append(FakeChild(6))
+        self.io[6] = 0
+        t.adjust()
+        self.assertEqual(3, sup.workers)
+
+    def test_rate_new_and_exited(self):
+        sup = FakeSupervisor(2, running=2, pending=0)
+        self.io = {1: 0, 2: 0}
+        now = [0.0]
+
+        self.patch(tuner, 'timer', lambda: now[0])
+
+        t = tuner.WorkerTuner(sup, min_workers=1, max_workers=3)
+        self.assertIsNone(t._sample_rate())
+
+        # The first process exits after its last reading and a new one
+        # that is not seen by the last sample is started.
+        self.io[1] = 300
+        t.sample()
+        sup.children = [sup.children[1], FakeChild(3)]
+        self.io.update({2: 500, 3: 200})
+
+        now[0] = 10.0
+        self.assertEqual(100, t._sample_rate())
+
+    def test_resize(self):
+        sup = supervisor.Supervisor(workers=1)
+
+        for i in range(4):
+            sup.submit(FakeJob(str(i)), ['sleep', '0.3'])
+
+        sup.loop.call_later(0.1, sup.resize, 4)
+
+        start = timer()
+        sup.run()
+
+        self.assertLess(timer() - start, 0.9)
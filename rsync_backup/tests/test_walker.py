@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+
+from rsync_backup.tests import base as base
+from rsync_backup.walker import Walker, scan_dir
+
+
+class TestWalker(base.TestCase):
+    def setUp(self):
+        super(TestWalker, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        for i in range(3):
+            for j in range(4):
+                os.makedirs(os.path.join(self.root, 'd%i' % i, 's%i' % j))
+
+            with open(os.path.join(self.root, 'd%i' % i, 'f'), 'w') as f:
+                f.write('data')
+
+        os.symlink(os.path.join(self.root, 'd0'),
+                   os.path.join(self.root, 'link'))
+
+    def test_scan_dir(self):
+        entries = scan_dir(os.path.join(self.root, 'd0'), sizes=True)
+        self.assertEqual(4, len(entries.dirs))
+        self.assertEqual(1, entries.files)
+        self.assertEqual(4, entries.bytes)
+
+    def test_symlinks(self):
+        followed = scan_dir(self.root)
+        self.assertEqual(4, len(followed.dirs))
+
+        not_followed = scan_dir(self.root, follow_symlinks=False)
+        self.assertEqual(3, len(not_followed.dirs))
+        self.assertEqual(1, not_followed.files)
+
+    def test_dirs_at_depth(self):
+        for threads in (1, 4):
+            walker = Walker(threads)
+            dirs = walker.dirs_at_depth(self.root, 2)
+
+            self.assertEqual(16, len(dirs))
+            self.assertIn(os.path.join(self.root, 'd2', 's3'), dirs)
+            self.assertEqual(5, walker.scanned)
+            self.assertGreater(walker.scan_seconds, 0)
+
+    def test_dirs_at_depth_error(self):
+        scandir = os.scandir
+
+        def fake_scandir(path):
+            if path == os.path.join(self.root, 'd1'):
+                raise PermissionError('denied')
+
+            return scandir(path)
+
+        self.patch(os, 'scandir', fake_scandir)
+
+        errors = []
+        dirs = Walker(1).dirs_at_depth(self.root, 2, errors=errors)
+
+        self.assertEqual(12, len(dirs))
+        self.assertEqual([os.path.join(self.root, 'd1')],
+                         [e.path for e in errors])
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+
+from rsync_backup import inotify
+from rsync_backup.manager import Manager
+from rsync_backup.tests import base as base
+from rsync_backup.watch import Watcher
+
+
+class TestWatcher(base.TestCase):
+    def setUp(self):
+        super(TestWatcher, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        self.src = os.path.join(self.root, 'src')
+        self.dst = os.path.join(self.root, 'dst')
+        os.mkdir(self.dst)
+
+        for name in ('a', 'b'):
+            os.makedirs(os.path.join(self.src, name, 'deep'))
+
+        mgr = Manager('rsync')
+        mgr.queue_jobs({'jobs': [{
+            'source': {'path': self.src},
+            'destination': {'path': self.dst},
+            'steps': 1,
+        }]})
+
+        self.watcher = Watcher(mgr, debounce=0, initial=False)
+        self.watcher.inotify = inotify.Inotify()
+        self.addCleanup(self.watcher.inotify.close)
+
+        self.watcher._sweep(full=False)
+
+    def _handle_events(self):
+        for event in self.watcher.inotify.read(1):
+            self.watcher.handle(event)
+
+    def test_sweep_watches_tree(self):
+        self.assertEqual(5, len(self.watcher.watches))
+        self.assertEqual({}, self.watcher.dirty)
+
+    def test_change_marks_shard(self):
+        path = os.path.join(self.src, 'a', 'deep', 'file')
+
+        with open(path, 'w') as f:
+            f.write('data')
+
+        self._handle_events()
+
+        dirty = [job.source for job, _ in self.watcher.dirty.values()]
+        self.assertEqual([os.path.join(self.src, 'a')], dirty)
+        self.assertIsNone(self.watcher.resweep_at)
+
+    def test_change_in_packed_directory(self):
+        for path in ('loose', 'a/deep/file', 'b/deep/file'):
+            with open(os.path.join(self.src, path), 'w') as f:
+                f.write('x' * 10)
+
+        mgr = Manager('rsync')
+        mgr.queue_jobs({'jobs': [{
+            'source': {'path': self.src},
+            'destination': {'path': self.dst},
+            'split': {'max_bytes': 20},
+        }]})
+
+        watcher = Watcher(mgr, debounce=0, initial=False)
+        watcher.inotify = inotify.Inotify()
+        self.addCleanup(watcher.inotify.close)
+        watcher._sweep(full=False)
+
+        with open(os.path.join(self.src, 'a', 'deep', 'file'), 'a') as f:
+            f.write('more')
+
+        for event in watcher.inotify.read(1):
+            watcher.handle(event)
+
+        # Only the shard with a packed into it runs.
+        dirty = [job.files_from for job, _ in watcher.dirty.values()]
+        self.assertEqual([['a', 'b']], dirty)
+        self.assertIsNone(watcher.resweep_at)
+
+    def test_new_shard_is_swept(self):
+        os.mkdir(os.path.join(self.src, 'c'))
+        self._handle_events()
+
+        self.assertIsNotNone(self.watcher.resweep_at)
+
+        self.watcher._sweep(full=False)
+
+        dirty = [job.source for job, _ in self.watcher.dirty.values()]
+        self.assertEqual([os.path.join(self.src, 'c')], dirty)
+        self.assertIn(os.path.join(self.src, 'c'),
+                      self.watcher.watches.values())
+
+    def test_overflow_sweeps_everything(self):
+        self.watcher.handle(inotify.Event(-1, inotify.IN_Q_OVERFLOW, 0, ''))
+        self.assertTrue(self.watcher.full_sweep)
+
+        self.watcher._sweep(full=self.watcher.full_sweep)
+        self.assertEqual(2, len(self.watcher.dirty))
+
+    def test_report_override_returncodes(self):
+        mgr = Manager('sh', allowed_returncodes=[0, 24],
+                      override_returncodes=True)
+        mgr.queue_jobs({'jobs': [{
+            'source': {'path': self.src},
+            'destination': {'path': self.dst},
+            'steps': 0,
+            'allowed_returncodes': [0],
+        }]})
+
+        watcher = Watcher(mgr, debounce=0, initial=False)
+        job = mgr.explode()[0]
+        job._command = ['sh', '-c', 'exit 24']
+
+        mgr.supervisor.submit(job, job.command)
+        mgr.supervisor.run()
+
+        # The return codes given as argument wins over the job.
+        watcher._report(mgr.supervisor.children[job.id])
+        self.assertEqual(1, watcher.completed)
+        self.assertEqual(0, watcher.failed)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+from rsync_backup.utils import which
+
+
+LOG = logging.getLogger(__name__)
+
+
+def get_priority_prefix(ionice_class=None, ionice_level=None, nice=None):
+    prefix = []
+
+    if ionice_class is not None:
+        ionice_path = which('ionice')
+
+        if ionice_path is None:
+            LOG.warning('could not find ionice executable, rsync will '
+                        'run with the default io priority')
+        else:
+            prefix += [ionice_path, '-c', str(ionice_class)]
+
+            if ionice_level is not None:
+                prefix += ['-n', str(ionice_level)]
+
+    if nice is not None:
+        nice_path = which('nice')
+
+        if nice_path is None:
+            LOG.warning('could not find nice executable, rsync will '
+                        'run with the default priority')
+        else:
+            prefix += [nice_path, '-n', str(nice)]
+
+    return prefix
+
+
+def has_bwlimit(command):
+    for arg in command:
+        if arg.startswith('--bwlimit'):
+            return True
+
+    return False
+
+
+class Throttle(object):
+    """Shares a total bandwidth limit between the running rsync.
+
+    rsync cannot change its --bwlimit once started so each job gets
+    its share of what is left of the total when it starts, based on
+    how many jobs is expected to run next to it. The total is never
+    handed out more than once, a job waits until at least an even
+    split of it is free.
+    """
+
+    def __init__(self, bandwidth_limit=None, ionice_class=None,
+                 ionice_level=None, nice=None):
+        # In KiB/s like --bwlimit.
+        self.bandwidth_limit = bandwidth_limit
+        self.prefix = get_priority_prefix(ionice_class, ionice_level, nice)
+        self.allocated = 0
+
+    def acquire(self, expected, workers):
+        # None when the job must wait for running jobs to release
+        # their share.
+        total = self.bandwidth_limit
+        available = total - self.allocated
+
+        # Never go below an even split so a job is not starved by
+        # jobs that started when fewer was running.
+        if available < max(total // max(workers, 1), 1):
+            return None
+
+        share = min(total // max(expected, 1), available)
+        share = max(share, 1)
+        self.allocated += share
+
+        return share
+
+    def release(self, share):
+        if share is not None:
+            self.allocated -= share
+
+    def limit(self, command, expected, workers):
+        # Returns None as command when there is no bandwidth left.
+        share = None
+
+        if self.bandwidth_limit is not None and not has_bwlimit(command):
+            share = self.acquire(expected, workers)
+
+            if share is None:
+                return None, None
+
+            command = [command[0], '--bwlimit=%i' % share] + command[1:]
+
+        return self.prefix + command, share
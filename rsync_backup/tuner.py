@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+from rsync_backup.supervisor import get_io_counters
+import os
+from timeit import default_timer as timer
+
+
+LOG = logging.getLogger(__name__)
+
+# Defaults for the autotune config.
+DEFAULT_INTERVAL = 30
+DEFAULT_MAX_IOWAIT = 30
+DEFAULT_MAX_LOAD = 2.0
+
+# Seconds between reading the io counters of the rsync processes. A
+# process that exits is counted up to the last reading since its
+# counters is gone once it is reaped.
+SAMPLE_INTERVAL = 1
+
+# Workers is multiplied with this when backing off.
+DECREASE = 0.5
+
+# A drop in throughput bigger than this after adding a worker means
+# the disks is thrashing.
+RATE_DROP = 0.1
+
+
+def read_cpu_times(path='/proc/stat'):
+    # Returns the iowait and total cpu time, None if not available.
+    try:
+        with open(path) as f:
+            fields = f.readline().split()
+    except (IOError, OSError):
+        return None
+
+    if not fields or fields[0] != 'cpu':
+        return None
+
+    # user nice system idle iowait irq softirq steal
+    times = [int(v) for v in fields[1:9]]
+
+    return times[4], sum(times)
+
+
+def read_load(path='/proc/loadavg'):
+    # Returns the one minute load average for each cpu.
+    try:
+        with open(path) as f:
+            load = float(f.read().split()[0])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+    return load / (os.cpu_count() or 1)
+
+
+class WorkerTuner(object):
+    """Changes the amount of workers while running.
+
+    Starts at min_workers and adds one worker at a time while every
+    worker is busy and jobs is waiting. The amount of workers is
+    halved, but never below min_workers, when iowait or load is too
+    high or when adding a worker made the rsync processes slower.
+    """
+
+    def __init__(self, supervisor, min_workers=1, max_workers=1,
+                 max_iowait=DEFAULT_MAX_IOWAIT, max_load=DEFAULT_MAX_LOAD):
+        self.supervisor = supervisor
+        self.min_workers = min_workers
+        self.max_workers = max(max_workers, min_workers)
+        # In percent of the cpu time.
+        self.max_iowait = max_iowait
+        self.max_load = max_load
+        self.adjustments = 0
+        self.last_rate = None
+        self._increased = False
+        # Counters when the last rate was sampled, the latest reading
+        # and what processes that exited since then moved.
+        self._counters = {}
+        self._latest = {}
+        self._moved = 0
+        self._sample_time = None
+        self._cpu_times = read_cpu_times()
+
+    def _processes(self):
+        # Jobs in a bundle share the same rsync.
+        processes = {}
+
+        for child in self.supervisor.running():
+            process = child.bundle or child
+            processes[id(process)] = process
+
+        return list(processes.values())
+
+    def sample(self):
+        # Called more often than adjust so the io of processes that
+        # exits between adjustments is not lost.
+        latest = {}
+
+        for process in self._processes():
+            if process.pid is None:
+                continue
+
+            value = get_io_counters(process.pid)
+
+            if value is not None:
+                latest[process.pid] = value
+
+        for pid, value in self._latest.items():
+            if pid not in latest:
+                self._moved += value - self._counters.pop(pid, 0)
+
+        self._latest = latest
+
+    def _sample_rate(self):
+        self.sample()
+        now = timer()
+
+        # Processes started since the last sample is counted from zero.
+        moved = self._moved + sum(value - self._counters.get(pid, 0)
+                                  for pid, value in self._latest.items())
+
+        previous = self._sample_time
+        self._counters = dict(self._latest)
+        self._moved = 0
+        self._sample_time = now
+
+        if previous is None or now <= previous:
+            return None
+
+        return moved / (now - previous)
+
+    def _sample_iowait(self):
+        cpu_times = read_cpu_times()
+        previous = self._cpu_times
+        self._cpu_times = cpu_times
+
+        if cpu_times is None or previous is None:
+            return None
+
+        total = cpu_times[1] - previous[1]
+
+        if total <= 0:
+            return None
+
+        return 100.0 * (cpu_times[0] - previous[0]) / total
+
+    def _congested(self, rate, iowait, load):
+        if iowait is not None and iowait > self.max_iowait:
+            return 'iowait is %.0f%%' % iowait
+
+        if load is not None and load > self.max_load:
+            return 'load is %.1f per cpu' % load
+
+        if not self._increased or not self.last_rate or rate is None:
+            return None
+
+        if rate < self.last_rate * (1 - RATE_DROP):
+            return 'throughput dropped from %.1f to %.1f MiB/s' % (
+                self.last_rate / 1024 / 1024, rate / 1024 / 1024)
+
+        return None
+
+    def _saturated(self):
+        busy = len(self._processes())
+        return busy >= self.supervisor.workers and self.supervisor.pending()
+
+    def adjust(self):
+        rate = self._sample_rate()
+        iowait = self._sample_iowait()
+        load = read_load()
+
+        workers = self.supervisor.workers
+        reason = self._congested(rate, iowait, load)
+
+        if reason is not None:
+            new_workers = max(self.min_workers, int(workers * DECREASE))
+        elif self._saturated():
+            new_workers = min(self.max_workers, workers + 1)
+            reason = 'every worker is busy'
+        else:
+            new_workers = workers
+
+        self._increased = new_workers > workers
+        self.last_rate = rate
+
+        if rate is not None:
+            LOG.debug('rsync io is %.1f MiB/s with %i workers' % (
+                      rate / 1024 / 1024, workers))
+
+        if new_workers == workers:
+            return
+
+        LOG.info('changing workers from %i to %i since %s' % (
+                 workers, new_workers, reason))
+
+        self.adjustments += 1
+        self.supervisor.resize(new_workers)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from concurrent import futures
+import functools
+import logging
+import os
+import six
+from timeit import default_timer as timer
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_THREADS = 8
+
+
+class DirEntries(object):
+    __slots__ = ('path', 'dirs', 'bytes', 'files', 'error')
+
+    def __init__(self, path):
+        self.path = path
+        self.dirs = []
+        self.bytes = 0
+        self.files = 0
+        # Set if the directory could not be scanned.
+        self.error = None
+
+
+def scan_dir(path, sizes=False, follow_symlinks=True):
+    result = DirEntries(path)
+
+    try:
+        it = os.scandir(path)
+    except OSError as exc:
+        LOG.error('failed to scan directory %s: %s' % (
+                  path, six.text_type(exc)))
+        result.error = exc
+        return result
+
+    for entry in it:
+        try:
+            # The type comes from d_type so this does not stat
+            # unless the entry is a symlink that should be followed.
+            if entry.is_dir(follow_symlinks=follow_symlinks):
+                result.dirs.append(entry.path)
+                continue
+
+            if sizes:
+                result.bytes += entry.stat(follow_symlinks=False).st_size
+        except OSError as exc:
+            LOG.debug('failed to check %s: %s' % (
+                      entry.path, six.text_type(exc)))
+            continue
+
+        result.files += 1
+
+    return result
+
+
+class Walker(object):
+    """Scans directories one level at a time using a thread pool.
+
+    Directories on the same level is scanned in parallel which
+    hides the latency of network filesystems.
+    """
+
+    def __init__(self, threads=DEFAULT_THREADS):
+        self.threads = threads
+        self.scanned = 0
+        self.scan_seconds = 0
+
+    def scan(self, paths, sizes=False, follow_symlinks=True):
+        start = timer()
+
+        func = functools.partial(scan_dir, sizes=sizes,
+                                 follow_symlinks=follow_symlinks)
+
+        if self.threads <= 1 or len(paths) <= 1:
+            results = [func(p) for p in paths]
+        else:
+            threads = min(self.threads, len(paths))
+
+            with futures.ThreadPoolExecutor(max_workers=threads) as ex:
+                results = list(ex.map(func, paths))
+
+        self.scanned += len(paths)
+        self.scan_seconds += timer() - start
+
+        return results
+
+    def iter_scan(self, paths, sizes=False, follow_symlinks=True):
+        # Like scan but results is yielded as soon as they are ready
+        # and only the time spent waiting for them is counted.
+        start = timer()
+
+        func = functools.partial(scan_dir, sizes=sizes,
+                                 follow_symlinks=follow_symlinks)
+        threads = max(min(self.threads, len(paths)), 1)
+
+        with futures.ThreadPoolExecutor(max_workers=threads) as ex:
+            results = ex.map(func, paths)
+
+            while True:
+                try:
+                    entries = next(results)
+                except StopIteration:
+                    break
+
+                self.scanned += 1
+                self.scan_seconds += timer() - start
+
+                yield entries
+
+                start = timer()
+
+        self.scan_seconds += timer() - start
+
+    def dirs_at_depth(self, path, depth, errors=None):
+        # Directories that could not be scanned is appended to errors
+        # since the directories below them is missing from the result.
+        level = [path]
+
+        while depth > 0:
+            new_level = []
+
+            for entries in self.scan(level):
+                if entries.error is not None and errors is not None:
+                    errors.append(entries)
+
+                new_level += entries.dirs
+
+            level = new_level
+            depth -= 1
+
+        return level
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2019 Tobias Urdin
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import errno
+import logging
+from rsync_backup import inotify
+from rsync_backup.job import Job
+import os
+import six
+from timeit import default_timer as timer
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_DEBOUNCE = 10
+
+# How long to wait for events before checking for finished jobs.
+TICK = 1.0
+
+# Events that change which files is in a directory.
+ENTRY_EVENTS = inotify.IN_CREATE | inotify.IN_DELETE
+ENTRY_EVENTS |= inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO
+
+
+class Watcher(object):
+    """Runs the shards whose source changed.
+
+    Every directory below the job sources is watched with inotify and
+    events is coalesced per shard, a shard is run when no event has
+    been seen for it during the debounce time. Events that no shard
+    covers makes the jobs to be exploded again and a overflowed event
+    queue makes every shard run again.
+    """
+
+    def __init__(self, manager, debounce=DEFAULT_DEBOUNCE, sweep_interval=0,
+                 initial=True):
+        self.manager = manager
+        self.supervisor = manager.supervisor
+        self.debounce = debounce
+        self.sweep_interval = sweep_interval
+        self.initial = initial
+        self.inotify = None
+        self.watches = {}
+        self.roots = set()
+        self.shards = {}
+        self.dirty = {}
+        self.active = {}
+        self.last_sweep = None
+        self.resweep_at = None
+        self.full_sweep = False
+        self.completed = 0
+        self.failed = 0
+        self._watch_errors = 0
+
+    def _watch_tree(self, path):
+        level = [path]
+
+        while level:
+            for dirpath in level:
+                try:
+                    wd = self.inotify.add_watch(dirpath)
+                except OSError as exc:
+                    if exc.errno == errno.ENOSPC:
+                        self._watch_errors += 1
+
+                        if self._watch_errors == 1:
+                            LOG.error('out of inotify watches, raise '
+                                      'fs.inotify.max_user_watches or use '
+                                      'a sweep interval')
+                    else:
+                        LOG.debug('failed to watch %s: %s' % (
+                                  dirpath, six.text_type(exc)))
+                    continue
+
+                self.watches[wd] = dirpath
+
+            new_level = []
+
+            for entries in self.manager.walker.scan(level,
+                                                    follow_symlinks=False):
+                new_level += entries.dirs
+
+            level = new_level
+
+    def _sweep(self, full):
+        start = timer()
+        jobs = self.manager.explode()
+
+        shards = {}
+        roots = set()
+
+        for job in jobs:
+            roots.add(os.path.normpath(job.template.source))
+            shards.setdefault(os.path.normpath(job.source), []).append(job)
+
+        keys = set(j.key for js in self.shards.values() for j in js)
+        self.shards = shards
+
+        for root in roots:
+            # Directories created while events was lost is only found
+            # by watching the whole tree again.
+            if full or root not in self.roots:
+                self._watch_tree(root)
+
+        self.roots = roots
+
+        now = timer()
+        marked = 0
+
+        for job in jobs:
+            # Only new shards needs to run unless it is a full sweep.
+            if full or (self.last_sweep is not None and job.key not in keys):
+                self._mark(job, now - self.debounce)
+                marked += 1
+
+        self.last_sweep = now
+        self.resweep_at = None
+        self.full_sweep = False
+
+        LOG.info('swept %i shards with %i watches in %.2f secs, %i shards '
+                 'is dirty' % (len(jobs), len(self.watches),
+                               timer() - start, marked))
+
+    def _mark(self, job, when):
+        self.dirty[job.key] = (job, when)
+
+    def shards_for(self, dirpath, name):
+        full_path = os.path.join(dirpath, name) if name else dirpath
+        path = full_path
+
+        while True:
+            jobs = self.shards.get(path, None)
+
+            if jobs is not None:
+                break
+
+            parent = os.path.dirname(path)
+
+            if path in self.roots or parent == path:
+                return None
+
+            path = parent
+
+        if full_path == path or jobs[0].files_from is None:
+            return jobs
+
+        # Files and small directories directly in a split directory
+        # is divided between several jobs by name.
+        first = os.path.relpath(full_path, path).split(os.sep)[0]
+        return [j for j in jobs if first in j.files_from] or None
+
+    def handle(self, event):
+        now = timer()
+
+        if event.mask & inotify.IN_Q_OVERFLOW:
+            LOG.warning('inotify event queue overflowed, every shard '
+                        'will be run again')
+            self.full_sweep = True
+            self.resweep_at = now
+            return
+
+        dirpath = self.watches.get(event.wd, None)
+
+        if dirpath is None:
+            return
+
+        if event.mask & inotify.IN_IGNORED:
+            del self.watches[event.wd]
+            return
+
+        isdir = event.mask & inotify.IN_ISDIR
+
+        if isdir and event.mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+            self._watch_tree(os.path.join(dirpath, event.name))
+
+        jobs = self.shards_for(dirpath, event.name)
+
+        if jobs is not None and jobs[0].files_from is not None:
+            # Split directories is divided by name so changing which
+            # entries exists directly in them changes the shards.
+            split_dir = os.path.normpath(jobs[0].source)
+
+            if os.path.normpath(dirpath) == split_dir and event.name:
+                if event.mask & ENTRY_EVENTS:
+                    jobs = None
+
+        if jobs is None:
+            LOG.debug('no shard covers %s, jobs will be exploded '
+                      'again' % os.path.join(dirpath, event.name))
+            self.resweep_at = now
+            return
+
+        for job in jobs:
+            self._mark(job, now)
+
+    def _reap(self, forget=True):
+        for key, job_id in list(self.active.items()):
+            child = self.supervisor.children.get(job_id, None)
+
+            if child is not None and not child.ready():
+                continue
+
+            del self.active[key]
+
+            if child is None:
+                continue
+
+            self._report(child)
+
+            if forget:
+                self.supervisor.loop.call_soon_threadsafe(
+                    self.supervisor.forget, job_id)
+
+    def _report(self, child):
+        job = child.job
+
+        try:
+            result = child.get()
+        except Exception as exc:
+            LOG.error('job %s was not completed due to error: %s' % (
+                      job.id, six.text_type(exc)))
+            self.failed += 1
+            return
+
+        if not self.manager.allowed(job, result.returncode):
+            LOG.error('job %s %s -> %s failed with return code: %i '
+                      '(%i secs)' % (job.id, job.source, job.destination,
+                                     result.returncode, result.seconds))
+            self.failed += 1
+            return
+
+        LOG.info('job %s %s -> %s was successful with return code: %i '
+                 '(%i secs)' % (job.id, job.source, job.destination,
+                                result.returncode, result.seconds))
+
+        self.completed += 1
+        self.manager.scheduler.history.record(job.key, result.seconds)
+
+    def _flush(self, now):
+        jobs = []
+
+        for key, (shard, when) in list(self.dirty.items()):
+            if now - when < self.debounce:
+                continue
+
+            # Changes while the shard is running is picked up by
+            # running it again after it is done.
+            if key in self.active:
+                continue
+
+            del self.dirty[key]
+
+            if not os.path.isdir(shard.source):
+                # The shard is gone, the jobs needs to be exploded
+                # again to find out what replaced it.
+                self.resweep_at = now
+                continue
+
+            job = Job(shard.template, relpath=shard.relpath,
+                      files_from=shard.files_from, size=shard.size)
+            self.active[key] = job.id
+            jobs.append(job)
+
+        if not jobs:
+            return
+
+        failed = self.manager.planner.prepare(jobs)
+
+        for job in jobs:
+            if job in failed:
+                # Usually removed since it changed, exploding the jobs
+                # again finds out what replaced it.
+                del self.active[job.key]
+                self.resweep_at = now
+                self.failed += 1
+                continue
+
+            LOG.info('queueing changed shard as job %s %s -> %s' % (
+                     job.id, job.source, job.destination))
+
+            expected = self.manager.scheduler.expected_seconds(job)
+            job.find_devices()
+            yield job, job.command, expected
+
+    def _produce(self):
+        self._sweep(full=self.initial)
+
+        while not self.supervisor.stopping:
+            for event in self.inotify.read(TICK):
+                self.handle(event)
+
+            self._reap()
+
+            now = timer()
+
+            if self.sweep_interval > 0:
+                if now - self.last_sweep >= self.sweep_interval:
+                    self.full_sweep = True
+                    self.resweep_at = now - self.debounce
+
+            if self.resweep_at is not None:
+                if now - self.resweep_at >= self.debounce:
+                    self._sweep(full=self.full_sweep)
+
+            for item in self._flush(now):
+                yield item
+
+    def run(self):
+        self.inotify = inotify.Inotify()
+
+        LOG.info('watching sources for changes with a debounce of %i '
+                 'secs' % self.debounce)
+
+        try:
+            self.supervisor.run(self._produce())
+        finally:
+            self.inotify.close()
+
+        self._reap(forget=False)
+
+        LOG.info('stopped watching, %i jobs successful %i failed' % (
+                 self.completed, self.failed))